@@ -0,0 +1,167 @@
+"""
+Admission control for the Kibala publish endpoints.
+===================================================
+
+Without a limit, a burst of uploads makes every publish slow at once.
+The AdmissionController lets at most `max_in_flight` publishes run (from
+reading the upload to returning the signed image) and lines the rest up
+in a bounded first-come-first-served queue:
+
+  - a request arriving while the queue is full is shed at once
+    (QueueFull, answered 429);
+  - a request that waited `queue_timeout` seconds without being admitted
+    is shed too (QueueTimeout, answered 503);
+
+both with a Retry-After estimated from how long admitted publishes have
+recently taken, so clients back off instead of timing out.  Work the
+gateway has already accepted (async jobs, the files of a batch) is
+admitted `patient`ly: it goes through the same bounded queue, but may
+only take PATIENT_QUEUE_SHARE of it, and when shed it sleeps for the
+Retry-After and tries again instead of failing.  However many batch
+files and jobs are pending, the rest of the queue stays free for single
+publishes.
+
+Only used from the event loop, so no lock is needed.
+"""
+
+import asyncio
+import collections
+import contextlib
+import math
+import time
+
+from metrics import PUBLISH_ADMISSION_WAITING, PUBLISH_ADMITTED, PUBLISH_STAGE_SECONDS
+
+# Weight of the latest publish in the moving average behind Retry-After.
+HOLD_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 60
+# Part of the wait queue that patient requests (batch files, jobs) may fill.
+PATIENT_QUEUE_SHARE = 0.5
+
+
+class Overloaded(Exception):
+    """The request was shed; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    """The wait queue was full when the request arrived."""
+
+
+class QueueTimeout(Overloaded):
+    """The request was not admitted within the queue timeout."""
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, timed FIFO wait queue."""
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._patient: set[asyncio.Future] = set()
+        self.max_patient_queued = int(max_queued * PATIENT_QUEUE_SHARE)
+        self._hold_seconds = 1.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(not future.done() for future in self._waiters)
+
+    @property
+    def patient_waiting(self) -> int:
+        return sum(not future.done() for future in self._patient)
+
+    @property
+    def queue_full(self) -> bool:
+        return self.in_flight >= self.max_in_flight and self.waiting >= self.max_queued
+
+    @property
+    def retry_after(self) -> int:
+        """Seconds until a new request could be admitted, roughly."""
+        queued = self.waiting + 1
+        estimate = math.ceil(self._hold_seconds * queued / self.max_in_flight)
+        return max(1, min(MAX_RETRY_AFTER, estimate))
+
+    @contextlib.asynccontextmanager
+    async def admit(self, patient: bool = False):
+        """Hold one in-flight slot for the duration of the block.
+
+        The request is shed (Overloaded) when the queue is full or the
+        queue timeout passes; a `patient` one retries after the
+        Retry-After instead, for as long as it takes.
+        """
+        started = time.monotonic()
+        while True:
+            try:
+                await self._enter(patient)
+                break
+            except Overloaded as e:
+                if not patient:
+                    raise
+                await asyncio.sleep(e.retry_after)
+        admitted = time.monotonic()
+        PUBLISH_STAGE_SECONDS.labels("admission_wait").observe(admitted - started)
+        self._update_gauges()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - admitted
+            self._hold_seconds += HOLD_SMOOTHING * (held - self._hold_seconds)
+            self._release()
+
+    async def _enter(self, patient: bool) -> None:
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            return
+        if self.waiting >= self.max_queued or (
+            patient and self.patient_waiting >= self.max_patient_queued
+        ):
+            raise QueueFull(self.retry_after)
+        await self._wait(self.queue_timeout, patient)
+
+    async def _wait(self, timeout: float | None, patient: bool) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        if patient:
+            self._patient.add(future)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            raise QueueTimeout(self.retry_after) from None
+        except BaseException:
+            self._abandon(future)
+            raise
+        finally:
+            self._patient.discard(future)
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        if future.done() and not future.cancelled():
+            # Handed a slot just as the wait was given up.
+            self._release()
+            return
+        with contextlib.suppress(ValueError):
+            self._waiters.remove(future)
+        self._grant()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        while self._waiters and self.in_flight < self.max_in_flight:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        PUBLISH_ADMITTED.set(self.in_flight)
+        PUBLISH_ADMISSION_WAITING.set(self.waiting)
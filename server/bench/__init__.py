@@ -0,0 +1,7 @@
+"""
+Benchmarks for the Kibala server.
+
+Run from the server directory:
+
+  python -m bench.loadtest --help
+"""
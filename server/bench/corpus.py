@@ -0,0 +1,159 @@
+"""
+Synthetic C2PA image corpus for load tests.
+===========================================
+
+Builds device-signed JPEGs the way the iOS app does: a P-256 device key,
+a CSR sent to POST /api/v1/certificates/sign (see new_csr()), and a c2pa
+manifest signed with the returned chain.  Alongside the valid photos it builds uploads the
+gateway must turn away:
+
+  valid      signed by a Kibala device certificate          -> 200
+  unsigned   plain JPEG without a C2PA manifest             -> 400
+  wrong_ca   signed by a device of a foreign Root CA        -> 403
+  tampered   valid photo with altered image data            -> 403
+
+Every photo carries an EXIF Orientation tag, so the orientation handling
+is exercised too.
+"""
+
+import datetime
+import io
+import tempfile
+from typing import NamedTuple
+
+import c2pa
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from PIL import Image
+
+import generate_root_ca
+from issuer import Issuer
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+DEVICE_MANIFEST = {
+    "claim_generator": "kibala-bench/1.0",
+    "assertions": [
+        {
+            "label": "c2pa.actions",
+            "data": {
+                "actions": [
+                    {
+                        "action": "c2pa.created",
+                        "digitalSourceType": "http://cv.iptc.org/newscodes/digitalsourcetype/digitalCapture",
+                    }
+                ]
+            },
+        }
+    ],
+}
+
+EXPECTED_STATUS = {"valid": 200, "unsigned": 400, "wrong_ca": 403, "tampered": 403}
+
+
+class CorpusImage(NamedTuple):
+    name: str
+    kind: str
+    data: bytes
+
+    @property
+    def expected_status(self) -> int:
+        return EXPECTED_STATUS[self.kind]
+
+
+class Device(NamedTuple):
+    key: ec.EllipticCurvePrivateKey
+    chain_pem: str
+
+
+def new_csr(common_name: str = "Kibala Bench Device") -> tuple[ec.EllipticCurvePrivateKey, str]:
+    """A fresh device key and its PEM CSR."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    csr = (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)]))
+        .sign(key, hashes.SHA256())
+    )
+    return key, csr.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+
+def foreign_device() -> Device:
+    """A device certificate issued by a throwaway Root CA the server does not trust.
+
+    Issued through the server's own Issuer, so that only the trust anchor
+    differs.
+    """
+    with tempfile.TemporaryDirectory(prefix="kibala_bench_ca_") as ca_dir:
+        foreign_ca = Issuer(*generate_root_ca.generate(ca_dir, verbose=False))
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    cert = foreign_ca.issue(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Foreign Device")]),
+        key.public_key(),
+        datetime.timedelta(days=30),
+    )
+    return Device(key, foreign_ca.chain_pem(cert))
+
+
+def photo(size: tuple[int, int], orientation: int, quality: int = 90) -> bytes:
+    """A camera-like JPEG: noisy gradient content with an EXIF orientation."""
+    noise = Image.effect_noise(size, 40).convert("RGB")
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    img = Image.blend(noise, gradient, 0.6)
+
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = orientation
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def sign(data: bytes, device: Device) -> bytes:
+    """Embed a device-signed C2PA manifest, as the iOS app does."""
+    def sign_callback(payload: bytes) -> bytes:
+        return device.key.sign(payload, ec.ECDSA(hashes.SHA256()))
+
+    output = io.BytesIO()
+    with c2pa.Signer.from_callback(
+        sign_callback, c2pa.C2paSigningAlg.ES256, device.chain_pem,
+    ) as signer, c2pa.Builder(DEVICE_MANIFEST) as builder:
+        builder.sign(signer, "image/jpeg", io.BytesIO(data), output)
+    return output.getvalue()
+
+
+def tamper(data: bytes) -> bytes:
+    """Flip bytes in the entropy-coded image data after the manifest."""
+    sos = data.rfind(b"\xff\xda")
+    body = bytearray(data)
+    for offset in range(sos + 64, len(body) - 2, max(1, (len(body) - sos) // 16)):
+        if body[offset] not in (0x00, 0xFE, 0xFF) and body[offset - 1] != 0xFF:
+            body[offset] ^= 0x01
+    return bytes(body)
+
+
+def build_corpus(
+    device: Device,
+    sizes: list[tuple[int, int]],
+    orientations: list[int],
+    invalid: bool = True,
+) -> list[CorpusImage]:
+    """Valid photos for every size × orientation, plus one invalid image of
+    each kind per size when `invalid` is set.  `device` holds a certificate
+    issued by the server under test."""
+    foreign = foreign_device() if invalid else None
+
+    corpus = []
+    for width, height in sizes:
+        for orientation in orientations:
+            raw = photo((width, height), orientation)
+            name = f"{width}x{height}_o{orientation}"
+            corpus.append(CorpusImage(f"valid_{name}", "valid", sign(raw, device)))
+        if invalid:
+            raw = photo((width, height), orientations[0])
+            name = f"{width}x{height}"
+            corpus.append(CorpusImage(f"unsigned_{name}", "unsigned", raw))
+            corpus.append(CorpusImage(f"wrong_ca_{name}", "wrong_ca", sign(raw, foreign)))
+            corpus.append(CorpusImage(f"tampered_{name}", "tampered", tamper(sign(raw, device))))
+    return corpus
@@ -0,0 +1,384 @@
+"""
+Load test for the Kibala server.
+================================
+
+Drives POST /api/v1/certificates/sign and POST /api/v1/publish at a fixed
+concurrency and reports latency percentiles, throughput and server memory.
+
+Run from the server directory:
+
+  python -m bench.loadtest                          # spawn a localhost server
+  python -m bench.loadtest --in-process             # ASGI app in this process
+  python -m bench.loadtest --url http://host:8080   # an already running server
+
+A spawned or in-process server gets a throwaway Root CA (generate_root_ca
+into a temp dir, passed via KIBALA_CERT_DIR) and has the publish dedupe
+cache disabled unless --with-cache is given, so every upload runs the
+full pipeline.  Other KIBALA_* settings are taken from the environment.
+--server-workers N runs the spawned server with N worker processes, as
+`python server.py --workers N` does.
+
+The publish corpus (see corpus.py) is built first: valid photos at every
+--sizes × --orientations, plus unsigned, wrong-CA and tampered uploads
+mixed in at --invalid-ratio.  A response counts as ok when its status is
+the one expected for that kind of upload.
+
+RSS is read from /proc (Linux only) for the server process and its
+children; with --in-process it includes the load generator itself.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import generate_root_ca
+from bench import corpus
+
+DEFAULT_SIZES = "640x480,1920x1080,4032x3024"
+DEFAULT_ORIENTATIONS = "1,6,3,8"
+
+
+# --- Server under test ---
+
+
+@contextlib.asynccontextmanager
+async def spawned_server(app_path: str, env: dict, log_path: str | None, workers: int = 1):
+    """Run uvicorn in a child process on a free localhost port."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--workers", str(workers),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env}, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as probe:
+            for _ in range(300):
+                if proc.poll() is not None:
+                    raise RuntimeError(f"server exited with status {proc.returncode}")
+                with contextlib.suppress(httpx.TransportError):
+                    await probe.get("/metrics")
+                    break
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("server did not start within 30 s")
+        yield httpx.AsyncClient(base_url=base_url, timeout=120), proc.pid
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+
+@contextlib.asynccontextmanager
+async def in_process_server(app_path: str, env: dict):
+    """Import the ASGI app here and talk to it without a socket."""
+    os.environ.update(env)
+    module_name, _, attr = app_path.partition(":")
+    app = getattr(importlib.import_module(module_name), attr or "app")
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        yield httpx.AsyncClient(transport=transport, base_url="http://kibala", timeout=120), os.getpid()
+
+
+@contextlib.asynccontextmanager
+async def external_server(url: str):
+    yield httpx.AsyncClient(base_url=url, timeout=120), None
+
+
+def process_rss(pid: int | None) -> int | None:
+    """Resident set size of a process and its descendants, in bytes."""
+    if pid is None:
+        return None
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return total or None
+    return total
+
+
+# --- Load generation ---
+
+
+class Results:
+    """Latency samples of one scenario, grouped by request kind."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.samples: dict[str, list[float]] = {}
+        self.unexpected: dict[str, dict[int, int]] = {}
+        self.bytes_sent = 0
+        self.elapsed = 0.0
+
+    def record(self, kind: str, seconds: float, status: int, expected: int, sent: int) -> None:
+        self.samples.setdefault(kind, []).append(seconds)
+        self.bytes_sent += sent
+        if status != expected:
+            by_status = self.unexpected.setdefault(kind, {})
+            by_status[status] = by_status.get(status, 0) + 1
+
+    def summary(self) -> dict:
+        every = [s for samples in self.samples.values() for s in samples]
+        kinds = {kind: _latency_summary(samples) for kind, samples in sorted(self.samples.items())}
+        for kind, by_status in self.unexpected.items():
+            kinds[kind]["unexpected_status"] = by_status
+        return {
+            "scenario": self.name,
+            "requests": len(every),
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(len(every) / self.elapsed, 2) if self.elapsed else 0.0,
+            "upload_mib_s": round(self.bytes_sent / 2**20 / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency": _latency_summary(every),
+            "kinds": kinds,
+        }
+
+
+def _latency_summary(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        if not ordered:
+            return 0.0
+        rank = min(len(ordered), max(1, math.ceil(p / 100 * len(ordered)))) - 1
+        return round(ordered[rank] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+async def drive(results: Results, next_request, concurrency: int, duration: float, total: int | None):
+    """Keep `concurrency` requests in flight until the time or request budget runs out.
+
+    next_request() returns (kind, expected status, coroutine factory).
+    """
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            if total is not None and next(counter) >= total:
+                return
+            kind, expected, send = next_request()
+            start = time.perf_counter()
+            try:
+                status, sent = await send()
+            except httpx.HTTPError:
+                status, sent = 0, 0
+            results.record(kind, time.perf_counter() - start, status, expected, sent)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    results.elapsed = time.perf_counter() - start
+
+
+def publish_requests(client: httpx.AsyncClient, images: list[corpus.CorpusImage],
+                     invalid_ratio: float, rng: random.Random):
+    valid = [img for img in images if img.kind == "valid"]
+    invalid = [img for img in images if img.kind != "valid"]
+
+    def next_request():
+        pool = invalid if invalid and rng.random() < invalid_ratio else valid
+        img = rng.choice(pool)
+
+        async def send():
+            r = await client.post(
+                "/api/v1/publish", files={"file": (f"{img.name}.jpg", img.data, "image/jpeg")},
+            )
+            return r.status_code, len(img.data)
+
+        return img.kind, img.expected_status, send
+
+    return next_request
+
+
+def csr_requests(client: httpx.AsyncClient, pool_size: int):
+    """Cycle through pool_size CSRs.  The server signs each key once and
+    answers repeats from its issuance store, so those count as csr_retry."""
+    csrs = itertools.cycle(enumerate(corpus.new_csr()[1] for _ in range(pool_size)))
+    sent = set()
+
+    def next_request():
+        index, csr_pem = next(csrs)
+        kind = "csr_retry" if index in sent else "csr"
+        sent.add(index)
+        body = {"csr": csr_pem}
+
+        async def send():
+            r = await client.post("/api/v1/certificates/sign", json=body)
+            return r.status_code, len(body["csr"])
+
+        return kind, 200, send
+
+    return next_request
+
+
+async def enroll_device(client: httpx.AsyncClient) -> corpus.Device:
+    key, csr_pem = corpus.new_csr()
+    r = await client.post("/api/v1/certificates/sign", json={"csr": csr_pem})
+    r.raise_for_status()
+    return corpus.Device(key, r.json()["certificate_chain"])
+
+
+async def sample_rss(pid: int | None, peak: list[int], interval: float = 0.25):
+    while True:
+        rss = process_rss(pid)
+        if rss is not None:
+            peak[0] = max(peak[0], rss)
+        await asyncio.sleep(interval)
+
+
+# --- Main ---
+
+
+async def run(args) -> dict:
+    env = {}
+    ca_dir = None
+    if not args.url:
+        ca_dir = tempfile.TemporaryDirectory(prefix="kibala_bench_")
+        generate_root_ca.generate(ca_dir.name, verbose=False)
+        env["KIBALA_CERT_DIR"] = ca_dir.name
+        if not args.with_cache:
+            env["KIBALA_PUBLISH_CACHE_ENTRIES"] = "0"
+        if args.server_workers > 1:
+            env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(ca_dir.name, "metrics")
+            os.mkdir(env["PROMETHEUS_MULTIPROC_DIR"])
+
+    if args.url:
+        target = external_server(args.url)
+    elif args.in_process:
+        target = in_process_server(args.app, env)
+    else:
+        target = spawned_server(args.app, env, args.server_log, args.server_workers)
+
+    report = {"target": args.url or ("in-process" if args.in_process else "localhost"),
+              "concurrency": args.concurrency, "scenarios": []}
+    try:
+        async with target as (client, pid):
+            async with client:
+                rss_start = process_rss(pid)
+                print(f"Building corpus ({args.sizes}, orientations {args.orientations})...",
+                      file=sys.stderr)
+                device = await enroll_device(client)
+                images = await asyncio.to_thread(
+                    corpus.build_corpus, device,
+                    [tuple(int(n) for n in size.split("x")) for size in args.sizes.split(",")],
+                    [int(o) for o in args.orientations.split(",")],
+                    args.invalid_ratio > 0,
+                )
+                report["corpus"] = {img.name: len(img.data) for img in images}
+
+                rng = random.Random(args.seed)
+                peak = [rss_start or 0]
+                sampler = asyncio.create_task(sample_rss(pid, peak))
+                try:
+                    for scenario in args.scenario.split(","):
+                        if scenario == "publish":
+                            next_request = publish_requests(client, images, args.invalid_ratio, rng)
+                        elif scenario == "csr":
+                            next_request = csr_requests(client, args.csr_pool)
+                        else:
+                            raise SystemExit(f"unknown scenario: {scenario}")
+                        print(f"Running {scenario} for {args.duration:g}s at concurrency "
+                              f"{args.concurrency}...", file=sys.stderr)
+                        results = Results(scenario)
+                        await drive(results, next_request, args.concurrency, args.duration, args.requests)
+                        report["scenarios"].append(results.summary())
+                finally:
+                    sampler.cancel()
+                report["rss_mib"] = {
+                    "start": _mib(rss_start),
+                    "peak": _mib(peak[0] or None),
+                    "end": _mib(process_rss(pid)),
+                }
+    finally:
+        if ca_dir is not None:
+            ca_dir.cleanup()
+    return report
+
+
+def _mib(value: int | None) -> float | None:
+    return round(value / 2**20, 1) if value else None
+
+
+def print_report(report: dict) -> None:
+    print(f"\nTarget: {report['target']}   concurrency: {report['concurrency']}")
+    rss = report["rss_mib"]
+    print(f"Server RSS (MiB): start {rss['start']}  peak {rss['peak']}  end {rss['end']}")
+    for s in report["scenarios"]:
+        print(f"\n{s['scenario']}: {s['requests']} requests in {s['elapsed_s']}s  "
+              f"{s['throughput_rps']} req/s  {s['upload_mib_s']} MiB/s uploaded")
+        print(f"  {'kind':<10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  unexpected")
+        for kind, lat in [("all", s["latency"]), *s["kinds"].items()]:
+            unexpected = lat.get("unexpected_status", "")
+            print(f"  {kind:<10} {lat['count']:>7} {lat['p50_ms']:>9} {lat['p95_ms']:>9} "
+                  f"{lat['p99_ms']:>9} {lat['max_ms']:>9}  {unexpected}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument("--url", help="benchmark an already running server")
+    where.add_argument("--in-process", action="store_true", help="run the app in this process")
+    parser.add_argument("--app", default="server:app", help="ASGI app to serve (default server:app)")
+    parser.add_argument("--server-log", help="write the spawned server's output here")
+    parser.add_argument("--server-workers", type=int, default=1,
+                        help="server processes of the spawned server (default 1)")
+    parser.add_argument("--scenario", default="csr,publish",
+                        help="comma-separated: csr, publish (default csr,publish)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-d", "--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("-n", "--requests", type=int, help="stop each scenario after this many requests")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"WxH list (default {DEFAULT_SIZES})")
+    parser.add_argument("--orientations", default=DEFAULT_ORIENTATIONS,
+                        help=f"EXIF orientations (default {DEFAULT_ORIENTATIONS})")
+    parser.add_argument("--invalid-ratio", type=float, default=0.2,
+                        help="share of publish uploads that must be rejected (default 0.2)")
+    parser.add_argument("--csr-pool", type=int, default=64,
+                        help="distinct device keys to cycle through (default 64)")
+    parser.add_argument("--with-cache", action="store_true",
+                        help="keep the publish dedupe cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
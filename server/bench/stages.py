@@ -0,0 +1,316 @@
+"""
+Per-stage microbenchmarks for the publish pipeline.
+===================================================
+
+Times each stage of server._publish_pipeline on its own, against fixed
+fixture images, and writes the results as JSON so runs can be compared
+across commits:
+
+  python -m bench.stages run --out before.json
+  ...change something...
+  python -m bench.stages run --out after.json
+  python -m bench.stages compare before.json after.json --threshold 0.10
+
+compare exits with status 1 when any stage's median got slower by more
+than the threshold (10 % by default).
+
+Stages:
+  read_validate    c2pa.Reader + JSON parse of the device manifest
+  validate_known   the same for a claim signature the validation cache
+                   already trusts (no trust-anchor check)
+  strip            segment-level metadata strip (jpeg_markers)
+  orient_lossless  jpegtran rotation (only when jpegtran is available)
+  orient_pillow    Pillow decode + transpose of the stripped image
+  encode           Pillow JPEG encode at quality 100
+  c2pa_sign        Builder.sign() of the clean image with the gateway signer
+  sign_callback    ECDSA P-256 sign of a 4 KiB claim (the gateway signer's callback)
+  pipeline         the whole _publish_pipeline
+
+Fixtures are photos with deterministic pixel content at each --sizes,
+EXIF-rotated (orientation 6) and signed by a device certificate the
+server issued.  They and their throwaway Root CA are generated into
+--fixtures (a temp dir by default); pass the same directory again to
+reuse exactly the same bytes.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import c2pa
+import PIL
+from PIL import Image
+
+import generate_root_ca
+import manifest_report
+from bench import corpus
+from jpeg_markers import lossless_orient, strip_metadata
+
+DEFAULT_SIZES = "1024x768,4032x3024"
+FIXTURE_ORIENTATION = 6
+CLAIM_SIZE = 4096
+
+
+# --- Fixtures ---
+
+
+def fixture_photo(size: tuple[int, int], seed: int) -> bytes:
+    """Deterministic camera-like JPEG content with an EXIF orientation."""
+    tile = Image.frombytes("RGB", (256, 256), random.Random(seed).randbytes(256 * 256 * 3))
+    noise = tile.resize(size, Image.Resampling.NEAREST)
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    img = Image.blend(noise, gradient, 0.6)
+
+    exif = Image.Exif()
+    exif[corpus.EXIF_ORIENTATION_TAG] = FIXTURE_ORIENTATION
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=90, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def load_server(fixtures_dir: str):
+    """Import server.py against the fixtures' Root CA, creating it if needed."""
+    cert_dir = os.path.join(fixtures_dir, "cert_key")
+    if not os.path.exists(os.path.join(cert_dir, generate_root_ca.CERT_NAME)):
+        generate_root_ca.generate(cert_dir, verbose=False)
+    os.environ["KIBALA_CERT_DIR"] = cert_dir
+    os.environ.setdefault("KIBALA_LOG_LEVEL", "WARNING")
+    with contextlib.redirect_stdout(sys.stderr):
+        import server
+        server.load_key_material()
+    return server
+
+
+async def issue_device(server) -> corpus.Device:
+    """A device certificate from the server's own sign_csr."""
+    key, csr_pem = corpus.new_csr()
+    with contextlib.redirect_stdout(sys.stderr):
+        async with server.app.router.lifespan_context(server.app):
+            issued = await server.sign_csr(server.SigningRequest(csr=csr_pem))
+    return corpus.Device(key, issued.certificate_chain)
+
+
+def load_fixtures(server, fixtures_dir: str, sizes: list[tuple[int, int]]) -> dict[str, bytes]:
+    """name -> device-signed JPEG, generated on first use."""
+    device = None
+    fixtures = {}
+    for seed, (width, height) in enumerate(sizes):
+        name = f"{width}x{height}"
+        path = os.path.join(fixtures_dir, f"{name}.jpg")
+        if not os.path.exists(path):
+            if device is None:
+                device = asyncio.run(issue_device(server))
+            with open(path, "wb") as f:
+                f.write(corpus.sign(fixture_photo((width, height), seed), device))
+        with open(path, "rb") as f:
+            fixtures[name] = f.read()
+    return fixtures
+
+
+# --- Stages ---
+
+
+def _pillow_orient(server, stripped: bytes, orientation: int) -> Image.Image:
+    """The publish pipeline's re-encode fallback, up to the encode."""
+    img = Image.open(io.BytesIO(stripped))
+    if orientation != 1:
+        img = img.transpose(server.ORIENTATION_TRANSPOSE[orientation])
+    img.load()
+    return img
+
+
+def stage_setups(server, content: bytes) -> dict:
+    """stage name -> zero-argument callable timing that stage on `content`."""
+    stripped, orientation = strip_metadata(content)
+    signer = server.signer_of(server._manifest_store_of(content))
+    transposed = _pillow_orient(server, stripped, orientation)
+    upright = io.BytesIO()
+    transposed.save(upright, format="JPEG", quality=100)
+    upright = upright.getvalue()
+    manifest_json = server.manifest_templates["default"].render(
+        when=datetime.datetime.now(datetime.UTC).isoformat() + "Z"
+    )
+    claim = random.Random(0).randbytes(CLAIM_SIZE)
+
+    def read_validate():
+        with c2pa.Reader("image/jpeg", io.BytesIO(content)) as reader:
+            summary = manifest_report.summarize(reader.json())
+        if summary.validation_status is not None:
+            raise RuntimeError(f"fixture does not validate: {summary.validation_status}")
+
+    def validate_known():
+        with c2pa.Reader(
+            "image/jpeg", io.BytesIO(content), context=server._known_signer_context(),
+        ) as reader:
+            summary = manifest_report.summarize(reader.json())
+        if summary.validation_status is not None:
+            raise RuntimeError(f"fixture does not validate: {summary.validation_status}")
+
+    def strip():
+        strip_metadata(content)
+
+    def orient_lossless():
+        lossless_orient(stripped, orientation, server.JPEGTRAN, trim=server.ORIENT_TRIM_EDGES)
+
+    def orient_pillow():
+        _pillow_orient(server, stripped, orientation)
+
+    def encode():
+        transposed.save(io.BytesIO(), format="JPEG", quality=100)
+
+    def c2pa_sign():
+        with c2pa.Builder(manifest_json) as builder:
+            builder.sign(server.gateway_signer(), "image/jpeg", io.BytesIO(upright), io.BytesIO())
+
+    def sign_callback():
+        server.gateway_identity.current().sign(claim)
+
+    def pipeline():
+        server._publish_pipeline(content, manifest_json, signer=signer)
+
+    stages = {
+        "read_validate": read_validate,
+        "validate_known": validate_known,
+        "strip": strip,
+        "orient_lossless": orient_lossless,
+        "orient_pillow": orient_pillow,
+        "encode": encode,
+        "c2pa_sign": c2pa_sign,
+        "sign_callback": sign_callback,
+        "pipeline": pipeline,
+    }
+    if not server.JPEGTRAN:
+        del stages["orient_lossless"]
+    return stages
+
+
+def measure(fn, min_time: float, min_rounds: int, warmup: int = 2) -> dict:
+    """Call fn until both min_time seconds and min_rounds calls have passed."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_rounds or time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {
+        "rounds": len(samples),
+        "median_ms": round(statistics.median(samples) * 1000, 4),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "min_ms": round(samples[0] * 1000, 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+        "stdev_ms": round(statistics.stdev(samples) * 1000, 4) if len(samples) > 1 else 0.0,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "c2pa": getattr(c2pa, "__version__", None),
+        "pillow": PIL.__version__,
+    }
+
+
+def run(args) -> dict:
+    fixtures_dir = args.fixtures or tempfile.mkdtemp(prefix="kibala_stage_fixtures_")
+    os.makedirs(fixtures_dir, exist_ok=True)
+    server = load_server(fixtures_dir)
+    server._init_publish_worker(False)
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.sizes.split(",")]
+    fixtures = load_fixtures(server, fixtures_dir, sizes)
+    selected = set(args.stages.split(",")) if args.stages else None
+
+    results = {}
+    for fixture, content in fixtures.items():
+        for stage, fn in stage_setups(server, content).items():
+            if selected and stage not in selected:
+                continue
+            key = f"{stage}/{fixture}"
+            results[key] = {"bytes": len(content), **measure(fn, args.min_time, args.min_rounds)}
+            print(f"  {key:<28} median {results[key]['median_ms']:>10.3f} ms  "
+                  f"({results[key]['rounds']} rounds)", file=sys.stderr)
+    return {"environment": environment(), "fixtures_dir": fixtures_dir, "results": results}
+
+
+def compare(base: dict, new: dict, threshold: float) -> bool:
+    """Print the median change per stage; True when nothing regressed."""
+    ok = True
+    print(f"{'stage/fixture':<28} {'base ms':>11} {'new ms':>11} {'change':>9}")
+    for key in sorted(set(base["results"]) | set(new["results"])):
+        before = base["results"].get(key, {}).get("median_ms")
+        after = new["results"].get(key, {}).get("median_ms")
+        if before is None or after is None:
+            print(f"{key:<28} {before or '-':>11} {after or '-':>11} {'n/a':>9}")
+            continue
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{key:<28} {before:>11.3f} {after:>11.3f} {change:>+8.1%}{flag}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark every stage")
+    run_parser.add_argument("--out", help="write the JSON results here (default: stdout)")
+    run_parser.add_argument("--fixtures", help="fixture directory to create or reuse")
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"WxH list (default {DEFAULT_SIZES})")
+    run_parser.add_argument("--stages", help="comma-separated subset of stages")
+    run_parser.add_argument("--min-time", type=float, default=1.0, help="seconds per stage (default 1)")
+    run_parser.add_argument("--min-rounds", type=int, default=5, help="calls per stage (default 5)")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="allowed median slowdown, as a fraction (default 0.10)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        report = run(args)
+        payload = json.dumps(report, indent=2)
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(payload + "\n")
+        else:
+            print(payload)
+        return
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if not compare(base, new, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
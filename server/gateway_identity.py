@@ -0,0 +1,197 @@
+"""
+Persistent gateway signing identity for the Kibala privacy gateway.
+===================================================================
+
+The gateway re-signs every published photo with its own end-entity
+certificate, issued by the Kibala Root CA.  The key and certificate are
+kept next to the Root CA:
+
+  cert_key/kibala_Gateway.crt   gateway certificate (PEM)
+  cert_key/kibala_Gateway.pem   gateway private key (PEM, UNENCRYPTED)
+
+so restarts and every worker process sign with the same identity, and
+startup is a file read instead of key generation plus certificate
+signing.  A new pair is issued when the files are missing, were not
+issued by the current Root CA, or are within the renewal window of
+not_valid_after.  Issuing happens under an exclusive file lock, so when
+several workers start (or renew) at once only one of them writes and the
+others load its result.
+
+GatewayIdentityStore re-checks the files about once a minute: workers pick
+up a pair renewed by another process when the certificate file changes,
+and renew it themselves once it is due.
+"""
+
+import contextlib
+import datetime
+import os
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from issuer import Issuer
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+CERT_NAME = "kibala_Gateway.crt"
+KEY_NAME = "kibala_Gateway.pem"
+LOCK_NAME = ".kibala_Gateway.lock"
+
+SUBJECT = x509.Name([
+    x509.NameAttribute(NameOID.COMMON_NAME, "imanmontajabi.com Gateway"),
+    x509.NameAttribute(NameOID.ORGANIZATION_NAME, "imanmontajabi"),
+    x509.NameAttribute(NameOID.COUNTRY_NAME, "DE"),
+])
+
+
+class GatewayIdentity(NamedTuple):
+    key: ec.EllipticCurvePrivateKey
+    cert: x509.Certificate
+    chain_pem: str  # gateway certificate, then the Root CA
+
+    def sign(self, data: bytes) -> bytes:
+        """Sign data with the gateway's EC P-256 private key (ES256)."""
+        return self.key.sign(data, ec.ECDSA(hashes.SHA256()))
+
+
+def load_or_issue(
+    cert_dir: str,
+    issuer: Issuer,
+    validity: datetime.timedelta,
+    renew_before: datetime.timedelta,
+) -> tuple[GatewayIdentity, bool]:
+    """Return (identity, freshly issued) for the pair in `cert_dir`."""
+    with _exclusive_lock(os.path.join(cert_dir, LOCK_NAME)):
+        identity = _load(cert_dir, issuer, renew_before)
+        if identity is not None:
+            return identity, False
+        identity = _issue(issuer, validity)
+        _write(cert_dir, identity)
+        return identity, True
+
+
+class GatewayIdentityStore:
+    """The current gateway identity, re-checked at most every `check_interval` s."""
+
+    def __init__(
+        self,
+        cert_dir: str,
+        issuer: Issuer,
+        validity: datetime.timedelta,
+        renew_before: datetime.timedelta,
+        check_interval: float = 60.0,
+    ):
+        self.cert_dir = cert_dir
+        self._issuer = issuer
+        self._validity = validity
+        self._renew_before = renew_before
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self.identity, self.issued = load_or_issue(cert_dir, issuer, validity, renew_before)
+        self._mtime = self._cert_mtime()
+        self._checked_at = time.monotonic()
+
+    def current(self) -> GatewayIdentity:
+        if time.monotonic() - self._checked_at < self._check_interval:
+            return self.identity
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self._check_interval:
+                self._refresh()
+        return self.identity
+
+    def _refresh(self) -> None:
+        self._checked_at = time.monotonic()
+        due = _renewal_due(self.identity.cert, self._renew_before)
+        if due or self._cert_mtime() != self._mtime:
+            self.identity, self.issued = load_or_issue(
+                self.cert_dir, self._issuer, self._validity, self._renew_before,
+            )
+            self._mtime = self._cert_mtime()
+
+    def _cert_mtime(self) -> int | None:
+        try:
+            return os.stat(os.path.join(self.cert_dir, CERT_NAME)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+def _renewal_due(cert: x509.Certificate, renew_before: datetime.timedelta) -> bool:
+    return cert.not_valid_after_utc - datetime.datetime.now(datetime.UTC) <= renew_before
+
+
+def _load(cert_dir: str, issuer: Issuer, renew_before) -> GatewayIdentity | None:
+    """The stored pair, or None if it is missing, foreign, mismatched or due."""
+    try:
+        with open(os.path.join(cert_dir, CERT_NAME), "rb") as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+        with open(os.path.join(cert_dir, KEY_NAME), "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), password=None)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    try:
+        cert.verify_directly_issued_by(issuer.root_cert)
+    except (InvalidSignature, ValueError, TypeError):
+        return None
+    if not isinstance(key, ec.EllipticCurvePrivateKey) or key.public_key() != cert.public_key():
+        return None
+    if _renewal_due(cert, renew_before):
+        return None
+    return GatewayIdentity(key, cert, issuer.chain_pem(cert))
+
+
+def _issue(issuer: Issuer, validity: datetime.timedelta) -> GatewayIdentity:
+    key = ec.generate_private_key(ec.SECP256R1())
+    cert = issuer.issue(SUBJECT, key.public_key(), validity)
+    return GatewayIdentity(key, cert, issuer.chain_pem(cert))
+
+
+def _write(cert_dir: str, identity: GatewayIdentity) -> None:
+    """Replace both files atomically (caller holds the lock).  A crash
+    between the two leaves a mismatched pair, which _load() rejects."""
+    key_pem = identity.key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    _atomic_write(os.path.join(cert_dir, KEY_NAME), key_pem, mode=0o600)
+    _atomic_write(
+        os.path.join(cert_dir, CERT_NAME),
+        identity.cert.public_bytes(serialization.Encoding.PEM),
+    )
+
+
+def _atomic_write(path: str, data: bytes, mode: int = 0o644) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def _exclusive_lock(path: str):
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
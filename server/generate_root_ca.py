@@ -13,9 +13,15 @@ Run this script ONCE to create:
   - cert_key/kibala_Root_Key.pem (PEM-encoded root private key, UNENCRYPTED)
 
 Then restart your FastAPI server.
+
+Pass a directory to write the pair somewhere else (e.g. for a throwaway
+benchmark CA) and point the server at it with KIBALA_CERT_DIR:
+
+  python generate_root_ca.py /tmp/kibala_bench_ca
 """
 
 import os
+import sys
 import datetime
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
@@ -23,14 +29,19 @@ from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.x509.oid import NameOID
 
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cert_key")
-CERT_PATH = os.path.join(OUTPUT_DIR, "kibala_Root_CA.crt")
-KEY_PATH = os.path.join(OUTPUT_DIR, "kibala_Root_Key.pem")
+CERT_NAME = "kibala_Root_CA.crt"
+KEY_NAME = "kibala_Root_Key.pem"
+CERT_PATH = os.path.join(OUTPUT_DIR, CERT_NAME)
+KEY_PATH = os.path.join(OUTPUT_DIR, KEY_NAME)
 
 VALIDITY_DAYS = 3650  # 10 years
 
 
-def generate():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+def generate(output_dir: str = OUTPUT_DIR, verbose: bool = True):
+    """Create the Root CA pair in `output_dir`; returns (certificate, key)."""
+    cert_path = os.path.join(output_dir, CERT_NAME)
+    key_path = os.path.join(output_dir, KEY_NAME)
+    os.makedirs(output_dir, exist_ok=True)
 
     # Generate an EC P-256 private key (matches ES256 / Secure Enclave)
     root_key = ec.generate_private_key(ec.SECP256R1())
@@ -84,7 +95,7 @@ def generate():
     )
 
     # Write private key (unencrypted - for development only!)
-    with open(KEY_PATH, "wb") as f:
+    with open(key_path, "wb") as f:
         f.write(
             root_key.private_bytes(
                 encoding=serialization.Encoding.PEM,
@@ -92,12 +103,16 @@ def generate():
                 encryption_algorithm=serialization.NoEncryption(),
             )
         )
-    print(f"✅ Root CA private key written to: {KEY_PATH}")
 
     # Write certificate
-    with open(CERT_PATH, "wb") as f:
+    with open(cert_path, "wb") as f:
         f.write(root_cert.public_bytes(serialization.Encoding.PEM))
-    print(f"✅ Root CA certificate written to: {CERT_PATH}")
+
+    if not verbose:
+        return root_cert, root_key
+
+    print(f"✅ Root CA private key written to: {key_path}")
+    print(f"✅ Root CA certificate written to: {cert_path}")
 
     # Print summary
     print(f"\n📜 Subject: {root_cert.subject}")
@@ -106,7 +121,8 @@ def generate():
     print(f"🔑 Key type: EC P-256 (matches Secure Enclave ES256)")
     print(f"\n⚠️  Now restart your FastAPI server so it loads the new Root CA.")
     print(f"⚠️  In the iOS app, tap 'Reset Keys' to clear the old cached certificate.")
+    return root_cert, root_key
 
 
 if __name__ == "__main__":
-    generate()
+    generate(*sys.argv[1:2])
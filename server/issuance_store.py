@@ -0,0 +1,379 @@
+"""
+Certificate issuance store for the Kibala CA.
+=============================================
+
+Every device certificate issued by POST /api/v1/certificates/sign is
+recorded in a SQLite database: serial, certificate id, subject, Subject
+Key Identifier, the issuing Root CA's key identifier (AKI), the client's
+"device" metadata, validity and the DER encoding.  It is the record that revocation, audits and idempotent
+re-issue work from.
+
+Lookups by serial, certificate id, SKI and device use B-tree indexes, so
+they stay O(log n) as the fleet grows.  Writes are behind the request:
+record() only queues the row, and a writer thread commits queued rows in
+batches (one transaction per KIBALA_ISSUANCE_BATCH rows or 50 ms), so
+issuance latency does not depend on the disk.  flush() waits for
+everything queued so far to be committed.  A batch that fails to commit
+(disk full, database locked past the busy timeout) is not dropped: its
+rows stay visible to find_current() and are retried with the next batch,
+backing off from RETRY_MIN to RETRY_MAX seconds while the failure lasts,
+and kibala_issuance_unwritten_rows shows how many are waiting.
+
+find_current() is the lookup behind idempotent re-issue: it also sees
+certificates still waiting for the writer, so a client retrying right
+after its first request gets the same certificate back.  It only returns
+certificates of the given issuer, so after a Root CA rotation devices
+re-enrolling get a certificate from the new root.
+
+revoke() notifies the callbacks registered with on_revoke() in this
+process; revocations made by other processes (another server worker, an
+admin script) are found with revoked_since().
+
+The database runs in WAL mode, so several server workers can share one
+file: readers never block the writer, and writers wait for each other
+(busy timeout) instead of failing.
+"""
+
+import datetime
+import json
+import queue
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from metrics import ISSUANCE_UNWRITTEN_ROWS, ISSUANCE_WRITE_ERRORS
+from structured_log import get_logger
+
+log = get_logger("issuance")
+
+# Seconds before retrying a batch that failed to commit, doubling per failure.
+RETRY_MIN = 0.5
+RETRY_MAX = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    serial            TEXT PRIMARY KEY,
+    certificate_id    TEXT NOT NULL UNIQUE,
+    subject           TEXT NOT NULL,
+    ski               BLOB NOT NULL,
+    device            TEXT,
+    metadata          TEXT,
+    issued_at         TEXT NOT NULL,
+    not_valid_after   TEXT NOT NULL,
+    der               BLOB NOT NULL,
+    revoked_at        TEXT,
+    revocation_reason TEXT,
+    aki               BLOB
+);
+CREATE INDEX IF NOT EXISTS certificates_ski ON certificates (ski, not_valid_after);
+CREATE INDEX IF NOT EXISTS certificates_device ON certificates (device, issued_at);
+CREATE INDEX IF NOT EXISTS certificates_revoked ON certificates (revoked_at)
+    WHERE revoked_at IS NOT NULL;
+"""
+
+COLUMNS = (
+    "serial, certificate_id, subject, ski, device, metadata, "
+    "issued_at, not_valid_after, der, revoked_at, revocation_reason, aki"
+)
+
+
+class IssuedCertificate(NamedTuple):
+    serial: str  # decimal, as returned to the client
+    certificate_id: str
+    subject: str  # RFC 4514
+    ski: bytes
+    device: str | None
+    metadata: dict | None
+    issued_at: datetime.datetime
+    not_valid_after: datetime.datetime
+    der: bytes
+    revoked_at: datetime.datetime | None = None
+    revocation_reason: str | None = None
+    aki: bytes | None = None  # key identifier of the issuing CA
+
+    @classmethod
+    def from_certificate(
+        cls, certificate: x509.Certificate, certificate_id: str, metadata: dict | None = None,
+    ) -> "IssuedCertificate":
+        ski = certificate.extensions.get_extension_for_class(x509.SubjectKeyIdentifier)
+        try:
+            aki = certificate.extensions.get_extension_for_class(
+                x509.AuthorityKeyIdentifier
+            ).value.key_identifier
+        except x509.ExtensionNotFound:
+            aki = None
+        device = (metadata or {}).get("device")
+        return cls(
+            serial=str(certificate.serial_number),
+            certificate_id=certificate_id,
+            subject=certificate.subject.rfc4514_string(),
+            ski=ski.value.digest,
+            device=str(device) if device is not None else None,
+            metadata=metadata,
+            issued_at=datetime.datetime.now(datetime.UTC),
+            not_valid_after=certificate.not_valid_after_utc,
+            der=certificate.public_bytes(serialization.Encoding.DER),
+            aki=aki,
+        )
+
+    @property
+    def certificate(self) -> x509.Certificate:
+        return x509.load_der_x509_certificate(self.der)
+
+    def _row(self) -> tuple:
+        return (
+            self.serial, self.certificate_id, self.subject, self.ski, self.device,
+            json.dumps(self.metadata) if self.metadata is not None else None,
+            _timestamp(self.issued_at), _timestamp(self.not_valid_after), self.der,
+            _timestamp(self.revoked_at), self.revocation_reason, self.aki,
+        )
+
+    @classmethod
+    def _from_row(cls, row: tuple) -> "IssuedCertificate":
+        (serial, certificate_id, subject, ski, device, metadata,
+         issued_at, not_valid_after, der, revoked_at, revocation_reason, aki) = row
+        return cls(
+            serial, certificate_id, subject, bytes(ski), device,
+            json.loads(metadata) if metadata is not None else None,
+            _datetime(issued_at), _datetime(not_valid_after), bytes(der),
+            _datetime(revoked_at), revocation_reason,
+            bytes(aki) if aki is not None else None,
+        )
+
+
+class IssuanceStore:
+    """SQLite record of issued certificates with a batched background writer."""
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        # ski -> latest recorded entry not yet committed by the writer
+        self._pending: dict[bytes, IssuedCertificate] = {}
+        self._pending_lock = threading.Lock()
+        self._revoke_callbacks = []
+        # rows of failed batches, waiting for a retry (writer thread only)
+        self._unwritten = 0
+        # IssuedCertificate rows, threading.Event flush markers, None to stop
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+
+        self._migrate(self._connect())
+        self._writer = threading.Thread(
+            target=self._write_loop, name="kibala-issuance-writer", daemon=True,
+        )
+        self._writer.start()
+
+    # --- writes ---
+
+    def record(
+        self, certificate: x509.Certificate, certificate_id: str, metadata: dict | None = None,
+    ) -> IssuedCertificate:
+        """Queue a freshly issued certificate; returns the row as stored."""
+        entry = IssuedCertificate.from_certificate(certificate, certificate_id, metadata)
+        with self._pending_lock:
+            self._pending[entry.ski] = entry
+        self._queue.put(entry)
+        return entry
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every row queued so far is committed; False if that
+        timed out or some rows failed to commit and await a retry."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout) and not self._unwritten
+
+    def close(self) -> None:
+        """Commit what is queued and stop the writer thread."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def revoke(self, serial: str, reason: str | None = None) -> bool:
+        """Mark a certificate revoked; False if unknown or already revoked."""
+        self.flush()
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE certificates SET revoked_at = ?, revocation_reason = ? "
+                "WHERE serial = ? AND revoked_at IS NULL",
+                (_timestamp(datetime.datetime.now(datetime.UTC)), reason, serial),
+            )
+        if cursor.rowcount != 1:
+            return False
+        entry = self.get(serial)
+        for callback in self._revoke_callbacks:
+            callback(entry)
+        return True
+
+    def on_revoke(self, callback) -> None:
+        """Call callback(IssuedCertificate) after each revoke() in this process."""
+        self._revoke_callbacks.append(callback)
+
+    # --- lookups ---
+
+    def get(self, serial: str) -> IssuedCertificate | None:
+        return self._one("serial = ?", (serial,))
+
+    def get_by_certificate_id(self, certificate_id: str) -> IssuedCertificate | None:
+        return self._one("certificate_id = ?", (certificate_id,))
+
+    def find_by_ski(self, ski: bytes) -> list[IssuedCertificate]:
+        """Certificates issued for one public key, latest expiry first."""
+        return self._all("ski = ? ORDER BY not_valid_after DESC", (ski,))
+
+    def find_by_device(self, device: str, limit: int = 100) -> list[IssuedCertificate]:
+        """Certificates issued to devices reporting this "device" metadata, newest first."""
+        return self._all("device = ? ORDER BY issued_at DESC LIMIT ?", (device, limit))
+
+    def find_current(
+        self, ski: bytes, subject: str, aki: bytes, valid_past: datetime.datetime,
+    ) -> IssuedCertificate | None:
+        """The unrevoked certificate for this key and subject, issued by the
+        CA with key identifier `aki`, that expires last, if it is still
+        valid after `valid_past`."""
+        with self._pending_lock:
+            entry = self._pending.get(ski)
+        if (
+            entry is not None
+            and entry.subject == subject
+            and entry.aki == aki
+            and entry.not_valid_after > valid_past
+        ):
+            return entry
+        return self._one(
+            "ski = ? AND subject = ? AND aki = ? AND revoked_at IS NULL "
+            "AND not_valid_after > ? ORDER BY not_valid_after DESC LIMIT 1",
+            (ski, subject, aki, _timestamp(valid_past)),
+        )
+
+    def revoked_since(self, since: datetime.datetime) -> list[IssuedCertificate]:
+        """Certificates revoked after `since`, oldest revocation first."""
+        return self._all(
+            "revoked_at > ? ORDER BY revoked_at", (_timestamp(since),),
+        )
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM certificates").fetchone()[0]
+
+    def _one(self, where: str, params: tuple) -> IssuedCertificate | None:
+        row = self._connect().execute(
+            f"SELECT {COLUMNS} FROM certificates WHERE {where}", params,
+        ).fetchone()
+        return IssuedCertificate._from_row(row) if row is not None else None
+
+    def _all(self, where: str, params: tuple) -> list[IssuedCertificate]:
+        rows = self._connect().execute(
+            f"SELECT {COLUMNS} FROM certificates WHERE {where}", params,
+        ).fetchall()
+        return [IssuedCertificate._from_row(row) for row in rows]
+
+    # --- internals ---
+
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection (sqlite3 connections are per thread)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(certificates)")}
+        if "aki" in columns:
+            return
+        # Databases from before the issuer was recorded; their rows keep a
+        # NULL aki, so find_current() never reuses them.
+        try:
+            conn.execute("ALTER TABLE certificates ADD COLUMN aki BLOB")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e):  # another worker got there first
+                raise
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        # Rows of a batch that failed to commit are carried into the next
+        # one, which is not written before `backoff` seconds have passed.
+        batch: list[IssuedCertificate] = []
+        backoff = 0.0
+        while not stopping:
+            flushed = []
+            due = time.monotonic() + backoff if batch else None
+            while True:
+                if flushed:
+                    # Markers and the stop request don't wait for the window.
+                    timeout = 0.0
+                else:
+                    timeout = None if due is None else max(0.0, due - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    flushed.append(item)
+                else:
+                    batch.append(item)
+                    if due is None:
+                        due = time.monotonic() + self.flush_interval
+                if stopping or len(batch) >= self.batch_size:
+                    break
+            if batch:
+                if self._write(conn, batch):
+                    batch, backoff = [], 0.0
+                else:
+                    backoff = min(max(2 * backoff, RETRY_MIN), RETRY_MAX)
+                self._unwritten = len(batch)
+                ISSUANCE_UNWRITTEN_ROWS.set(self._unwritten)
+            for done in flushed:
+                done.set()
+        if batch:
+            log.error(
+                "issuance rows not recorded at shutdown",
+                serials=[entry.serial for entry in batch],
+            )
+        conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: list[IssuedCertificate]) -> bool:
+        """Commit a batch; on failure its rows stay pending for a retry."""
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO certificates ({COLUMNS}) "
+                    f"VALUES ({', '.join('?' * 12)})",
+                    [entry._row() for entry in batch],
+                )
+        except sqlite3.Error as e:
+            ISSUANCE_WRITE_ERRORS.inc()
+            log.error(
+                "issuance batch not recorded, will retry", error=str(e),
+                serials=[entry.serial for entry in batch],
+            )
+            return False
+        with self._pending_lock:
+            for entry in batch:
+                if self._pending.get(entry.ski) is entry:
+                    del self._pending[entry.ski]
+        return True
+
+
+def _timestamp(when: datetime.datetime | None) -> str | None:
+    # Fixed-width UTC ISO 8601, so text order is time order.
+    return when.astimezone(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ") if when else None
+
+
+def _datetime(text: str | None) -> datetime.datetime | None:
+    if text is None:
+        return None
+    return datetime.datetime.strptime(text, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=datetime.UTC)
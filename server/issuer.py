@@ -0,0 +1,97 @@
+"""
+End-entity certificate issuance by the Kibala Root CA.
+======================================================
+
+Device certificates (POST /api/v1/certificates/sign) and the gateway's
+own certificate share one profile, the extensions C2PA requires of a
+signing certificate:
+
+  - BasicConstraints(ca=False)                     -- not a CA
+  - KeyUsage(digitalSignature=True)                -- signs content
+  - ExtendedKeyUsage(emailProtection)              -- required by C2PA spec
+  - SubjectKeyIdentifier                           -- identifies the cert's key
+  - AuthorityKeyIdentifier                         -- links to issuing CA
+
+Everything that does not depend on the subject is built once per Root CA
+by Issuer: the issuer name, the constant extensions, the Authority Key
+Identifier and the Root CA's PEM that ends every chain.  Issuing a
+certificate is then only the subject's SKI and the Root CA's signature.
+"""
+
+import datetime
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509.oid import ExtendedKeyUsageOID
+
+# Certificates are back-dated a little to tolerate client clock skew.
+BACKDATE = datetime.timedelta(minutes=5)
+
+# ---- Extensions required by C2PA ----
+#
+# 1. Not a CA
+BASIC_CONSTRAINTS = x509.BasicConstraints(ca=False, path_length=None)
+# 2. Key usage: digital signatures only
+KEY_USAGE = x509.KeyUsage(
+    digital_signature=True,
+    content_commitment=False,
+    key_encipherment=False,
+    data_encipherment=False,
+    key_agreement=False,
+    key_cert_sign=False,
+    crl_sign=False,
+    encipher_only=False,
+    decipher_only=False,
+)
+# 3. Extended Key Usage — emailProtection is required by C2PA
+EXTENDED_KEY_USAGE = x509.ExtendedKeyUsage([ExtendedKeyUsageOID.EMAIL_PROTECTION])
+
+
+class Issuer:
+    """Signs end-entity certificates with the Root CA; immutable, so one
+    instance is shared by every thread."""
+
+    def __init__(self, root_cert: x509.Certificate, root_key):
+        self.root_cert = root_cert
+        self.root_key = root_key
+        self.name = root_cert.subject
+        self.root_pem = root_cert.public_bytes(serialization.Encoding.PEM).decode("utf-8").strip()
+        # 5. Authority Key Identifier — links to the issuing Root CA
+        self.authority_key_identifier = x509.AuthorityKeyIdentifier.from_issuer_public_key(
+            root_key.public_key()
+        )
+        self._template = (
+            x509.CertificateBuilder()
+            .issuer_name(self.name)
+            .add_extension(BASIC_CONSTRAINTS, critical=True)
+            .add_extension(KEY_USAGE, critical=True)
+            .add_extension(EXTENDED_KEY_USAGE, critical=False)
+        )
+
+    def issue(
+        self,
+        subject: x509.Name,
+        public_key,
+        validity: datetime.timedelta,
+        ski: x509.SubjectKeyIdentifier | None = None,
+    ) -> x509.Certificate:
+        """A certificate for public_key, valid from now (back-dated) for `validity`."""
+        if ski is None:
+            ski = x509.SubjectKeyIdentifier.from_public_key(public_key)
+        valid_from = datetime.datetime.now(datetime.UTC) - BACKDATE
+        return (
+            self._template
+            .subject_name(subject)
+            .public_key(public_key)
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(valid_from)
+            .not_valid_after(valid_from + validity)
+            # 4. Subject Key Identifier — identifies this cert's public key
+            .add_extension(ski, critical=False)
+            .add_extension(self.authority_key_identifier, critical=False)
+        ).sign(private_key=self.root_key, algorithm=hashes.SHA256())
+
+    def chain_pem(self, certificate: x509.Certificate) -> str:
+        """PEM chain: the end-entity certificate first, then the Root CA."""
+        cert_pem = certificate.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+        return cert_pem.strip() + "\n" + self.root_pem
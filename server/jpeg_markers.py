@@ -0,0 +1,399 @@
+"""
+JPEG marker-stream utilities for the Kibala privacy gateway.
+============================================================
+
+Works on the raw JPEG segment structure instead of decoded pixels:
+
+  - strip_metadata() rewrites a JPEG in a single pass, dropping every
+    metadata segment while copying the entropy-coded image data
+    byte-for-byte (no decode, no generation loss).
+  - read_frame_header() returns the SOF dimensions and MCU geometry.
+  - lossless_orient() applies an EXIF orientation in the DCT coefficient
+    domain by piping the image through libjpeg-turbo's jpegtran.
+  - JpegHeaderScanner parses the header segments of a JPEG while it is
+    still arriving and collects the C2PA manifest store (APP11 JUMBF).
+
+Segment layout reminder:
+  FFD8                      SOI   start of image
+  FFEn <len> <payload>      APPn  application data (EXIF, XMP, ICC, JUMBF, ...)
+  FFDB / FFC4 / FFC0 ...    tables and frame header
+  FFDA <len> <header>       SOS   start of scan, followed by entropy-coded data
+  FFD9                      EOI   end of image
+
+Inside entropy-coded data a literal 0xFF byte is always followed by 0x00
+(byte stuffing) or is a restart marker RST0–RST7, so the next real marker
+can be found without decoding the scan.
+"""
+
+import subprocess
+from typing import NamedTuple
+
+from jumbf import MANIFEST_STORE_LABEL, box_header, superbox_label
+
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+TEM = 0x01
+RST0 = 0xD0
+RST7 = 0xD7
+APP0 = 0xE0
+APP1 = 0xE1
+APP2 = 0xE2
+APP11 = 0xEB
+APP14 = 0xEE
+APP15 = 0xEF
+COM = 0xFE
+
+# SOF0–SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+PROGRESSIVE_SOF_MARKERS = frozenset({0xC2, 0xC6, 0xCA, 0xCE})
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# EXIF orientation → jpegtran operation that makes the image upright.
+ORIENTATION_TRANSFORMS = {
+    2: ("-flip", "horizontal"),
+    3: ("-rotate", "180"),
+    4: ("-flip", "vertical"),
+    5: ("-transpose",),
+    6: ("-rotate", "90"),
+    7: ("-transverse",),
+    8: ("-rotate", "270"),
+}
+
+
+class JpegError(ValueError):
+    """The data is not a well-formed JPEG marker stream."""
+
+
+class FrameHeader(NamedTuple):
+    """Image geometry from the SOF segment."""
+    width: int
+    height: int
+    components: int
+    mcu_width: int
+    mcu_height: int
+    progressive: bool
+
+
+def strip_metadata(data: bytes) -> tuple[bytes, int]:
+    """
+    Remove all metadata segments from a JPEG without touching the pixels.
+
+    Dropped:
+      - APP1   EXIF (camera, serial number, GPS) and XMP
+      - APP11  JUMBF / C2PA manifests
+      - APP13  IPTC / Photoshop resources
+      - COM    comments
+      - every other APPn (vendor maker notes, MPF, FlashPix, ...)
+      - trailing bytes after EOI (MPF secondary images, gain maps)
+
+    Kept:
+      - APP0   JFIF header
+      - APP2   ICC_PROFILE chunks (correct color rendering)
+      - APP14  Adobe header (color transform needed to decode correctly)
+      - all tables, frame/scan headers and entropy-coded data, unchanged
+
+    Returns (clean JPEG bytes, EXIF orientation 1–8). The orientation is
+    read from the EXIF segment on the way through so the caller can decide
+    whether it still has to be applied to the image; 1 means upright.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise JpegError("missing SOI marker")
+
+    view = memoryview(data)
+    size = len(data)
+    out = bytearray(b"\xff\xd8")
+    orientation = 1
+    pos = 2
+
+    while True:
+        if pos >= size or data[pos] != 0xFF:
+            raise JpegError(f"expected marker at offset {pos}")
+        # Any number of 0xFF fill bytes may precede the marker code.
+        while pos < size and data[pos] == 0xFF:
+            pos += 1
+        if pos >= size:
+            raise JpegError("truncated marker")
+        marker = data[pos]
+        pos += 1
+
+        if marker == EOI:
+            out += b"\xff\xd9"
+            return bytes(out), orientation
+        if marker == TEM or RST0 <= marker <= RST7:
+            out += bytes((0xFF, marker))
+            continue
+
+        if pos + 2 > size:
+            raise JpegError("truncated segment length")
+        length = int.from_bytes(view[pos:pos + 2], "big")
+        end = pos + length
+        if length < 2 or end > size:
+            raise JpegError(f"segment 0x{marker:02X} at offset {pos - 2} overruns the file")
+        payload = view[pos + 2:end]
+
+        if _keep_segment(marker, payload):
+            out += bytes((0xFF, marker))
+            out += view[pos:end]
+        elif marker == APP1 and payload[:6] == b"Exif\x00\x00":
+            orientation = _exif_orientation(payload[6:])
+        pos = end
+
+        if marker == SOS:
+            # Copy the entropy-coded scan up to the next real marker.
+            scan_start = pos
+            while True:
+                pos = data.find(b"\xff", pos)
+                if pos < 0 or pos + 1 >= size:
+                    raise JpegError("truncated scan data (no EOI)")
+                code = data[pos + 1]
+                if code == 0xFF:
+                    pos += 1
+                elif code == 0x00 or RST0 <= code <= RST7:
+                    pos += 2
+                else:
+                    break
+            out += view[scan_start:pos]
+
+
+def _keep_segment(marker: int, payload: memoryview) -> bool:
+    if marker == COM:
+        return False
+    if not APP0 <= marker <= APP15:
+        return True
+    if marker == APP0:
+        return payload[:5] == b"JFIF\x00"
+    if marker == APP2:
+        return payload[:12] == b"ICC_PROFILE\x00"
+    if marker == APP14:
+        return payload[:5] == b"Adobe"
+    return False
+
+
+def _exif_orientation(tiff: memoryview) -> int:
+    """Read IFD0 Orientation (tag 0x0112) from a TIFF-structured EXIF blob."""
+    if len(tiff) < 8:
+        return 1
+    if tiff[:4] == b"II*\x00":
+        order = "little"
+    elif tiff[:4] == b"MM\x00*":
+        order = "big"
+    else:
+        return 1
+
+    ifd = int.from_bytes(tiff[4:8], order)
+    if ifd + 2 > len(tiff):
+        return 1
+    count = int.from_bytes(tiff[ifd:ifd + 2], order)
+    entry = ifd + 2
+    for _ in range(count):
+        if entry + 12 > len(tiff):
+            break
+        if int.from_bytes(tiff[entry:entry + 2], order) == EXIF_ORIENTATION_TAG:
+            value = int.from_bytes(tiff[entry + 8:entry + 10], order)
+            return value if 1 <= value <= 8 else 1
+        entry += 12
+    return 1
+
+
+class JpegHeaderScanner:
+    """
+    Incremental parser for the segments in front of the first scan.
+
+    Feed the upload chunk by chunk; once `complete` is True every APPn
+    segment has been seen, so `has_c2pa` tells whether a C2PA manifest
+    store is embedded and manifest_data() returns it reassembled.  Raises
+    JpegError as soon as the stream cannot be a JPEG.
+    """
+
+    def __init__(self):
+        self.complete = False
+        self._buf = bytearray()
+        self._pos = 0
+        # JUMBF box instance (En) -> [(sequence Z, segment data)]
+        self._jumbf: dict[bytes, list[tuple[int, bytes]]] = {}
+
+    @property
+    def has_c2pa(self) -> bool:
+        return any(
+            _is_c2pa_superbox(min(parts)[1])
+            for parts in self._jumbf.values()
+            if parts and min(parts)[0] == 1
+        )
+
+    def feed(self, chunk: bytes) -> bool:
+        """Consume more of the upload; returns `complete`."""
+        if self.complete:
+            return True
+        self._buf += chunk
+        buf = self._buf
+
+        if self._pos == 0:
+            if len(buf) < 2:
+                return False
+            if buf[:2] != b"\xff\xd8":
+                raise JpegError("missing SOI marker")
+            self._pos = 2
+
+        while self._pos + 2 <= len(buf):
+            pos = self._pos
+            if buf[pos] != 0xFF:
+                raise JpegError(f"expected marker at offset {pos}")
+            marker = buf[pos + 1]
+            if marker == 0xFF:
+                self._pos += 1
+                continue
+            if marker == TEM or RST0 <= marker <= RST7:
+                self._pos += 2
+                continue
+            if marker in (SOS, EOI):
+                self.complete = True
+                self._buf = bytearray()
+                return True
+            if pos + 4 > len(buf):
+                return False
+            length = int.from_bytes(buf[pos + 2:pos + 4], "big")
+            if length < 2:
+                raise JpegError(f"bad segment length at offset {pos}")
+            end = pos + 2 + length
+            if end > len(buf):
+                return False
+            if marker == APP11 and buf[pos + 4:pos + 6] == b"JP" and length >= 10:
+                instance = bytes(buf[pos + 6:pos + 8])
+                sequence = int.from_bytes(buf[pos + 8:pos + 12], "big")
+                self._jumbf.setdefault(instance, []).append(
+                    (sequence, bytes(buf[pos + 12:end]))
+                )
+            self._pos = end
+        return False
+
+    def manifest_data(self) -> bytes:
+        """The embedded C2PA manifest store (JUMBF), reassembled."""
+        for parts in self._jumbf.values():
+            parts = sorted(parts)
+            if not parts or parts[0][0] != 1 or not _is_c2pa_superbox(parts[0][1]):
+                continue
+            box = bytearray(parts[0][1])
+            # Continuation segments repeat the box header (LBox, TBox and,
+            # for large boxes, XLBox); only the first copy is kept.
+            _, header, _ = box_header(box)
+            for _, data in parts[1:]:
+                box += data[header:]
+            return bytes(box)
+        return b""
+
+
+def _is_c2pa_superbox(box: bytes) -> bool:
+    """JUMBF superbox ('jumb') whose description ('jumd') is labelled c2pa.
+
+    `box` is the first APP11 segment's share of the box, so only its
+    header and description have to be present.
+    """
+    header = box_header(box)
+    if header is None or header[0] != b"jumb":
+        return False
+    return superbox_label(box, header[1], len(box)) == MANIFEST_STORE_LABEL
+
+
+def read_frame_header(data: bytes) -> FrameHeader:
+    """Parse the SOF segment; only the headers before the first scan are read."""
+    if data[:2] != b"\xff\xd8":
+        raise JpegError("missing SOI marker")
+
+    size = len(data)
+    pos = 2
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            raise JpegError(f"expected marker at offset {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == TEM or RST0 <= marker <= RST7:
+            pos += 2
+            continue
+        if marker in (SOS, EOI):
+            break
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        if length < 2 or pos + 2 + length > size:
+            raise JpegError(f"segment 0x{marker:02X} at offset {pos} overruns the file")
+        if marker in SOF_MARKERS:
+            if length < 8:
+                raise JpegError("SOF segment too short")
+            height = int.from_bytes(data[pos + 5:pos + 7], "big")
+            width = int.from_bytes(data[pos + 7:pos + 9], "big")
+            components = data[pos + 9]
+            if length < 8 + 3 * components:
+                raise JpegError("SOF segment too short for its components")
+            sampling = data[pos + 11:pos + 10 + 3 * components:3]
+            max_h = max((f >> 4 for f in sampling), default=1)
+            max_v = max((f & 0x0F for f in sampling), default=1)
+            return FrameHeader(
+                width=width,
+                height=height,
+                components=components,
+                mcu_width=8 * max_h,
+                mcu_height=8 * max_v,
+                progressive=marker in PROGRESSIVE_SOF_MARKERS,
+            )
+        pos += 2 + length
+    raise JpegError("no SOF segment before the first scan")
+
+
+def is_perfect_transform(frame: FrameHeader, orientation: int) -> bool:
+    """
+    True if the orientation can be applied without partial MCU edges.
+
+    DCT-domain transforms move whole MCU blocks.  An edge that is not a
+    multiple of the MCU size ends up on the wrong side of the image after a
+    flip or rotation, so jpegtran either leaves it untransformed or, with
+    -trim, drops it.  Which edges matter depends on the transform (this is
+    the same test as libjpeg-turbo's jtransform_perfect_transform).
+    """
+    width_ok = frame.width % frame.mcu_width == 0
+    height_ok = frame.height % frame.mcu_height == 0
+    if orientation in (2, 8):       # flip horizontal, rotate 270
+        return width_ok
+    if orientation in (4, 6):       # flip vertical, rotate 90
+        return height_ok
+    if orientation in (3, 7):       # rotate 180, transverse
+        return width_ok and height_ok
+    return True                     # upright, transpose
+
+
+def lossless_orient(
+    data: bytes,
+    orientation: int,
+    jpegtran: str,
+    trim: bool = False,
+    timeout: float = 30.0,
+) -> bytes | None:
+    """
+    Rotate/flip a JPEG so it is upright, losslessly, via jpegtran.
+
+    `data` should already be stripped: jpegtran runs with `-copy all` so the
+    ICC profile survives.  Returns None when the image has partial MCU
+    edges and `trim` is False — the caller then has to fall back to a pixel
+    decode.  With `trim`, the partial edge (under one MCU, at most 15 px)
+    is dropped instead.  Raises JpegError if jpegtran fails.
+    """
+    if orientation == 1:
+        return data
+    operation = ORIENTATION_TRANSFORMS.get(orientation)
+    if operation is None:
+        raise JpegError(f"invalid EXIF orientation {orientation}")
+
+    perfect = is_perfect_transform(read_frame_header(data), orientation)
+    if not perfect and not trim:
+        return None
+
+    cmd = [jpegtran, "-copy", "all", "-perfect" if perfect else "-trim", *operation]
+    try:
+        result = subprocess.run(cmd, input=data, capture_output=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise JpegError(f"jpegtran failed: {e}") from e
+    if result.returncode != 0 or not result.stdout:
+        stderr = result.stderr.decode("utf-8", "replace").strip()
+        raise JpegError(f"jpegtran exited with {result.returncode}: {stderr}")
+    return result.stdout
@@ -0,0 +1,192 @@
+"""
+Minimal JUMBF reader for C2PA manifest stores.
+==============================================
+
+A C2PA manifest store (ISO 19566-5 JUMBF) is a tree of boxes:
+
+  jumb  "c2pa"                           manifest store
+    jumd                                 description (type UUID, label)
+    jumb  "urn:c2pa:..."                 one manifest per signer, in order;
+      jumd                               the last one is the active manifest
+      jumb  "c2pa.assertions"            assertion store (hash bindings, ...)
+      jumb  "c2pa.claim" / "c2pa.claim.v2"
+      jumb  "c2pa.signature"             COSE_Sign1 over the claim, carrying
+                                         the signer's certificate chain
+
+Each box is LBox (u32 size, 1 = 64-bit XLBox follows, 0 = to the end),
+TBox (4-char type), then the payload.  Only the box framing and the
+description labels are parsed here; nothing is validated, so a malformed
+store just yields None and the c2pa library gets to report the error.
+
+The signature box holds a 'cbor' box with a COSE_Sign1 structure
+(RFC 9052); signer_certificate() decodes just enough CBOR to pull the
+signer's end-entity certificate out of its x5chain header.  Anything the
+c2pa library might read differently (a second 'cbor' box, x5chain in
+both header buckets, a duplicated map key) yields None rather than a
+guess.
+"""
+
+from collections.abc import Iterator
+
+MANIFEST_STORE_LABEL = "c2pa"
+SIGNATURE_LABEL = "c2pa.signature"
+COSE_SIGN1_TAG = 18
+COSE_X5CHAIN = 33
+
+
+def box_header(data: bytes, pos: int = 0, end: int | None = None) -> tuple[bytes, int, int] | None:
+    """(type, payload start, box size) of the box at data[pos], or None if
+    its header does not fit before `end`.  The payload itself may not."""
+    end = len(data) if end is None else end
+    if pos + 8 > end:
+        return None
+    size = int.from_bytes(data[pos:pos + 4], "big")
+    box_type = bytes(data[pos + 4:pos + 8])
+    payload = pos + 8
+    if size == 1:
+        if pos + 16 > end:
+            return None
+        size = int.from_bytes(data[pos + 8:pos + 16], "big")
+        payload = pos + 16
+    elif size == 0:
+        size = end - pos
+    return box_type, payload, size
+
+
+def iter_boxes(data: bytes, start: int = 0, end: int | None = None) -> Iterator[tuple[bytes, int, int, int]]:
+    """Yield (type, box start, payload start, box end) for the boxes in data[start:end]."""
+    end = len(data) if end is None else end
+    pos = start
+    while (header := box_header(data, pos, end)) is not None:
+        box_type, payload, size = header
+        if size < payload - pos or pos + size > end:
+            return
+        yield box_type, pos, payload, pos + size
+        pos += size
+
+
+def superbox_label(data: bytes, payload: int, end: int) -> str | None:
+    """Label of a 'jumb' superbox from its leading 'jumd' description box."""
+    for box_type, _, jumd, jumd_end in iter_boxes(data, payload, end):
+        if box_type != b"jumd" or jumd + 17 > jumd_end:
+            return None
+        toggles = data[jumd + 16]
+        if not toggles & 0x02:  # no label present
+            return None
+        label_end = bytes(data[jumd + 17:jumd_end]).find(b"\x00")
+        if label_end < 0:
+            return None
+        return bytes(data[jumd + 17:jumd + 17 + label_end]).decode("utf-8", "replace")
+    return None
+
+
+def child_superboxes(data: bytes, payload: int, end: int) -> Iterator[tuple[str | None, int, int, int]]:
+    """Yield (label, box start, payload start, box end) for nested 'jumb' boxes."""
+    for box_type, box_start, child_payload, box_end in iter_boxes(data, payload, end):
+        if box_type == b"jumb":
+            yield superbox_label(data, child_payload, box_end), box_start, child_payload, box_end
+
+
+def active_signature_box(store: bytes) -> bytes | None:
+    """The complete 'c2pa.signature' superbox of the active manifest."""
+    for box_type, _, payload, end in iter_boxes(store):
+        if box_type != b"jumb" or superbox_label(store, payload, end) != MANIFEST_STORE_LABEL:
+            continue
+        manifests = list(child_superboxes(store, payload, end))
+        if not manifests:
+            return None
+        _, _, manifest_payload, manifest_end = manifests[-1]
+        for label, box_start, _, box_end in child_superboxes(store, manifest_payload, manifest_end):
+            if label == SIGNATURE_LABEL:
+                return bytes(store[box_start:box_end])
+        return None
+    return None
+
+
+def signer_certificate(signature_box: bytes) -> bytes | None:
+    """DER of the end-entity certificate in a c2pa.signature box's x5chain."""
+    for box_type, _, payload, end in iter_boxes(signature_box):
+        if box_type != b"jumb":
+            continue
+        cbor = [
+            (content, content_end)
+            for content_type, _, content, content_end in iter_boxes(signature_box, payload, end)
+            if content_type == b"cbor"
+        ]
+        if len(cbor) != 1:
+            return None
+        content, content_end = cbor[0]
+        try:
+            cose, _ = _cbor_item(signature_box[content:content_end], 0)
+            if isinstance(cose, _Tagged) and cose.tag == COSE_SIGN1_TAG:
+                cose = cose.value
+            protected, unprotected = cose[0], cose[1]
+            headers = [dict(unprotected)]
+            if protected:
+                headers.append(_cbor_item(protected, 0)[0])
+        except (ValueError, IndexError, TypeError, KeyError, RecursionError):
+            return None
+        chains = [
+            bucket[label] for bucket in headers for label in (COSE_X5CHAIN, "x5chain")
+            if label in bucket
+        ]
+        if len(chains) != 1:
+            return None
+        chain = chains[0]
+        if isinstance(chain, list):
+            chain = chain[0] if chain else None
+        return chain if isinstance(chain, bytes) else None
+    return None
+
+
+class _Tagged:
+    def __init__(self, tag: int, value):
+        self.tag = tag
+        self.value = value
+
+
+def _cbor_item(data: bytes, pos: int):
+    """Decode one definite-length CBOR item at data[pos:]; returns (item, next pos)."""
+    initial = data[pos]
+    major, info = initial >> 5, initial & 0x1F
+    pos += 1
+    if info < 24:
+        arg = info
+    elif info <= 27:
+        width = 1 << (info - 24)
+        arg = int.from_bytes(data[pos:pos + width], "big")
+        pos += width
+    else:
+        raise ValueError("indefinite-length CBOR is not supported")
+
+    if major == 0:
+        return arg, pos
+    if major == 1:
+        return -1 - arg, pos
+    if major in (2, 3):
+        if pos + arg > len(data):
+            raise ValueError("truncated CBOR string")
+        raw = bytes(data[pos:pos + arg])
+        return (raw if major == 2 else raw.decode("utf-8", "replace")), pos + arg
+    if major == 4:
+        items = []
+        for _ in range(arg):
+            item, pos = _cbor_item(data, pos)
+            items.append(item)
+        return items, pos
+    if major == 5:
+        entries = {}
+        for _ in range(arg):
+            key, pos = _cbor_item(data, pos)
+            value, pos = _cbor_item(data, pos)
+            if isinstance(key, (list, dict, _Tagged)):
+                continue
+            if key in entries:
+                raise ValueError("duplicate CBOR map key")
+            entries[key] = value
+        return entries, pos
+    if major == 6:
+        value, pos = _cbor_item(data, pos)
+        return _Tagged(arg, value), pos
+    # major 7: false/true/null/undefined and floats; the value is not needed
+    return {20: False, 21: True}.get(info, None) if info < 24 else None, pos
@@ -0,0 +1,166 @@
+"""
+Lazy reading of the c2pa manifest store report.
+===============================================
+
+The gateway accepts or rejects an upload on three top-level fields of
+the JSON report c2pa.Reader.json() returns: whether "manifests" is
+empty, "validation_status" (present only when validation failed) and
+"active_manifest".  The rest of the report describes every manifest,
+assertion and ingredient; json.loads() would build all of it per request
+only to throw it away, and the Reader's get_validation_state() and
+friends do exactly that internally.
+
+c2pa-rs pretty-prints the report with two-space indentation.  A JSON
+string cannot hold a raw newline, so in such a report a newline, exactly
+two spaces and a quote only ever start a top-level key: one regex pass
+finds them, and only the values the decision needs are decoded.
+
+This is a trust decision, so the scan fails closed: it must find
+"manifests", every top-level value must end exactly where the next key
+(or the closing brace) begins, and "manifests" must be an object closed
+at the top level.  A report that breaks any of that, or is laid out any
+other way, is parsed with json.loads() instead, which raises ValueError
+when it is not valid JSON.
+
+summarize_signed() also returns the active manifest's "signature_info"
+(the certificate c2pa actually verified the claim signature with).  The
+same layout rule finds it without decoding "manifests": the active
+manifest is the key at four spaces whose object closes at the first
+newline, four spaces and a brace after it, and its own keys are the ones
+at six spaces in between, so only "signature_info" itself is decoded.
+"""
+
+import json
+import re
+from typing import NamedTuple
+
+_PRETTY_PREFIX = '{\n  "'
+_PRETTY_SUFFIX = "\n}"
+_KEY_START = '\n  "'
+_TOP_LEVEL_KEY = re.compile(r'\n  "((?:[^"\\\n]|\\.)*)": ')
+_EMPTY_OBJECT = re.compile(r"\{\s*\}")
+_MANIFEST_END = "\n    }"
+_SIGNATURE_INFO_KEY = '\n      "signature_info": '
+_decoder = json.JSONDecoder()
+
+
+class ManifestSummary(NamedTuple):
+    has_manifests: bool
+    active_manifest: str | None
+    validation_status: list | None  # None when validation passed
+
+
+def summarize(report: str) -> ManifestSummary:
+    """The accept/reject fields of a manifest store report; raises ValueError
+    if it is not valid JSON."""
+    scanned = _scan(report)
+    return scanned[0] if scanned is not None else _from_store(json.loads(report))
+
+
+def summarize_signed(report: str) -> tuple[ManifestSummary, dict]:
+    """summarize() plus the active manifest's "signature_info" ({} if absent);
+    raises ValueError if the report is not valid JSON."""
+    scanned = _scan(report, signed=True)
+    if scanned is not None:
+        return scanned
+    store = json.loads(report)
+    manifest = (store.get("manifests") or {}).get(store.get("active_manifest"))
+    signature_info = manifest.get("signature_info") if isinstance(manifest, dict) else None
+    return _from_store(store), signature_info if isinstance(signature_info, dict) else {}
+
+
+def _scan(report: str, signed: bool = False) -> tuple[ManifestSummary, dict] | None:
+    """The summary (and, if `signed`, the active manifest's signature_info)
+    from a pretty-printed report, or None if the report is not laid out
+    exactly as expected."""
+    body_end = len(report.rstrip()) - len(_PRETTY_SUFFIX)
+    if not report.startswith(_PRETTY_PREFIX) or not report.startswith(_PRETTY_SUFFIX, body_end):
+        return None
+
+    # key -> (value start, value end), the end excluding the separating comma
+    spans = {}
+    key = value_start = None
+    pos = report.find(_KEY_START, 1)
+    while pos >= 0:
+        match = _TOP_LEVEL_KEY.match(report, pos)
+        if match is None:
+            return None
+        if key is not None:
+            if report[pos - 1] != ",":
+                return None
+            spans[key] = (value_start, pos - 1)
+        key, value_start = match.group(1), match.end()
+        pos = report.find(_KEY_START, pos + 1)
+    if key is None or report[body_end - 1] == ",":
+        return None
+    spans[key] = (value_start, body_end)
+
+    if "manifests" not in spans:
+        return None
+    manifests_span = spans["manifests"]
+    manifests = report[slice(*manifests_span)]
+    if _EMPTY_OBJECT.fullmatch(manifests):
+        has_manifests = False
+    elif manifests.startswith("{") and manifests.endswith("\n  }"):
+        has_manifests = True
+    else:
+        return None
+    try:
+        summary = ManifestSummary(
+            has_manifests,
+            _value(report, spans.get("active_manifest")),
+            _value(report, spans.get("validation_status")),
+        )
+        signature_info = {}
+        if signed and summary.active_manifest is not None:
+            signature_info = _signature_info(report, manifests_span, summary.active_manifest)
+    except ValueError:
+        return None
+    if signature_info is None:
+        return None
+    return summary, signature_info
+
+
+def _signature_info(report: str, manifests_span: tuple[int, int], label) -> dict | None:
+    """The active manifest's "signature_info" ({} if absent), or None if
+    the manifest is not laid out exactly as expected."""
+    if not isinstance(label, str):
+        return None
+    start, end = manifests_span
+    header = f'\n    {json.dumps(label, ensure_ascii=False)}: {{'
+    manifest = report.find(header, start, end)
+    if manifest < 0 or report.find(header, manifest + 1, end) >= 0:
+        return None
+    if not report.startswith('\n      "', manifest + len(header)):
+        return None  # "{}" on one line; closes before any _MANIFEST_END
+    manifest_end = report.find(_MANIFEST_END, manifest, end)
+    if manifest_end < 0 or report[manifest_end + len(_MANIFEST_END)] not in ",\n":
+        return None
+    key = report.find(_SIGNATURE_INFO_KEY, manifest, manifest_end)
+    if key < 0:
+        return {}
+    if report.find(_SIGNATURE_INFO_KEY, key + 1, manifest_end) >= 0:
+        return None
+    value, value_end = _decoder.raw_decode(report, key + len(_SIGNATURE_INFO_KEY))
+    if value_end != manifest_end and not (
+        report[value_end] == "," and report.startswith("\n      \"", value_end + 1)
+    ):
+        return None
+    return value if isinstance(value, dict) else {}
+
+
+def _value(report: str, span: tuple[int, int] | None):
+    if span is None:
+        return None
+    value, end = _decoder.raw_decode(report, span[0])
+    if end != span[1]:
+        raise ValueError("top-level value does not end before the next key")
+    return value
+
+
+def _from_store(store: dict) -> ManifestSummary:
+    return ManifestSummary(
+        bool(store.get("manifests")),
+        store.get("active_manifest"),
+        store.get("validation_status"),
+    )
@@ -0,0 +1,104 @@
+"""
+Gateway manifest templates for the Kibala privacy gateway.
+==========================================================
+
+The manifest the gateway signs into every published photo is the same on
+each request except for a few fields (the publish timestamp).  A template
+is serialized to JSON once at startup and split around its placeholders,
+so rendering a manifest is a string join instead of building and dumping
+a nested dict per request.
+
+Placeholders are string values of the form "${field}".  Supported fields:
+  when    ISO-8601 publish timestamp
+
+Operators can add publisher variants without code changes by pointing
+KIBALA_MANIFEST_TEMPLATES at a JSON file of named manifests:
+
+  {
+    "default":   { "claim_generator": "...", "assertions": [...] },
+    "acme-news": { "claim_generator": "...", "assertions": [...] }
+  }
+
+A "default" entry in the file replaces the built-in default below.
+"""
+
+import json
+import re
+
+PLACEHOLDER = re.compile(r'"\$\{(\w+)\}"')
+FIELDS = frozenset({"when"})
+
+DEFAULT_MANIFEST = {
+    "claim_generator": "imanmontajabi.com/1.0",
+    "claim_generator_info": [
+        {"name": "imanmontajabi.com", "version": "1.0"}
+    ],
+    "title": "imanmontajabi.com",
+    "assertions": [
+        {
+            "label": "c2pa.actions",
+            "data": {
+                "actions": [
+                    {
+                        "action": "c2pa.published",
+                        "softwareAgent": "imanmontajabi.com/1.0",
+                        "when": "${when}",
+                    }
+                ]
+            },
+        },
+        {
+            "label": "stds.schema-org.CreativeWork",
+            "data": {
+                "@context": "http://schema.org",
+                "@type": "CreativeWork",
+                "author": [
+                    {
+                        "@type": "Organization",
+                        "name": "imanmontajabi.com",
+                    }
+                ],
+            },
+        },
+    ],
+}
+
+
+class ManifestTemplate:
+    """A manifest pre-serialized to JSON with its placeholders cut out."""
+
+    def __init__(self, name: str, manifest: dict):
+        self.name = name
+        serialized = json.dumps(manifest, separators=(",", ":"), ensure_ascii=False)
+        # re.split alternates static chunks and captured field names:
+        # [chunk, field, chunk, field, ..., chunk]
+        parts = PLACEHOLDER.split(serialized)
+        self._chunks = parts[0::2]
+        self._fields = parts[1::2]
+        unknown = set(self._fields) - FIELDS
+        if unknown:
+            raise ValueError(
+                f"Manifest template {name!r} uses unknown placeholders: {sorted(unknown)}"
+            )
+
+    def render(self, **values: str) -> str:
+        """Return the manifest JSON with every placeholder filled in."""
+        out = [self._chunks[0]]
+        for field, chunk in zip(self._fields, self._chunks[1:]):
+            out.append(json.dumps(values[field]))
+            out.append(chunk)
+        return "".join(out)
+
+
+def load_templates(path: str | None = None) -> dict[str, ManifestTemplate]:
+    """Compile the built-in default plus any named variants from `path`."""
+    manifests = {"default": DEFAULT_MANIFEST}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            configured = json.load(f)
+        if not isinstance(configured, dict) or not all(
+            isinstance(m, dict) for m in configured.values()
+        ):
+            raise ValueError(f"{path} must map template names to manifest objects")
+        manifests.update(configured)
+    return {name: ManifestTemplate(name, m) for name, m in manifests.items()}
@@ -0,0 +1,138 @@
+"""
+Memory budget for the Kibala publish pipeline.
+==============================================
+
+Publishing decodes the image to pixels: the c2pa Builder decodes it for
+the claim thumbnail, and when the EXIF orientation cannot be applied
+losslessly Pillow holds the decoded image and its transposed copy.  How
+much memory that takes depends only on the dimensions in the SOF header,
+not on the upload size, so a small JPEG claiming 30000 x 30000 pixels
+would make a worker allocate gigabytes.
+
+estimate_publish_bytes() reads the dimensions before anything is
+decoded, and MemoryBudget admits pipelines against the limit of its
+server process (the server splits its budget between its workers):
+
+  - an image whose estimate exceeds the whole budget is refused outright
+    (MemoryBudgetExceeded);
+  - otherwise it waits until enough of the budget is free, first come
+    first served, so large images are not starved by small ones;
+  - a pipeline that cannot get its share within the wait time is turned
+    away (MemoryBudgetTimeout) and the client asked to retry.
+
+Under pressure the gateway therefore slows down and sheds load instead
+of running out of memory.  The budget lives in the event loop; it needs
+no lock.
+"""
+
+import asyncio
+import collections
+import contextlib
+
+from jpeg_markers import FrameHeader
+from metrics import MEMORY_BUDGET_RESERVED_BYTES, MEMORY_BUDGET_WAITING
+
+# Peak of the Pillow orientation fallback, measured (ru_maxrss) on 12 and
+# 24 MP photos: about three decoded copies (c2pa thumbnail decode, Pillow
+# decode, transposed copy) plus the upload and the re-signed output.
+DECODED_COPIES = 3
+UPLOAD_COPIES = 2
+
+
+class MemoryBudgetExceeded(Exception):
+    """The image needs more memory than the whole budget."""
+
+
+class MemoryBudgetTimeout(Exception):
+    """Not enough of the budget became free within the wait time."""
+
+
+def estimate_publish_bytes(frame: FrameHeader, upload_bytes: int) -> int:
+    """Estimated peak memory of publishing one image."""
+    # Decoders work in whole MCUs, so the buffers cover the padded size.
+    width = -(-frame.width // frame.mcu_width) * frame.mcu_width
+    height = -(-frame.height // frame.mcu_height) * frame.mcu_height
+    decoded = width * height * max(frame.components, 3)  # decoded as RGB at least
+    estimate = DECODED_COPIES * decoded + UPLOAD_COPIES * upload_bytes
+    if frame.progressive:
+        # libjpeg keeps every 16-bit DCT coefficient of a progressive scan.
+        estimate += width * height * frame.components * 2
+    return estimate
+
+
+class MemoryBudget:
+    """FIFO admission of memory reservations against a byte limit."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.reserved = 0
+        self._waiters: collections.deque[tuple[int, asyncio.Future]] = collections.deque()
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, nbytes: int, timeout: float | None):
+        """Hold `nbytes` of the budget for the duration of the block,
+        waiting up to `timeout` seconds for it (None: no limit)."""
+        if not self.enabled:
+            yield
+            return
+        if nbytes > self.limit:
+            raise MemoryBudgetExceeded(nbytes)
+        await self._acquire(nbytes, timeout)
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+    async def _acquire(self, nbytes: int, timeout: float | None) -> None:
+        if not self._waiters and self.reserved + nbytes <= self.limit:
+            self.reserved += nbytes
+            self._update_gauges()
+            return
+
+        waiter = (nbytes, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            raise MemoryBudgetTimeout(nbytes) from None
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: tuple[int, asyncio.Future]) -> None:
+        nbytes, future = waiter
+        if future.done() and not future.cancelled():
+            # Granted just as the wait was given up.
+            self._release(nbytes)
+            return
+        with contextlib.suppress(ValueError):
+            self._waiters.remove(waiter)
+        # It may have been holding back smaller reservations behind it.
+        self._wake()
+
+    def _release(self, nbytes: int) -> None:
+        self.reserved -= nbytes
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if self.reserved + nbytes > self.limit:
+                break
+            self._waiters.popleft()
+            self.reserved += nbytes
+            future.set_result(None)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        MEMORY_BUDGET_RESERVED_BYTES.set(self.reserved)
+        MEMORY_BUDGET_WAITING.set(sum(not future.done() for _, future in self._waiters))
@@ -0,0 +1,260 @@
+"""
+Prometheus metrics for the Kibala server.
+=========================================
+
+Everything is registered on prometheus_client's default registry and
+served as text from GET /metrics:
+
+  kibala_publish_stage_seconds{stage}              publish latency per stage
+  kibala_publish_requests_total{endpoint,outcome}  accepted / rejected publishes
+  kibala_csr_stage_seconds{stage}                  CSR signing latency per stage
+  kibala_csr_requests_total{outcome}               issued / reused / failed certificates
+  kibala_http_request_duration_seconds{method,route,status}
+  kibala_http_response_write_seconds{route}        first to last response byte
+  kibala_http_requests_in_flight                   requests being handled
+  kibala_publish_pipelines_in_flight               pipelines submitted to the pool
+  kibala_publish_pool_queue_depth                  of those, waiting for a worker
+  kibala_publish_job_queue_depth                   async jobs not yet started
+  kibala_publish_memory_reserved_bytes             memory budget held by pipelines
+  kibala_publish_memory_waiting                    pipelines waiting for budget
+  kibala_publish_admitted                          publishes admitted and running
+  kibala_publish_admission_waiting                 publishes queued for admission
+  kibala_cache_events_total{cache,event}           cache hits, misses, stores, evictions
+  kibala_cache_entries{cache,tier}                 entries held, refreshed per scrape
+  kibala_cache_bytes{cache,tier}                   bytes held, refreshed per scrape
+  kibala_issuance_write_errors_total               failed issuance batch commits
+  kibala_issuance_unwritten_rows                   issued certificates awaiting a retry
+
+Publish stages run inside the worker pool, possibly in another process,
+so the pipeline records its durations with a StageTimer and returns them
+to the server, which observes them here.
+
+With several server workers (`python server.py --workers N`) each one
+writes its samples to PROMETHEUS_MULTIPROC_DIR and render() merges them,
+so a scrape shows the totals across workers; the gauges are summed over
+the live workers.
+"""
+
+import contextlib
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    multiprocess,
+)
+
+# Photo publishes take tens of milliseconds to several seconds; the
+# default buckets stop at 10 s and are too coarse below 5 ms.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+PUBLISH_STAGE_SECONDS = Histogram(
+    "kibala_publish_stage_seconds",
+    "Time spent in each publish stage.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+PUBLISH_REQUESTS = Counter(
+    "kibala_publish_requests",
+    "Publish requests by endpoint and outcome (published, cache_hit or a rejection reason).",
+    ["endpoint", "outcome"],
+)
+CSR_STAGE_SECONDS = Histogram(
+    "kibala_csr_stage_seconds",
+    "Time spent in each certificate signing stage.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+CSR_REQUESTS = Counter(
+    "kibala_csr_requests",
+    "Certificate signing requests by outcome.",
+    ["outcome"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "kibala_http_request_duration_seconds",
+    "HTTP request latency, from the first request byte to the last response byte.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_RESPONSE_WRITE_SECONDS = Histogram(
+    "kibala_http_response_write_seconds",
+    "Time from sending the response headers to sending the last body byte.",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "kibala_http_requests_in_flight",
+    "HTTP requests currently being handled.",
+    multiprocess_mode="livesum",
+)
+PUBLISH_PIPELINES_IN_FLIGHT = Gauge(
+    "kibala_publish_pipelines_in_flight",
+    "Publish pipelines submitted to the worker pool and not yet finished.",
+    multiprocess_mode="livesum",
+)
+PUBLISH_POOL_QUEUE_DEPTH = Gauge(
+    "kibala_publish_pool_queue_depth",
+    "Publish pipelines waiting for a free worker.",
+    multiprocess_mode="livesum",
+)
+PUBLISH_JOB_QUEUE_DEPTH = Gauge(
+    "kibala_publish_job_queue_depth",
+    "Async publish jobs queued and not yet picked up by a job worker.",
+    multiprocess_mode="livesum",
+)
+MEMORY_BUDGET_RESERVED_BYTES = Gauge(
+    "kibala_publish_memory_reserved_bytes",
+    "Estimated peak memory of the publish pipelines admitted by the memory budget.",
+    multiprocess_mode="livesum",
+)
+MEMORY_BUDGET_WAITING = Gauge(
+    "kibala_publish_memory_waiting",
+    "Publish pipelines waiting for their share of the memory budget.",
+    multiprocess_mode="livesum",
+)
+PUBLISH_ADMITTED = Gauge(
+    "kibala_publish_admitted",
+    "Publish requests admitted by the admission controller and not yet finished.",
+    multiprocess_mode="livesum",
+)
+PUBLISH_ADMISSION_WAITING = Gauge(
+    "kibala_publish_admission_waiting",
+    "Publish requests queued for admission.",
+    multiprocess_mode="livesum",
+)
+CACHE_EVENTS = Counter(
+    "kibala_cache_events",
+    "Cache hits, misses, stores and evictions by cache and event.",
+    ["cache", "event"],
+)
+CACHE_ENTRIES = Gauge(
+    "kibala_cache_entries",
+    "Entries held by each cache tier.",
+    ["cache", "tier"],
+    multiprocess_mode="livesum",
+)
+CACHE_BYTES = Gauge(
+    "kibala_cache_bytes",
+    "Bytes held by each cache tier.",
+    ["cache", "tier"],
+    multiprocess_mode="livesum",
+)
+ISSUANCE_WRITE_ERRORS = Counter(
+    "kibala_issuance_write_errors",
+    "Issuance store batches that failed to commit and will be retried.",
+)
+ISSUANCE_UNWRITTEN_ROWS = Gauge(
+    "kibala_issuance_unwritten_rows",
+    "Issued certificates whose record failed to commit and is waiting for a retry.",
+    multiprocess_mode="livesum",
+)
+
+
+class StageTimer:
+    """Accumulates wall-clock seconds per named stage in a plain dict."""
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+
+_pipelines_in_flight = 0
+
+
+@contextlib.contextmanager
+def track_pipeline(workers: int):
+    """Count a pipeline from submission to the pool until it finishes.
+
+    Only used from the event loop, so the count needs no lock.
+    """
+    global _pipelines_in_flight
+    _pipelines_in_flight += 1
+    _set_pipeline_gauges(workers)
+    try:
+        yield
+    finally:
+        _pipelines_in_flight -= 1
+        _set_pipeline_gauges(workers)
+
+
+def _set_pipeline_gauges(workers: int) -> None:
+    PUBLISH_PIPELINES_IN_FLIGHT.set(_pipelines_in_flight)
+    PUBLISH_POOL_QUEUE_DEPTH.set(max(0, _pipelines_in_flight - workers))
+
+
+def observe_publish_stages(timings: dict[str, float]) -> None:
+    for stage, seconds in timings.items():
+        PUBLISH_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def render() -> tuple[bytes, str]:
+    """The exposition-format payload and its content type."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_worker_stopped() -> None:
+    """Drop this process's live gauges from the shared multiprocess files."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """ASGI middleware for request latency, response write time and in-flight count."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        write_start = None
+
+        async def send_with_metrics(message):
+            nonlocal status, write_start
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                write_start = time.perf_counter()
+            await send(message)
+            if (
+                message["type"] == "http.response.body"
+                and not message.get("more_body", False)
+                and write_start is not None
+            ):
+                HTTP_RESPONSE_WRITE_SECONDS.labels(_route(scope)).observe(
+                    time.perf_counter() - write_start
+                )
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.labels(scope["method"], _route(scope), str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+def _route(scope) -> str:
+    """The matched API route template, so path parameters don't explode the
+    labels; unmatched paths and the built-in docs pages count as "other"."""
+    route = scope.get("route")
+    return getattr(route, "path", "other")
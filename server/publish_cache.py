@@ -0,0 +1,209 @@
+"""
+Content-hash dedupe cache for the Kibala privacy gateway.
+=========================================================
+
+Mobile clients retry uploads after flaky connections, so the same
+device-signed JPEG often reaches /api/v1/publish several times.  The
+gateway keys each upload by SHA-256 of its bytes (plus the manifest
+template it was published with) and keeps recently published outputs, so
+a retry returns the cached signed JPEG without validating, stripping or
+signing again.
+
+Two tiers, both bounded by entry TTL and total size:
+  - memory  LRU of the most recent outputs
+  - disk    optional directory of outputs; hits are promoted to memory
+
+Counters (hits per tier, misses, stores, evictions) are exported as
+kibala_cache_events_total{cache="publish"}; stats() also reports the
+entries and bytes held per tier, which /metrics exports as gauges.
+"""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from metrics import CACHE_EVENTS
+
+
+class PublishCache:
+    """Bounded two-tier LRU of published JPEGs keyed by upload hash."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl: float,
+        disk_dir: str | None = None,
+        disk_max_bytes: int = 0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        # key -> (expires_at, data), least recently used first
+        self._memory: collections.OrderedDict[str, tuple[float, bytes]] = collections.OrderedDict()
+        self._memory_bytes = 0
+        # key -> size, oldest first
+        self._disk: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._disk_bytes = 0
+        self._counters = collections.Counter()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key_for(content: bytes, variant: str) -> str:
+        """Cache key for an upload published with a given template."""
+        digest = hashlib.sha256(content)
+        digest.update(b"\0" + variant.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        """Return the cached output for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count("hits_memory")
+                    return data
+                self._drop_memory(key)
+                self._count("expired")
+            on_disk = key in self._disk
+
+        if on_disk:
+            data = self._read_disk(key, now)
+            if data is not None:
+                with self._lock:
+                    self._count("hits_disk")
+                    self._store_memory(key, data, now)
+                return data
+
+        with self._lock:
+            self._count("misses")
+        return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """Remember a published output."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._count("stores")
+            self._store_memory(key, data, now)
+        if self.disk_dir:
+            self._write_disk(key, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _count(self, event: str) -> None:
+        self._counters[event] += 1
+        CACHE_EVENTS.labels("publish", event).inc()
+
+    # --- memory tier (caller holds the lock) ---
+
+    def _store_memory(self, key: str, data: bytes, now: float) -> None:
+        if len(data) > self.max_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (now + self.ttl, data)
+        self._memory_bytes += len(data)
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self._count("evictions_memory")
+
+    def _drop_memory(self, key: str) -> None:
+        _, data = self._memory.pop(key)
+        self._memory_bytes -= len(data)
+
+    # --- disk tier ---
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.jpg")
+
+    def _scan_disk(self) -> None:
+        """Index outputs left by a previous run, oldest first."""
+        found = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".jpg"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key: str, now: float) -> bytes | None:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl > now:
+                with open(path, "rb") as f:
+                    return f.read()
+            os.unlink(path)
+            with self._lock:
+                self._count("expired")
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._forget_disk(key)
+        return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        evicted = []
+        with self._lock:
+            self._forget_disk(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk and self._disk_bytes > self.disk_max_bytes:
+                oldest = next(iter(self._disk))
+                self._forget_disk(oldest)
+                evicted.append(oldest)
+                self._count("evictions_disk")
+        for old in evicted:
+            try:
+                os.unlink(self._path(old))
+            except FileNotFoundError:
+                pass
+
+    def _forget_disk(self, key: str) -> None:
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
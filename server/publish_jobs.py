@@ -0,0 +1,167 @@
+"""
+Asynchronous publish jobs for the Kibala privacy gateway.
+=========================================================
+
+POST /api/v1/publish/jobs accepts an upload and returns a job id at once;
+a fixed set of asyncio workers drains a bounded queue and runs each job
+through the normal publish pipeline.  Clients poll (or long-poll) the job
+until the signed JPEG is ready.  Finished jobs are kept for a retention
+window and then forgotten.
+
+The jobs kept for polling are bounded too: once `max_jobs` are tracked,
+or the signed results waiting to be fetched reach `max_result_bytes`,
+new submissions are refused (JobStoreFull) until the retention window
+frees room.
+
+This decouples how fast uploads arrive from how fast the worker pool can
+process them: bursts wait in the queue instead of holding HTTP
+connections open, and a full queue is rejected up front.
+"""
+
+import asyncio
+import contextvars
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """The job queue has no room for another upload."""
+
+
+class JobStoreFull(Exception):
+    """Too many jobs or result bytes are kept for polling."""
+
+
+class PublishJob:
+    """One upload moving through the queue."""
+
+    def __init__(self, content: bytes, publisher: str):
+        self.id = str(uuid.uuid4())
+        self.publisher = publisher
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        self.result: bytes | None = None
+        self.status_code: int | None = None
+        self.detail: str | None = None
+        self._content: bytes | None = content
+        self._finished = asyncio.Event()
+        # Run the job in the submitting request's context (e.g. its
+        # request id for logging), not the worker task's.
+        self._context = contextvars.copy_context()
+
+    async def wait(self, timeout: float) -> None:
+        """Block until the job finishes or `timeout` seconds pass."""
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self._finished.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def to_dict(self) -> dict:
+        info = {"job_id": self.id, "status": self.status}
+        if self.status == FAILED:
+            info["error"] = {"status_code": self.status_code, "detail": self.detail}
+        return info
+
+
+class PublishJobQueue:
+    """Bounded queue of publish jobs drained by a fixed number of workers."""
+
+    def __init__(
+        self,
+        process: Callable[[bytes, str], Awaitable[bytes]],
+        workers: int,
+        max_queued: int,
+        retention: float,
+        max_jobs: int,
+        max_result_bytes: int,
+    ):
+        self._process = process
+        self._workers = workers
+        self._retention = retention
+        self._max_jobs = max_jobs
+        self._max_result_bytes = max_result_bytes
+        self._result_bytes = 0
+        self._queue: asyncio.Queue[PublishJob] = asyncio.Queue(maxsize=max_queued)
+        self._jobs: dict[str, PublishJob] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"publish-job-worker-{i}")
+            for i in range(self._workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._purge(), name="publish-job-purge"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def result_bytes(self) -> int:
+        return self._result_bytes
+
+    def submit(self, content: bytes, publisher: str) -> PublishJob:
+        if len(self._jobs) >= self._max_jobs or self._result_bytes >= self._max_result_bytes:
+            raise JobStoreFull()
+        job = PublishJob(content, publisher)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull() from None
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> PublishJob | None:
+        return self._jobs.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = PROCESSING
+            try:
+                job.result = await asyncio.create_task(
+                    self._process(job._content, job.publisher), context=job._context,
+                )
+                job.status = DONE
+                job.status_code = 200
+                self._result_bytes += len(job.result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.status = FAILED
+                job.status_code = getattr(e, "status_code", 500)
+                job.detail = getattr(e, "detail", str(e))
+            finally:
+                job._content = None
+                job.finished_at = time.time()
+                job._finished.set()
+                self._queue.task_done()
+
+    async def _purge(self) -> None:
+        """Drop finished jobs once their retention window has passed."""
+        interval = max(1.0, min(self._retention / 4, 60.0))
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.time() - self._retention
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                job = self._jobs.pop(job_id)
+                if job.result is not None:
+                    self._result_bytes -= len(job.result)
@@ -5,13 +5,21 @@ Kibala C2PA Certificate Signing & Privacy Gateway Server
 FastAPI server with two roles:
 
 1. **Certificate Authority** — issues end-entity certificates to iOS devices
-   (POST /api/v1/certificates/sign).
+   (POST /api/v1/certificates/sign, or many at once via
+   POST /api/v1/certificates/sign/batch) and records each one in the
+   issuance store.
 
 2. **Privacy Gateway** — receives device-signed C2PA photos, validates the
    manifest against our Root CA, strips all metadata (EXIF, XMP, JUMBF),
    and re-signs with the gateway's own certificate. The output contains
    ONLY the gateway's signature — the photographer is fully anonymized
-   (POST /api/v1/publish).
+   (POST /api/v1/publish).  Slow or bursty clients can instead queue the
+   upload as a job and poll for the result
+   (POST /api/v1/publish/jobs, GET /api/v1/publish/{job_id}), and bursts
+   of photos can be sent in one request (POST /api/v1/publish/batch).
+
+Per-stage latency histograms, accept/reject counters and queue gauges are
+exported for Prometheus at GET /metrics.
 
 Required end-entity certificate extensions for C2PA:
   - BasicConstraints(ca=False)                     -- not a CA
@@ -19,127 +27,579 @@ Required end-entity certificate extensions for C2PA:
   - ExtendedKeyUsage(emailProtection)              -- required by C2PA spec
   - SubjectKeyIdentifier                           -- identifies the cert's key
   - AuthorityKeyIdentifier                         -- links to issuing CA
+(built once per Root CA by issuer.Issuer)
 
 Dependencies:
   pip install fastapi uvicorn cryptography c2pa-python python-multipart Pillow
+              prometheus-client
+  jpegtran from libjpeg-turbo (e.g. apt install libjpeg-turbo-progs) to
+  rotate photos losslessly; without it they are decoded and re-encoded
+  with Pillow, and a warning is logged at startup
+
+Configuration (environment variables):
+  KIBALA_HOST                bind address (default 0.0.0.0)
+  KIBALA_PORT                port (default 8080)
+  KIBALA_WORKERS             server processes (default 1); each loads the
+                             Root CA and the shared gateway identity from
+                             KIBALA_CERT_DIR at startup
+  KIBALA_CERT_DIR            directory holding kibala_Root_CA.crt and
+                             kibala_Root_Key.pem (default: ./cert_key); the
+                             gateway's own key and certificate are kept
+                             there too
+  KIBALA_GATEWAY_CERT_DAYS   validity of a newly issued gateway certificate
+                             (default 365)
+  KIBALA_GATEWAY_RENEW_DAYS  days before expiry the gateway certificate is
+                             renewed (default 30)
+  KIBALA_PUBLISH_EXECUTOR    "thread" (default) or "process" — pool type that
+                             runs the CPU-bound publish pipeline
+  KIBALA_PUBLISH_WORKERS     pool size (default: number of CPU cores)
+  KIBALA_PUBLISH_QUEUE_SIZE  only sets the default in-flight limit below,
+                             workers + this (default: 4 × workers); the
+                             queues themselves are bounded by admission
+  KIBALA_PUBLISH_MAX_IN_FLIGHT      publishes admitted at once, from reading
+                                    the upload to the response (default:
+                                    workers + queue size); see admission.py
+  KIBALA_PUBLISH_ADMISSION_QUEUE    publishes allowed to wait for admission
+                                    before new ones get 429 (default: max
+                                    in flight); batch files and async jobs
+                                    may fill only half of it
+  KIBALA_PUBLISH_ADMISSION_TIMEOUT  seconds a publish may wait for admission
+                                    before getting 503 (default 10)
+  KIBALA_PUBLISH_IN_MEMORY   "1" (default) keeps every pipeline stage in
+                             memory buffers; "0" spills the intermediate
+                             images to anonymous temp files instead
+  KIBALA_JPEGTRAN            path to libjpeg-turbo's jpegtran, used to apply
+                             EXIF orientation losslessly (default: jpegtran
+                             on PATH; empty disables it)
+  KIBALA_ORIENT_TRIM_EDGES   "1" drops partial MCU edges (< 16 px) so every
+                             rotation stays lossless; "0" (default) decodes
+                             and re-encodes those images with Pillow instead
+  KIBALA_MAX_UPLOAD_BYTES    largest request body /api/v1/publish reads
+                             before answering 413 (default 50 MiB)
+  KIBALA_MEMORY_BUDGET       bytes of estimated decode memory the publish
+                             pipelines may hold at once (default 1 GiB;
+                             0 disables it), split evenly between the
+                             server workers; see memory_budget.py
+  KIBALA_MEMORY_WAIT         seconds a publish waits for its share of that
+                             budget before getting 503 (default 30)
+  KIBALA_MANIFEST_TEMPLATES  JSON file of named gateway manifest templates;
+                             clients pick one with the "publisher" form
+                             field (see manifest_templates.py)
+  KIBALA_PUBLISH_CACHE_ENTRIES     retried uploads answered from the dedupe
+                                   cache (default 256; 0 disables it)
+  KIBALA_PUBLISH_CACHE_BYTES       memory budget of that cache (default 256 MiB)
+  KIBALA_PUBLISH_CACHE_TTL         seconds a published output stays cached
+                                   (default 900)
+  KIBALA_PUBLISH_CACHE_DIR         optional directory for an on-disk tier
+  KIBALA_PUBLISH_CACHE_DISK_BYTES  size cap of the on-disk tier (default 2 GiB)
+  KIBALA_VALIDATION_CACHE_ENTRIES  claim signatures and device certificates
+                                   whose trust outcome is cached (default
+                                   4096 each; 0 disables it)
+  KIBALA_VALIDATION_CACHE_TTL      seconds a claim signature's trust outcome
+                                   is reused (default 3600); a device
+                                   certificate stays verified until it expires
+  KIBALA_REVOCATION_POLL_INTERVAL  seconds between checks of the issuance
+                                   store for certificates revoked by other
+                                   processes (default 5)
+  KIBALA_PUBLISH_BATCH_MAX       most files accepted by /api/v1/publish/batch
+                                 (default 32)
+  KIBALA_PUBLISH_BATCH_MAX_BYTES largest /api/v1/publish/batch body, checked
+                                 while it is received (default: 4 × max
+                                 upload bytes)
+  KIBALA_PUBLISH_JOB_WORKERS     concurrent async publish jobs (default: workers)
+  KIBALA_PUBLISH_JOB_QUEUE_SIZE  async jobs allowed to wait before POSTs get
+                                 503 (default 64)
+  KIBALA_PUBLISH_JOB_RETENTION   seconds finished job results are kept for
+                                 polling (default 600)
+  KIBALA_PUBLISH_JOB_MAX_JOBS    most jobs tracked for polling at once before
+                                 POSTs get 429 (default 1024)
+  KIBALA_PUBLISH_JOB_RESULT_BYTES  signed results kept for polling before
+                                   POSTs get 429 (default 512 MiB)
+  KIBALA_CA_WORKERS          threads signing the CSRs of a batch request
+                             (default: number of CPU cores)
+  KIBALA_CSR_BATCH_MAX       most CSRs accepted by
+                             /api/v1/certificates/sign/batch (default 1000)
+  KIBALA_DEVICE_RENEW_DAYS   a CSR for a key that already holds a valid
+                             certificate gets that certificate back, unless
+                             it expires within this many days (default 30)
+  KIBALA_ISSUANCE_DB         SQLite database recording every issued device
+                             certificate (default: kibala_issuance.db in
+                             KIBALA_CERT_DIR); see issuance_store.py
+  KIBALA_ISSUANCE_BATCH      most rows the issuance writer commits per
+                             transaction (default 256)
+  KIBALA_LOG_LEVEL          request log level (default INFO); request logs
+                            are JSON lines on stdout, see structured_log.py
+  KIBALA_LOG_SAMPLE_RATE    fraction of per-request success lines kept
+                            (default 0.1); rejections and errors are always
+                            logged
 
 Usage:
   1. Run generate_root_ca.py first (if you haven't already)
-  2. python server.py
+  2. python server.py [--workers N] [--host HOST] [--port PORT]
   3. Server listens on http://0.0.0.0:8080
+
+With --workers N (or KIBALA_WORKERS) N server processes share the port,
+each with its own publish pool, dedupe cache and async job queue: a job
+can only be polled on the worker that accepted it, so run async jobs
+behind a single worker or a sticky proxy.  KIBALA_MEMORY_BUDGET is split
+between the workers; when another runner starts them (uvicorn server:app
+--workers N), set KIBALA_WORKERS=N as well.
 """
 
-from fastapi import FastAPI, HTTPException, File, UploadFile
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import FormData
 from pydantic import BaseModel
 from cryptography import x509
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+from cryptography.hazmat.primitives import serialization
 import c2pa
+import asyncio
+import contextlib
 import datetime
 import uuid
+import io
 import os
 import json
-import tempfile
 import shutil
-from PIL import Image, ImageOps
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+from jpeg_markers import (
+    JpegError, JpegHeaderScanner, lossless_orient, read_frame_header, strip_metadata,
+)
+from admission import AdmissionController, Overloaded, QueueFull
+from manifest_templates import ManifestTemplate, load_templates
+from memory_budget import (
+    MemoryBudget, MemoryBudgetExceeded, MemoryBudgetTimeout, estimate_publish_bytes,
+)
+from metrics import (
+    CACHE_BYTES, CACHE_ENTRIES, CSR_REQUESTS, CSR_STAGE_SECONDS, PUBLISH_JOB_QUEUE_DEPTH,
+    PUBLISH_REQUESTS, PUBLISH_STAGE_SECONDS, MetricsMiddleware, StageTimer, mark_worker_stopped,
+    observe_publish_stages, render as render_metrics, track_pipeline,
+)
+import generate_root_ca
+import manifest_report
+from gateway_identity import GatewayIdentityStore
+from issuance_store import IssuanceStore
+from issuer import Issuer
+from publish_cache import PublishCache
+from publish_jobs import DONE, FAILED, JobQueueFull, JobStoreFull, PublishJobQueue
+from streaming_upload import StreamingUpload, UploadError
+from structured_log import RequestIdMiddleware, get_logger, request_id, setup_logging
+from validation_cache import Signer, ValidationCache, certificate_fingerprint, signer_of
+
+# --- Server process settings ---
+HOST = os.environ.get("KIBALA_HOST", "0.0.0.0")
+PORT = int(os.environ.get("KIBALA_PORT", 8080))
+SERVER_WORKERS = int(os.environ.get("KIBALA_WORKERS", 1))
+
+# --- Publish worker pool settings ---
+PUBLISH_EXECUTOR = os.environ.get("KIBALA_PUBLISH_EXECUTOR", "thread")
+PUBLISH_WORKERS = int(os.environ.get("KIBALA_PUBLISH_WORKERS", os.cpu_count() or 1))
+PUBLISH_QUEUE_SIZE = int(os.environ.get("KIBALA_PUBLISH_QUEUE_SIZE", PUBLISH_WORKERS * 4))
+PUBLISH_MAX_IN_FLIGHT = int(
+    os.environ.get("KIBALA_PUBLISH_MAX_IN_FLIGHT", PUBLISH_WORKERS + PUBLISH_QUEUE_SIZE)
+)
+PUBLISH_ADMISSION_QUEUE = int(
+    os.environ.get("KIBALA_PUBLISH_ADMISSION_QUEUE", PUBLISH_MAX_IN_FLIGHT)
+)
+PUBLISH_ADMISSION_TIMEOUT = float(os.environ.get("KIBALA_PUBLISH_ADMISSION_TIMEOUT", 10))
+PUBLISH_IN_MEMORY = os.environ.get("KIBALA_PUBLISH_IN_MEMORY", "1") != "0"
+JPEGTRAN = os.environ.get("KIBALA_JPEGTRAN", shutil.which("jpegtran") or "")
+ORIENT_TRIM_EDGES = os.environ.get("KIBALA_ORIENT_TRIM_EDGES", "0") == "1"
+MAX_UPLOAD_BYTES = int(os.environ.get("KIBALA_MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+
+# --- Gateway certificate settings ---
+GATEWAY_CERT_DAYS = int(os.environ.get("KIBALA_GATEWAY_CERT_DAYS", 365))
+GATEWAY_RENEW_DAYS = int(os.environ.get("KIBALA_GATEWAY_RENEW_DAYS", 30))
+
+# --- Publish dedupe cache settings ---
+PUBLISH_CACHE_ENTRIES = int(os.environ.get("KIBALA_PUBLISH_CACHE_ENTRIES", 256))
+PUBLISH_CACHE_BYTES = int(os.environ.get("KIBALA_PUBLISH_CACHE_BYTES", 256 * 1024 * 1024))
+PUBLISH_CACHE_TTL = float(os.environ.get("KIBALA_PUBLISH_CACHE_TTL", 900))
+PUBLISH_CACHE_DIR = os.environ.get("KIBALA_PUBLISH_CACHE_DIR") or None
+PUBLISH_CACHE_DISK_BYTES = int(os.environ.get("KIBALA_PUBLISH_CACHE_DISK_BYTES", 2 * 1024 ** 3))
+
+# --- Trust-validation cache settings ---
+VALIDATION_CACHE_ENTRIES = int(os.environ.get("KIBALA_VALIDATION_CACHE_ENTRIES", 4096))
+VALIDATION_CACHE_TTL = float(os.environ.get("KIBALA_VALIDATION_CACHE_TTL", 3600))
+REVOCATION_POLL_INTERVAL = float(os.environ.get("KIBALA_REVOCATION_POLL_INTERVAL", 5))
+
+# --- Memory budget settings ---
+MEMORY_BUDGET = int(os.environ.get("KIBALA_MEMORY_BUDGET", 1024 ** 3))
+MEMORY_WAIT = float(os.environ.get("KIBALA_MEMORY_WAIT", 30))
+
+# --- Batch publish settings ---
+PUBLISH_BATCH_MAX = int(os.environ.get("KIBALA_PUBLISH_BATCH_MAX", 32))
+PUBLISH_BATCH_MAX_BYTES = int(
+    os.environ.get("KIBALA_PUBLISH_BATCH_MAX_BYTES", MAX_UPLOAD_BYTES * 4)
+)
+
+# --- Async publish job settings ---
+PUBLISH_JOB_WORKERS = int(os.environ.get("KIBALA_PUBLISH_JOB_WORKERS", PUBLISH_WORKERS))
+PUBLISH_JOB_QUEUE_SIZE = int(os.environ.get("KIBALA_PUBLISH_JOB_QUEUE_SIZE", 64))
+PUBLISH_JOB_RETENTION = float(os.environ.get("KIBALA_PUBLISH_JOB_RETENTION", 600))
+PUBLISH_JOB_MAX_JOBS = int(os.environ.get("KIBALA_PUBLISH_JOB_MAX_JOBS", 1024))
+PUBLISH_JOB_RESULT_BYTES = int(
+    os.environ.get("KIBALA_PUBLISH_JOB_RESULT_BYTES", 512 * 1024 * 1024)
+)
+PUBLISH_JOB_MAX_WAIT = 30.0  # longest long-poll a client may ask for
+
+# --- Device certificate settings ---
+DEVICE_CERT_DAYS = 365
+CA_WORKERS = int(os.environ.get("KIBALA_CA_WORKERS", os.cpu_count() or 1))
+CSR_BATCH_MAX = int(os.environ.get("KIBALA_CSR_BATCH_MAX", 1000))
+# A device re-enrolling with the same key gets its current certificate
+# back unless fewer than this many days of validity are left.
+DEVICE_RENEW_DAYS = int(os.environ.get("KIBALA_DEVICE_RENEW_DAYS", 30))
+
+# --- Issuance store settings ---
+ISSUANCE_DB = os.environ.get("KIBALA_ISSUANCE_DB") or None  # default: CERT_DIR
+ISSUANCE_BATCH = int(os.environ.get("KIBALA_ISSUANCE_BATCH", 256))
+
+# --- Logging settings ---
+LOG_LEVEL = os.environ.get("KIBALA_LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.environ.get("KIBALA_LOG_SAMPLE_RATE", 0.1))
+
+setup_logging(LOG_LEVEL, LOG_SAMPLE_RATE)
+ca_log = get_logger("ca")
+gateway_log = get_logger("gateway")
+
+# --- Key Material ---
+CERT_DIR = os.environ.get("KIBALA_CERT_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cert_key"
+)
+
+# Loaded by load_key_material(), once per server process.
+issuer: Issuer | None = None
+gateway_identity: GatewayIdentityStore | None = None
 
-app = FastAPI(title="Kibala C2PA CA & Gateway Server")
 
-# --- Load Root CA ---
-CERT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cert_key")
+class RootCANotFound(RuntimeError):
+    """The Root CA certificate or key is missing from CERT_DIR."""
 
-try:
-    with open(os.path.join(CERT_DIR, "kibala_Root_CA.crt"), "rb") as f:
-        root_cert = x509.load_pem_x509_certificate(f.read())
-    with open(os.path.join(CERT_DIR, "kibala_Root_Key.pem"), "rb") as f:
-        root_key = serialization.load_pem_private_key(f.read(), password=None)
+
+def load_key_material() -> None:
+    """Load the Root CA and the gateway identity into this process.
+
+    Runs in the lifespan of every server worker and in publish worker
+    processes; `python server.py` also calls it before starting the
+    workers, so a missing Root CA stops the server with one message
+    instead of crashing each worker.  The gateway pair is persisted in
+    CERT_DIR (see gateway_identity.py), so all workers sign with the
+    identity the first one loaded or issued.  Does nothing once loaded.
+    """
+    global issuer, gateway_identity
+    if gateway_identity is not None:
+        return
+
+    try:
+        with open(os.path.join(CERT_DIR, generate_root_ca.CERT_NAME), "rb") as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+        with open(os.path.join(CERT_DIR, generate_root_ca.KEY_NAME), "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), password=None)
+    except FileNotFoundError as e:
+        raise RootCANotFound(
+            f"Root CA files not found! Run generate_root_ca.py first.\n"
+            f"   Expected files in: {CERT_DIR}/ (missing {os.path.basename(e.filename)})"
+        ) from None
 
     # Validate root CA has BasicConstraints ca=True
     try:
-        bc = root_cert.extensions.get_extension_for_class(x509.BasicConstraints)
+        bc = cert.extensions.get_extension_for_class(x509.BasicConstraints)
         if not bc.value.ca:
             print("⚠️  WARNING: Root CA does not have ca=True! Re-run generate_root_ca.py")
     except x509.ExtensionNotFound:
         print("⚠️  WARNING: Root CA missing BasicConstraints! Re-run generate_root_ca.py")
 
     print("✅ Root CA loaded successfully.")
-    print(f"   Subject: {root_cert.subject}")
-    print(f"   Valid until: {root_cert.not_valid_after_utc}")
-except FileNotFoundError:
-    print("❌ Root CA files not found! Run generate_root_ca.py first.")
-    print(f"   Expected files in: {CERT_DIR}/")
-    exit(1)
-
-
-# --- Gateway End-Entity Certificate ---
-# Generated at startup, signed by Root CA.
-# Used by the /api/v1/publish endpoint to re-sign photos.
-
-gateway_key = ec.generate_private_key(ec.SECP256R1())
-
-gateway_cert = (
-    x509.CertificateBuilder()
-    .subject_name(x509.Name([
-        x509.NameAttribute(NameOID.COMMON_NAME, "imanmontajabi.com Gateway"),
-        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "imanmontajabi"),
-        x509.NameAttribute(NameOID.COUNTRY_NAME, "DE"),
-    ]))
-    .issuer_name(root_cert.subject)
-    .public_key(gateway_key.public_key())
-    .serial_number(x509.random_serial_number())
-    .not_valid_before(datetime.datetime.now(datetime.UTC) - datetime.timedelta(minutes=5))
-    .not_valid_after(datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=365))
-    .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
-    .add_extension(
-        x509.KeyUsage(
-            digital_signature=True, content_commitment=False,
-            key_encipherment=False, data_encipherment=False,
-            key_agreement=False, key_cert_sign=False, crl_sign=False,
-            encipher_only=False, decipher_only=False,
-        ),
-        critical=True,
-    )
-    .add_extension(
-        x509.ExtendedKeyUsage([ExtendedKeyUsageOID.EMAIL_PROTECTION]),
-        critical=False,
-    )
-    .add_extension(
-        x509.SubjectKeyIdentifier.from_public_key(gateway_key.public_key()),
-        critical=False,
-    )
-    .add_extension(
-        x509.AuthorityKeyIdentifier.from_issuer_public_key(root_key.public_key()),
-        critical=False,
+    print(f"   Subject: {cert.subject}")
+    print(f"   Valid until: {cert.not_valid_after_utc}")
+
+    # --- Gateway End-Entity Certificate ---
+    # Signed by the Root CA and kept in CERT_DIR next to it, so every restart
+    # and every worker re-signs photos with the same identity.  Renewed
+    # automatically before it expires (see gateway_identity.py).
+    # Used by the /api/v1/publish endpoint to re-sign photos.
+    root_issuer = Issuer(cert, key)
+    identity = GatewayIdentityStore(
+        CERT_DIR,
+        root_issuer,
+        validity=datetime.timedelta(days=GATEWAY_CERT_DAYS),
+        renew_before=datetime.timedelta(days=GATEWAY_RENEW_DAYS),
     )
-).sign(private_key=root_key, algorithm=hashes.SHA256())
+    gateway_cert = identity.identity.cert
+    print(f"✅ Gateway certificate {'issued' if identity.issued else 'loaded'}")
+    print(f"   Subject: {gateway_cert.subject}")
+    print(f"   Valid until: {gateway_cert.not_valid_after_utc}")
 
-# PEM certificate chain for c2pa signer: gateway EE cert → Root CA
-gateway_cert_pem = gateway_cert.public_bytes(serialization.Encoding.PEM).decode("utf-8")
-root_cert_pem = root_cert.public_bytes(serialization.Encoding.PEM).decode("utf-8")
-gateway_chain_pem = gateway_cert_pem.strip() + "\n" + root_cert_pem.strip()
+    issuer = root_issuer
+    gateway_identity = identity
 
-print("✅ Gateway certificate generated")
-print(f"   Subject: {gateway_cert.subject}")
 
 # --- Configure C2PA Trust Anchors ---
 # Tell the c2pa library to validate signatures against our Root CA only.
 # Photos NOT signed by a certificate issued by this Root CA will be rejected.
-c2pa.load_settings({
-    "verify": {
-        "verify_cert_anchors": True,
-    },
-    "trust": {
-        "trust_anchors": root_cert_pem,
-    },
-})
-print("🔒 C2PA trust anchors configured (only our Root CA is trusted)")
 
 
-def gateway_sign_callback(data: bytes) -> bytes:
-    """Sign data with the gateway's EC P-256 private key (ES256)."""
-    return gateway_key.sign(data, ec.ECDSA(hashes.SHA256()))
+def configure_c2pa_trust():
+    """Apply our trust anchors to the c2pa settings of the calling thread.
+
+    c2pa keeps these settings in thread-local storage, so every server
+    worker's event loop thread and every publish worker thread (or
+    process) must call this before reading manifests.  Cached trust
+    outcomes are dropped if the anchors differ from the ones they were
+    made under.
+    """
+    validation_cache.set_trust_anchors(issuer.root_pem)
+    c2pa.load_settings({
+        "verify": {
+            "verify_cert_anchors": True,
+        },
+        "trust": {
+            "trust_anchors": issuer.root_pem,
+        },
+    })
+
+
+# --- Gateway Manifest Templates ---
+# Compiled once; each publish only fills in the timestamp.
+manifest_templates = load_templates(os.environ.get("KIBALA_MANIFEST_TEMPLATES"))
+print(f"📝 Manifest templates loaded: {', '.join(sorted(manifest_templates))}")
+
+
+# --- Publish Dedupe Cache ---
+# Retries of the same upload get the already-signed output back.
+publish_cache = PublishCache(
+    max_entries=PUBLISH_CACHE_ENTRIES,
+    max_bytes=PUBLISH_CACHE_BYTES,
+    ttl=PUBLISH_CACHE_TTL,
+    disk_dir=PUBLISH_CACHE_DIR,
+    disk_max_bytes=PUBLISH_CACHE_DISK_BYTES,
+)
+
+
+# --- Memory Budget ---
+# Pipelines are admitted by the decode memory their SOF header implies
+# (see memory_budget.py).  Each server worker holds its own budget, so
+# KIBALA_MEMORY_BUDGET is split between them to bound the whole server.
+memory_budget = MemoryBudget(
+    max(1, MEMORY_BUDGET // max(1, SERVER_WORKERS)) if MEMORY_BUDGET > 0 else 0
+)
+
+
+# --- Trust-Validation Cache ---
+# Device manifests whose signing certificate already passed the Root CA
+# check are validated without repeating it (see validation_cache.py).  The
+# cache lives in the server process; publish workers are only told whether
+# the signer is known.
+validation_cache = ValidationCache(
+    max_entries=VALIDATION_CACHE_ENTRIES,
+    ttl=VALIDATION_CACHE_TTL,
+)
+
+_reader_contexts = threading.local()
+
+
+def _known_signer_context() -> c2pa.Context:
+    """This thread's c2pa context without the trust-anchor check, for
+    signers the validation cache already trusts.  Signatures and
+    content hash bindings are still verified.
+
+    Without the anchor check nothing ties the signing certificate to the
+    Root CA, so a read with this context is only sound together with
+    _summarize_verified(): the certificate c2pa verified the claim with
+    must be the cached one signer_of() identified.
+    """
+    context = getattr(_reader_contexts, "known_signer", None)
+    if context is None:
+        context = c2pa.Context(c2pa.Settings.from_dict({"verify": {"verify_trust": False}}))
+        _reader_contexts.known_signer = context
+    return context
+
+
+def _forget_revoked(entry) -> None:
+    validation_cache.forget_certificate(certificate_fingerprint(entry.der))
+
+
+async def _watch_revocations(store: IssuanceStore) -> None:
+    """Drop certificates revoked by other processes from the validation cache."""
+    since = datetime.datetime.now(datetime.UTC)
+    while True:
+        await asyncio.sleep(REVOCATION_POLL_INTERVAL)
+        try:
+            revoked = await asyncio.to_thread(store.revoked_since, since)
+        except sqlite3.Error as e:
+            gateway_log.warning("revocation check failed", error=str(e))
+            continue
+        for entry in revoked:
+            _forget_revoked(entry)
+            since = max(since, entry.revoked_at)
+
+
+# --- Gateway Signer Cache ---
+# The gateway key and certificate chain only change on renewal, so each
+# publish worker builds its c2pa Signer once and reuses it.  Signers are
+# kept per thread (the native handle is not shared between concurrent
+# signings) and rebuilt only when the identity changes.
+
+_signer_cache = threading.local()
+
+
+def gateway_signer() -> c2pa.Signer:
+    """Return this worker's c2pa Signer for the current gateway identity."""
+    identity = gateway_identity.current()
+    cached = getattr(_signer_cache, "entry", None)
+    if cached is not None and cached[0] is identity:
+        return cached[1]
+
+    # The callback is bound to this identity's key, so a renewal between
+    # building the signer and signing can never pair a key with the
+    # wrong certificate chain.
+    signer = c2pa.Signer.from_callback(
+        callback=identity.sign,
+        alg=c2pa.C2paSigningAlg.ES256,
+        certs=identity.chain_pem,
+    )
+    if cached is not None:
+        cached[1].close()
+    _signer_cache.entry = (identity, signer)
+    return signer
+
+
+# --- Publish Worker Pool ---
+# The publish pipeline is CPU-bound (manifest validation, Pillow decode and
+# re-encode, c2pa signing), so it runs in a pool instead of on the event
+# loop.  Admission control (admission.py) keeps what reaches it bounded:
+# uploads beyond the in-flight limit plus the admission queue are turned
+# away with 429, and ones that wait past the queue timeout with 503,
+# rather than piling up.
+
+class PublishError(Exception):
+    """Rejection raised by the publish pipeline, mapped to an HTTP error.
+
+    `reason` is a short machine-readable label used for the rejection
+    counters on /metrics.
+    """
+
+    def __init__(
+        self, status_code: int, detail: str, reason: str = "error", headers: dict | None = None,
+    ):
+        super().__init__(status_code, detail, reason)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+        self.headers = headers
+
+
+def _init_publish_worker(own_process: bool):
+    """Pool initializer: c2pa trust settings are per thread/process, and
+    the worker's signer is built here so no publish pays for it.
+
+    `own_process` is set by the process pool only: a uvicorn --workers
+    child has a parent process too, but its thread workers share its
+    logging and key material.
+    """
+    if own_process:
+        # A worker process needs its own log writer thread.
+        setup_logging(LOG_LEVEL, LOG_SAMPLE_RATE)
+        load_key_material()
+    configure_c2pa_trust()
+    gateway_signer()
+
+
+def _with_request_id(rid: str | None, fn, *args):
+    """Run fn(*args) in a pool worker with the caller's request id bound,
+    since run_in_executor does not carry context variables over."""
+    token = request_id.set(rid)
+    try:
+        return fn(*args)
+    finally:
+        request_id.reset(token)
+
+
+def _create_publish_executor() -> Executor:
+    if PUBLISH_EXECUTOR == "process":
+        return ProcessPoolExecutor(
+            max_workers=PUBLISH_WORKERS,
+            initializer=_init_publish_worker,
+            initargs=(True,),
+        )
+    if PUBLISH_EXECUTOR == "thread":
+        return ThreadPoolExecutor(
+            max_workers=PUBLISH_WORKERS,
+            thread_name_prefix="kibala-publish",
+            initializer=_init_publish_worker,
+            initargs=(False,),
+        )
+    raise ValueError(
+        f"KIBALA_PUBLISH_EXECUTOR must be 'thread' or 'process', got {PUBLISH_EXECUTOR!r}"
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_key_material()
+    configure_c2pa_trust()
+    print("🔒 C2PA trust anchors configured (only our Root CA is trusted)")
+    app.state.issuance_store = IssuanceStore(
+        ISSUANCE_DB or os.path.join(CERT_DIR, "kibala_issuance.db"),
+        batch_size=ISSUANCE_BATCH,
+    )
+    print(f"🗄️  Issuance store: {app.state.issuance_store.path}")
+    app.state.issuance_store.on_revoke(_forget_revoked)
+    revocation_watch = asyncio.create_task(
+        _watch_revocations(app.state.issuance_store), name="revocation-watch",
+    )
+    app.state.ca_executor = ThreadPoolExecutor(
+        max_workers=CA_WORKERS, thread_name_prefix="kibala-ca",
+    )
+    app.state.publish_executor = _create_publish_executor()
+    app.state.admission = AdmissionController(
+        max_in_flight=PUBLISH_MAX_IN_FLIGHT,
+        max_queued=PUBLISH_ADMISSION_QUEUE,
+        queue_timeout=PUBLISH_ADMISSION_TIMEOUT,
+    )
+    print(f"⚙️  Publish pool: {PUBLISH_WORKERS} {PUBLISH_EXECUTOR} workers")
+    if JPEGTRAN and shutil.which(JPEGTRAN):
+        print(f"🔄 Lossless orientation: {JPEGTRAN}")
+    else:
+        gateway_log.warning(
+            "jpegtran not found; rotated photos will be re-encoded with Pillow",
+            jpegtran=JPEGTRAN or None,
+        )
+    print(
+        f"🚦 Admission: {PUBLISH_MAX_IN_FLIGHT} publishes in flight, "
+        f"{PUBLISH_ADMISSION_QUEUE} queued for up to {PUBLISH_ADMISSION_TIMEOUT:g} s"
+    )
+    app.state.publish_jobs = PublishJobQueue(
+        process=_run_publish_job,
+        workers=PUBLISH_JOB_WORKERS,
+        max_queued=PUBLISH_JOB_QUEUE_SIZE,
+        retention=PUBLISH_JOB_RETENTION,
+        max_jobs=PUBLISH_JOB_MAX_JOBS,
+        max_result_bytes=PUBLISH_JOB_RESULT_BYTES,
+    )
+    app.state.publish_jobs.start()
+    try:
+        yield
+    finally:
+        await app.state.publish_jobs.stop()
+        revocation_watch.cancel()
+        await asyncio.gather(revocation_watch, return_exceptions=True)
+        app.state.publish_executor.shutdown(wait=True, cancel_futures=True)
+        app.state.ca_executor.shutdown(wait=True, cancel_futures=True)
+        app.state.issuance_store.close()
+        mark_worker_stopped()
+
+
+app = FastAPI(title="Kibala C2PA CA & Gateway Server", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 
 # --- Models ---
@@ -156,97 +616,163 @@ class SigningResponse(BaseModel):
     expires_at: str
 
 
+class BatchSigningRequest(BaseModel):
+    requests: list[SigningRequest]
+
+
+class BatchSigningResult(BaseModel):
+    index: int
+    certificate: SigningResponse | None = None
+    error: str | None = None
+
+
+class BatchSigningResponse(BaseModel):
+    results: list[BatchSigningResult]
+
+
 # --- Endpoint ---
 
 @app.post("/api/v1/certificates/sign", response_model=SigningResponse)
 async def sign_csr(req: SigningRequest):
+    loop = asyncio.get_running_loop()
     try:
-        csr = x509.load_pem_x509_csr(req.csr.encode("utf-8"))
-
-        valid_from = datetime.datetime.now(datetime.UTC) - datetime.timedelta(minutes=5)
-        valid_to = valid_from + datetime.timedelta(days=365)
-
-        builder = (
-            x509.CertificateBuilder()
-            .subject_name(csr.subject)
-            .issuer_name(root_cert.subject)
-            .public_key(csr.public_key())
-            .serial_number(x509.random_serial_number())
-            .not_valid_before(valid_from)
-            .not_valid_after(valid_to)
-            # ---- Extensions required by C2PA ----
-            #
-            # 1. Not a CA
-            .add_extension(
-                x509.BasicConstraints(ca=False, path_length=None),
-                critical=True,
-            )
-            # 2. Key usage: digital signatures only
-            .add_extension(
-                x509.KeyUsage(
-                    digital_signature=True,
-                    content_commitment=False,
-                    key_encipherment=False,
-                    data_encipherment=False,
-                    key_agreement=False,
-                    key_cert_sign=False,
-                    crl_sign=False,
-                    encipher_only=False,
-                    decipher_only=False,
-                ),
-                critical=True,
-            )
-            # 3. Extended Key Usage — emailProtection is required by C2PA
-            .add_extension(
-                x509.ExtendedKeyUsage([ExtendedKeyUsageOID.EMAIL_PROTECTION]),
-                critical=False,
-            )
-            # 4. Subject Key Identifier — identifies this cert's public key
-            .add_extension(
-                x509.SubjectKeyIdentifier.from_public_key(csr.public_key()),
-                critical=False,
-            )
-            # 5. Authority Key Identifier — links to the issuing Root CA
-            .add_extension(
-                x509.AuthorityKeyIdentifier.from_issuer_public_key(
-                    root_key.public_key()
-                ),
-                critical=False,
-            )
+        # The issuance store lookup is blocking SQLite, so like the batch
+        # endpoint this runs in the CA pool rather than on the event loop.
+        return await loop.run_in_executor(
+            app.state.ca_executor,
+            _with_request_id, request_id.get(),
+            _issue_device_certificate, req.csr, req.metadata,
         )
+    except Exception as e:
+        ca_log.error("CSR signing failed", error=str(e))
+        CSR_REQUESTS.labels("error").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/v1/certificates/sign/batch", response_model=BatchSigningResponse)
+async def sign_csr_batch(req: BatchSigningRequest):
+    """
+    Sign many CSRs in one request, e.g. to provision a fleet or test farm.
 
-        certificate = builder.sign(
-            private_key=root_key,
-            algorithm=hashes.SHA256(),
+    The CSRs are signed in parallel in the CA worker pool.  Results come
+    back in request order, each with the same certificate fields as
+    /api/v1/certificates/sign or an `error`; one bad CSR does not fail the
+    batch.  Repeated CSRs are signed once.
+    """
+    if len(req.requests) > CSR_BATCH_MAX:
+        CSR_REQUESTS.labels("batch_too_large").inc()
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(req.requests)} CSRs (max {CSR_BATCH_MAX}).",
         )
 
-        # Build the PEM chain: end-entity cert first, then root CA
-        cert_pem = certificate.public_bytes(serialization.Encoding.PEM).decode("utf-8")
-        root_pem = root_cert.public_bytes(serialization.Encoding.PEM).decode("utf-8")
-        full_chain = cert_pem.strip() + "\n" + root_pem.strip()
+    loop = asyncio.get_running_loop()
+    rid = request_id.get()
+    futures = {}
+    for item in req.requests:
+        if item.csr not in futures:
+            futures[item.csr] = loop.run_in_executor(
+                app.state.ca_executor,
+                _with_request_id, rid,
+                _issue_device_certificate, item.csr, item.metadata,
+            )
+    outcomes = dict(zip(futures, await asyncio.gather(*futures.values(), return_exceptions=True)))
 
-        cert_id = str(uuid.uuid4())
-        serial = str(certificate.serial_number)
+    results = []
+    for index, item in enumerate(req.requests):
+        outcome = outcomes[item.csr]
+        if isinstance(outcome, Exception):
+            ca_log.error("CSR signing failed", index=index, error=str(outcome))
+            CSR_REQUESTS.labels("error").inc()
+            results.append(BatchSigningResult(index=index, error=str(outcome)))
+        else:
+            results.append(BatchSigningResult(index=index, certificate=outcome))
+    ca_log.info("CSR batch signed", csrs=len(req.requests), sample=True)
+    return BatchSigningResponse(results=results)
 
-        print(f"✅ Issued certificate {cert_id} (serial: {serial[:16]}...)")
 
+def _issue_device_certificate(csr_pem: str, metadata: dict | None) -> SigningResponse:
+    """Certificate for one device CSR: reused from the issuance store or
+    freshly signed by the Root CA.  Runs in the CA pool, since the
+    issuance store lookup blocks."""
+    with CSR_STAGE_SECONDS.labels("parse").time():
+        csr = x509.load_pem_x509_csr(csr_pem.encode("utf-8"))
+        ski = x509.SubjectKeyIdentifier.from_public_key(csr.public_key())
+
+    # A device that re-enrolls (app reset, retried request) sends the
+    # same Secure Enclave key again: hand back its current certificate
+    # instead of signing another one, unless that one is due for renewal
+    # or was issued by a Root CA that has since been rotated out.
+    now = datetime.datetime.now(datetime.UTC)
+    with CSR_STAGE_SECONDS.labels("lookup").time():
+        existing = app.state.issuance_store.find_current(
+            ski.digest,
+            csr.subject.rfc4514_string(),
+            aki=issuer.authority_key_identifier.key_identifier,
+            valid_past=now + datetime.timedelta(days=DEVICE_RENEW_DAYS),
+        )
+    if existing is not None:
+        ca_log.info(
+            "certificate reused", certificate_id=existing.certificate_id, serial=existing.serial,
+        )
+        CSR_REQUESTS.labels("reused").inc()
         return SigningResponse(
-            certificate_chain=full_chain,
-            certificate_id=cert_id,
-            serial_number=serial,
-            expires_at=valid_to.isoformat(),
+            certificate_chain=issuer.chain_pem(existing.certificate),
+            certificate_id=existing.certificate_id,
+            serial_number=existing.serial,
+            expires_at=existing.not_valid_after.isoformat(),
         )
 
-    except Exception as e:
-        print(f"❌ Error signing CSR: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # Issuer holds the extensions C2PA requires (see issuer.py); only the
+    # subject's key identifier and the signature are computed here.
+    with CSR_STAGE_SECONDS.labels("sign").time():
+        certificate = issuer.issue(
+            csr.subject, csr.public_key(), datetime.timedelta(days=DEVICE_CERT_DAYS), ski=ski,
+        )
+
+    cert_id = str(uuid.uuid4())
+    serial = str(certificate.serial_number)
+
+    # Recorded by the store's writer thread, off the request path.
+    app.state.issuance_store.record(certificate, cert_id, metadata)
+
+    ca_log.info("certificate issued", certificate_id=cert_id, serial=serial)
+    CSR_REQUESTS.labels("issued").inc()
+
+    return SigningResponse(
+        certificate_chain=issuer.chain_pem(certificate),
+        certificate_id=cert_id,
+        serial_number=serial,
+        expires_at=certificate.not_valid_after_utc.isoformat(),
+    )
 
 
 # --- Publish (Redaction Gateway) Endpoint ---
 
 
-@app.post("/api/v1/publish")
-async def publish_photo(file: UploadFile = File(...)):
+# The photo endpoints parse their multipart body themselves (see
+# streaming_upload.py), so the schema is declared for the docs by hand.
+_PHOTO_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "publisher": {"type": "string", "default": "default"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/api/v1/publish", openapi_extra=_PHOTO_UPLOAD_BODY)
+async def publish_photo(request: Request):
     """
     Privacy-preserving redaction gateway.
 
@@ -256,158 +782,826 @@ async def publish_photo(file: UploadFile = File(...)):
     2. Validates the manifest against our Root CA trust anchor.
        - Rejects images that were NOT signed by a Kibala device.
     3. Strips ALL metadata (EXIF, XMP, JUMBF/C2PA, GPS, camera info)
-       using Pillow, producing a clean JPEG with no provenance history.
+       at the JPEG segment level, producing a clean JPEG with no
+       provenance history.  Pillow only re-encodes when the EXIF
+       orientation has to be baked into the pixels.
     4. Signs the clean image with a fresh manifest using the gateway's
        certificate. The output shows ONLY the gateway's signature —
        the photographer's identity is completely anonymized.
+
+    Steps 2–4 run in the publish worker pool so the event loop stays free
+    to serve other requests while photos are processed.  The optional
+    "publisher" form field selects a named gateway manifest template.
+
+    The multipart body is parsed as it streams in.  As soon as the JPEG
+    header segments have arrived, uploads without a C2PA manifest (400)
+    or with an untrusted signature (403) are rejected without reading
+    the rest of the image.
+
+    Retried uploads (same bytes, same template) are answered from the
+    dedupe cache without running the pipeline again.
+
+    Under load, publishes beyond KIBALA_PUBLISH_MAX_IN_FLIGHT wait in a
+    bounded queue; when it is full (429) or the wait times out (503) the
+    upload is turned away with a Retry-After.
+    """
+    _check_declared_length(request, "publish")
+
+    try:
+        async with app.state.admission.admit():
+            try:
+                content, publisher = await _receive_upload(request)
+                gateway_log.info("upload received", bytes=len(content), sample=True)
+                template = _publisher_template(publisher)
+
+                signed_data, cache_hit = await _publish(content, template)
+                PUBLISH_REQUESTS.labels("publish", "cache_hit" if cache_hit else "published").inc()
+
+                # ── 5. Return re-signed image ──
+                return _published_response(signed_data, cache="hit" if cache_hit else "miss")
+
+            except PublishError as e:
+                PUBLISH_REQUESTS.labels("publish", e.reason).inc()
+                raise HTTPException(
+                    status_code=e.status_code, detail=e.detail, headers=e.headers,
+                ) from e
+            except UploadError as e:
+                outcome = "too_large" if e.status_code == 413 else "bad_upload"
+                PUBLISH_REQUESTS.labels("publish", outcome).inc()
+                raise HTTPException(status_code=e.status_code, detail=e.detail) from e
+            except HTTPException:
+                PUBLISH_REQUESTS.labels("publish", "bad_request").inc()
+                raise
+            except Exception as e:
+                gateway_log.exception("publish failed")
+                PUBLISH_REQUESTS.labels("publish", "error").inc()
+                raise HTTPException(status_code=500, detail=str(e)) from e
+    except Overloaded as e:
+        raise _shed("publish", e) from e
+
+
+def _check_declared_length(request: Request, endpoint: str, limit: int | None = None) -> None:
+    """413 before reading a body whose Content-Length is already over `limit`
+    (default: the single-upload limit)."""
+    limit = MAX_UPLOAD_BYTES if limit is None else limit
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        PUBLISH_REQUESTS.labels(endpoint, "too_large").inc()
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload exceeds {limit:,} bytes.",
+        )
+
+
+def _shed(endpoint: str, e: Overloaded) -> HTTPException:
+    """The 429/503 answer for a publish turned away by admission control."""
+    if isinstance(e, QueueFull):
+        PUBLISH_REQUESTS.labels(endpoint, "queue_full").inc()
+        status_code, detail = 429, "Gateway is busy: too many publishes queued, retry later."
+    else:
+        PUBLISH_REQUESTS.labels(endpoint, "queue_timeout").inc()
+        status_code, detail = 503, "Gateway is busy: the publish could not start in time, retry later."
+    return HTTPException(
+        status_code=status_code, detail=detail, headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+async def _receive_upload(request: Request) -> tuple[bytes, str]:
+    """Stream the multipart body in, screening the photo on the way.
+
+    Returns (photo bytes, publisher); raises UploadError or PublishError
+    as soon as the upload can be turned away.
+    """
+    upload = StreamingUpload(
+        request.headers.get("content-type", ""), "file", MAX_UPLOAD_BYTES,
+        text_fields=("publisher",),
+    )
+    screened = False
+    started = time.perf_counter()
+    screen_seconds = 0.0
+    async for chunk in request.stream():
+        try:
+            upload.write(chunk)
+        except JpegError as e:
+            raise PublishError(
+                status_code=400,
+                detail=f"Rejected: malformed JPEG — {e}",
+                reason="malformed_jpeg",
+            )
+        if not screened and upload.scanner.complete:
+            screened = True
+            screen_started = time.perf_counter()
+            try:
+                await _screen_manifest(upload.scanner)
+            finally:
+                screen_seconds = time.perf_counter() - screen_started
+                PUBLISH_STAGE_SECONDS.labels("screen").observe(screen_seconds)
+    content = upload.finish()
+    PUBLISH_STAGE_SECONDS.labels("upload_read").observe(
+        time.perf_counter() - started - screen_seconds
+    )
+    if not screened:
+        raise PublishError(
+            status_code=400,
+            detail="Rejected: malformed JPEG — no image data found",
+            reason="malformed_jpeg",
+        )
+    return content, upload.fields.get("publisher", "default")
+
+
+async def _screen_manifest(scanner: JpegHeaderScanner) -> None:
+    """Early rejection from the JPEG header segments alone (step 2, cheap part).
+
+    The full validation still runs in the pipeline once the whole image is
+    in; this only turns away uploads that can never pass it.
+    """
+    if not scanner.has_c2pa:
+        gateway_log.info("upload rejected", reason="no_manifest", early=True)
+        raise PublishError(
+            status_code=400,
+            detail="Rejected: no C2PA manifests found in the uploaded image.",
+            reason="no_manifest",
+        )
+
+    manifest_data = scanner.manifest_data()
+    signer = signer_of(manifest_data)
+    if await _known_signer(signer):
+        return
+    failures = validation_cache.get(signer)
+    if failures is None:
+        loop = asyncio.get_running_loop()
+        failures = await loop.run_in_executor(
+            app.state.publish_executor,
+            _with_request_id, request_id.get(), _manifest_trust_failures, manifest_data, signer,
+        )
+        validation_cache.put(signer, failures)
+    if failures:
+        gateway_log.info(
+            "upload rejected", reason="validation_failed", early=True, validation_status=failures,
+        )
+        raise PublishError(
+            status_code=403,
+            detail=f"Rejected: C2PA validation failed — {failures}",
+            reason="validation_failed",
+        )
+
+
+def _trust_probe_jpeg() -> bytes:
+    probe = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(probe, format="JPEG")
+    return probe.getvalue()
+
+
+# Stand-in asset for checking a manifest store on its own: only the
+# signature and certificate chain are judged, never the content hashes.
+_TRUST_PROBE_JPEG = _trust_probe_jpeg()
+_TRUST_FAILURE_PREFIXES = ("signingCredential.", "claimSignature.")
+
+
+def _manifest_trust_failures(manifest_data: bytes, signer: Signer | None = None) -> list:
+    """Signature/trust validation errors of a detached manifest store."""
+    try:
+        with c2pa.Reader(
+            "image/jpeg", io.BytesIO(_TRUST_PROBE_JPEG), manifest_data=manifest_data,
+        ) as reader:
+            report = reader.json()
+    except Exception as e:
+        raise PublishError(
+            status_code=400,
+            detail=f"Cannot read C2PA manifest from uploaded image: {e}",
+            reason="unreadable_manifest",
+        )
+    summary = _summarize_verified(report, signer)
+    return [
+        status for status in summary.validation_status or []
+        if status.get("code", "").startswith(_TRUST_FAILURE_PREFIXES)
+    ]
+
+
+def _summarize_verified(report: str, signer: Signer | None) -> manifest_report.ManifestSummary:
+    """Summary of a c2pa report, checking that the certificate c2pa verified
+    the claim signature with is the one signer_of() found.
+
+    The validation cache trusts certificates by that fingerprint, so a
+    manifest store the two read differently is rejected rather than let
+    one certificate's verdict stand for another.  So is one whose signing
+    certificate signer_of() could not read at all: without its serial the
+    revocation check could not run.
+    """
+    try:
+        summary, signature_info = manifest_report.summarize_signed(report)
+    except ValueError as e:
+        raise PublishError(
+            status_code=400,
+            detail=f"Cannot read C2PA manifest from uploaded image: {e}",
+            reason="unreadable_manifest",
+        )
+    serial = signer.serial if signer is not None else None
+    verified_serial = signature_info.get("cert_serial_number")
+    if summary.has_manifests and (serial is None or verified_serial != serial):
+        gateway_log.warning(
+            "upload rejected", reason="signer_mismatch",
+            serial=serial, verified_serial=verified_serial,
+        )
+        raise PublishError(
+            status_code=403,
+            detail="Rejected: the manifest's signing certificate is ambiguous.",
+            reason="signer_mismatch",
+        )
+    return summary
+
+
+def _manifest_store_of(content: bytes) -> bytes:
+    """The embedded C2PA manifest store, scanning only the header segments."""
+    scanner = JpegHeaderScanner()
+    view = memoryview(content)
+    for offset in range(0, len(content), 64 * 1024):
+        if scanner.feed(view[offset:offset + 64 * 1024]):
+            break
+    return scanner.manifest_data()
+
+
+async def _known_signer(signer: Signer | None) -> bool:
+    """Whether the signer's certificate chain is already verified.
+
+    A revoked device certificate is turned away here: once dropped from
+    the cache it would otherwise still pass c2pa's own chain check.  A
+    signer whose certificate serial could not be read is never known; the
+    full validation then rejects it (see _summarize_verified()).
+    """
+    if signer is None or signer.serial is None:
+        return False
+    if validation_cache.certificate_trusted(signer):
+        return True
+    issued = await asyncio.to_thread(app.state.issuance_store.get, signer.serial)
+    # Serials are ours to assign, so a revoked one is refused whatever
+    # certificate carries it.
+    if issued is not None and issued.revoked_at is not None:
+        gateway_log.info("upload rejected", reason="revoked", serial=signer.serial)
+        raise PublishError(
+            status_code=403,
+            detail="Rejected: the device certificate has been revoked.",
+            reason="revoked",
+        )
+    return validation_cache.get(signer) == []
+
+
+# --- Batch Publish ---
+
+
+_BATCH_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["files"],
+                    "properties": {
+                        "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                        "publisher": {"type": "string", "default": "default"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/api/v1/publish/batch", openapi_extra=_BATCH_UPLOAD_BODY)
+async def publish_batch(request: Request):
+    """
+    Publish several photos from one multipart request.
+
+    Every file goes through the same pipeline as /api/v1/publish, in
+    parallel across the worker pool.  The response is streamed as
+    multipart/mixed, one part per file in the order they finish:
+
+      X-Kibala-Index:  position of the file in the request
+      X-Kibala-Status: 200 with the signed JPEG as the body, or the
+                       error status with a JSON {"detail": ...} body
+
+    Each file is held to the same size limit as a single upload, and the
+    whole body to KIBALA_PUBLISH_BATCH_MAX_BYTES, checked before any of it
+    is spooled and again as it arrives.  The
+    batch is turned away with 429 if the admission queue is full when it
+    arrives; its files are then admitted patiently (see admission.py):
+    they may fill only part of the admission queue and wait out any
+    Retry-After instead of failing.
     """
-    temp_dir = tempfile.mkdtemp(prefix="kibala_gw_")
+    _check_declared_length(request, "batch", PUBLISH_BATCH_MAX_BYTES)
+    form = await _receive_batch(request)
+    try:
+        files = [f for f in form.getlist("files") if not isinstance(f, str)]
+        if not files:
+            PUBLISH_REQUESTS.labels("batch", "bad_request").inc()
+            raise HTTPException(status_code=422, detail="Expected one or more files under 'files'.")
+        publisher = form.get("publisher", "default")
+        template = _publisher_template(publisher if isinstance(publisher, str) else "default")
+        if len(files) > PUBLISH_BATCH_MAX:
+            PUBLISH_REQUESTS.labels("batch", "too_large").inc()
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch too large: {len(files)} files (max {PUBLISH_BATCH_MAX}).",
+            )
+        admission = app.state.admission
+        if admission.queue_full:
+            raise _shed("batch", QueueFull(admission.retry_after))
+    except HTTPException:
+        await form.close()
+        raise
+
+    gateway_log.info("batch received", files=len(files), sample=True)
+    boundary = uuid.uuid4().hex
+    tasks = [
+        asyncio.create_task(_publish_batch_item(i, upload, template))
+        for i, upload in enumerate(files)
+    ]
+
+    async def parts():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, filename, status_code, body = await next_done
+                if status_code == 200:
+                    headers = (
+                        "Content-Type: image/jpeg\r\n"
+                        f'Content-Disposition: attachment; filename="{filename}"\r\n'
+                    )
+                else:
+                    headers = "Content-Type: application/json\r\n"
+                headers += f"X-Kibala-Index: {index}\r\nX-Kibala-Status: {status_code}\r\n"
+                yield f"--{boundary}\r\n{headers}\r\n".encode("utf-8")
+                yield body
+                yield b"\r\n"
+            yield f"--{boundary}--\r\n".encode("utf-8")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        parts(), media_type=f"multipart/mixed; boundary={boundary}",
+        background=BackgroundTask(form.close),
+    )
+
+
+async def _receive_batch(request: Request) -> FormData:
+    """Parse a batch body, refusing it with 413 once it passes
+    KIBALA_PUBLISH_BATCH_MAX_BYTES (Content-Length may be absent or wrong)."""
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get("body", b""))
+        if received > PUBLISH_BATCH_MAX_BYTES:
+            raise UploadError(413, f"Upload exceeds {PUBLISH_BATCH_MAX_BYTES:,} bytes.")
+        return message
+
     try:
-        # ── 1. Save uploaded file ──
-        input_path = os.path.join(temp_dir, "input.jpg")
-        content = await file.read()
-        with open(input_path, "wb") as f:
-            f.write(content)
-        print(f"📥 Received upload: {len(content):,} bytes")
+        return await Request(request.scope, receive).form()
+    except UploadError as e:
+        PUBLISH_REQUESTS.labels("batch", "too_large").inc()
+        raise HTTPException(status_code=e.status_code, detail=e.detail) from e
+
+
+async def _publish_batch_item(
+    index: int, upload: UploadFile, template: ManifestTemplate,
+) -> tuple[int, str, int, bytes]:
+    """Publish one batch file; returns (index, filename, status, body)."""
+    stem = os.path.splitext(os.path.basename(upload.filename or ""))[0]
+    stem = "".join(c for c in stem if c.isalnum() or c in "-_.") or f"photo_{index}"
+    filename = f"{stem}_published.jpg"
+
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        PUBLISH_REQUESTS.labels("batch", "too_large").inc()
+        detail = f"Upload exceeds {MAX_UPLOAD_BYTES:,} bytes."
+        return index, filename, 413, json.dumps({"detail": detail}).encode("utf-8")
+
+    async with app.state.admission.admit(patient=True):
+        try:
+            content = await upload.read()
+            signed_data, cache_hit = await _publish(content, template)
+            PUBLISH_REQUESTS.labels("batch", "cache_hit" if cache_hit else "published").inc()
+            return index, filename, 200, signed_data
+        except PublishError as e:
+            PUBLISH_REQUESTS.labels("batch", e.reason).inc()
+            return index, filename, e.status_code, json.dumps({"detail": e.detail}).encode("utf-8")
+        except Exception as e:
+            gateway_log.exception("publish failed", index=index)
+            PUBLISH_REQUESTS.labels("batch", "error").inc()
+            return index, filename, 500, json.dumps({"detail": str(e)}).encode("utf-8")
+
+
+# --- Async Publish Jobs ---
+
+
+@app.post("/api/v1/publish/jobs", status_code=202, openapi_extra=_PHOTO_UPLOAD_BODY)
+async def submit_publish_job(request: Request):
+    """
+    Queue an upload for publishing and return a job id immediately.
+
+    The same Validate → Strip → Re-sign pipeline as /api/v1/publish runs
+    in the background; fetch the result from GET /api/v1/publish/{job_id}.
+    The upload is read and screened like /api/v1/publish's, with the same
+    size limit.
+    """
+    _check_declared_length(request, "job")
+    try:
+        content, publisher = await _receive_upload(request)
+    except PublishError as e:
+        PUBLISH_REQUESTS.labels("job", e.reason).inc()
+        raise HTTPException(status_code=e.status_code, detail=e.detail) from e
+    except UploadError as e:
+        PUBLISH_REQUESTS.labels("job", "too_large" if e.status_code == 413 else "bad_upload").inc()
+        raise HTTPException(status_code=e.status_code, detail=e.detail) from e
+    _publisher_template(publisher)
+    try:
+        job = app.state.publish_jobs.submit(content, publisher)
+        PUBLISH_JOB_QUEUE_DEPTH.set(app.state.publish_jobs.depth)
+    except JobQueueFull:
+        PUBLISH_REQUESTS.labels("job", "busy").inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Gateway is busy: publish job queue is full, retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+    except JobStoreFull:
+        PUBLISH_REQUESTS.labels("job", "store_full").inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many publish job results are waiting to be fetched, retry later.",
+            headers={"Retry-After": str(max(1, round(PUBLISH_JOB_RETENTION / 4)))},
+        )
+
+    gateway_log.info("publish job queued", job_id=job.id, bytes=len(content), sample=True)
+    return {**job.to_dict(), "status_url": f"/api/v1/publish/{job.id}"}
 
+
+@app.get("/api/v1/publish/{job_id}")
+async def get_publish_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=PUBLISH_JOB_MAX_WAIT),
+):
+    """
+    Poll a publish job; `wait` long-polls up to that many seconds.
+
+    Returns the signed JPEG once the job is done, 202 with the job status
+    while it is queued or processing, and the pipeline's error status
+    (400/403/500) if it failed.
+    """
+    job = app.state.publish_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired publish job.")
+
+    await job.wait(wait)
+
+    if job.status == DONE:
+        return _published_response(job.result)
+    if job.status == FAILED:
+        raise HTTPException(status_code=job.status_code, detail=job.detail)
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+
+async def _run_publish_job(content: bytes, publisher: str) -> bytes:
+    """Job worker body: admitted through the bounded queue like any publish,
+    but waits out a Retry-After instead of being turned away."""
+    PUBLISH_JOB_QUEUE_DEPTH.set(app.state.publish_jobs.depth)
+    async with app.state.admission.admit(patient=True):
+        try:
+            signed_data, cache_hit = await _publish(
+                content, manifest_templates[publisher], memory_wait=None,
+            )
+            PUBLISH_REQUESTS.labels("job", "cache_hit" if cache_hit else "published").inc()
+            return signed_data
+        except PublishError as e:
+            PUBLISH_REQUESTS.labels("job", e.reason).inc()
+            raise
+        except Exception as e:
+            gateway_log.exception("publish failed")
+            PUBLISH_REQUESTS.labels("job", "error").inc()
+            raise
+
+
+def _publisher_template(publisher: str) -> ManifestTemplate:
+    template = manifest_templates.get(publisher)
+    if template is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown publisher template: {publisher!r}",
+        )
+    return template
+
+
+async def _publish(
+    content: bytes, template: ManifestTemplate, memory_wait: float | None = MEMORY_WAIT,
+) -> tuple[bytes, bool]:
+    """Publish one upload via the dedupe cache and the worker pool.
+
+    The pipeline waits up to `memory_wait` seconds (None: as long as it
+    takes) for its share of the memory budget.  Returns (signed JPEG,
+    served from cache); raises PublishError.
+    """
+    # Checked first so a revoked device is not served its earlier output.
+    signer = None
+    with contextlib.suppress(JpegError):
+        signer = signer_of(_manifest_store_of(content))
+    known_signer = await _known_signer(signer)
+
+    cache_key = None
+    if publish_cache.enabled:
+        with PUBLISH_STAGE_SECONDS.labels("cache_lookup").time():
+            cache_key = await asyncio.to_thread(
+                PublishCache.key_for, content, template.name,
+            )
+            cached = await asyncio.to_thread(publish_cache.get, cache_key)
+        if cached is not None:
+            gateway_log.info("dedupe cache hit", bytes=len(cached), sample=True)
+            return cached, True
+
+    timestamp = datetime.datetime.now(datetime.UTC).isoformat() + "Z"
+    manifest_json = template.render(when=timestamp)
+
+    loop = asyncio.get_running_loop()
+    async with _memory_reservation(content, memory_wait):
+        with track_pipeline(PUBLISH_WORKERS):
+            signed_data, timings = await loop.run_in_executor(
+                app.state.publish_executor,
+                _with_request_id, request_id.get(),
+                _publish_pipeline, content, manifest_json, time.time(), signer, known_signer,
+            )
+    observe_publish_stages(timings)
+    if not known_signer:
+        validation_cache.put(signer, [])
+
+    if cache_key is not None:
+        await asyncio.to_thread(publish_cache.put, cache_key, signed_data)
+    return signed_data, False
+
+
+@contextlib.asynccontextmanager
+async def _memory_reservation(content: bytes, timeout: float | None):
+    """Admit one pipeline against the memory budget by its SOF dimensions,
+    before any pixel is decoded."""
+    try:
+        frame = read_frame_header(content)
+    except JpegError as e:
+        raise PublishError(
+            status_code=400,
+            detail=f"Rejected: malformed JPEG — {e}",
+            reason="malformed_jpeg",
+        )
+    estimate = estimate_publish_bytes(frame, len(content))
+    try:
+        async with memory_budget.reserve(estimate, timeout):
+            yield
+    except MemoryBudgetExceeded:
+        gateway_log.info(
+            "upload rejected", reason="image_too_large",
+            width=frame.width, height=frame.height, estimate_bytes=estimate,
+        )
+        raise PublishError(
+            status_code=413,
+            detail=f"Rejected: a {frame.width}×{frame.height} image is too large to process.",
+            reason="image_too_large",
+        )
+    except MemoryBudgetTimeout:
+        raise PublishError(
+            status_code=503,
+            detail="Gateway is busy: not enough memory to process this image now, retry shortly.",
+            reason="memory_busy",
+            headers={"Retry-After": str(max(1, round(MEMORY_WAIT / 2)))},
+        )
+
+
+def _published_response(signed_data: bytes, cache: str | None = None) -> Response:
+    headers = {"Content-Disposition": 'attachment; filename="kibala_published.jpg"'}
+    if cache is not None:
+        headers["X-Kibala-Cache"] = cache
+    return Response(content=signed_data, media_type="image/jpeg", headers=headers)
+
+
+# EXIF orientation → Pillow transpose that makes the image upright
+# (the re-encode counterpart of jpeg_markers.ORIENTATION_TRANSFORMS).
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def _publish_pipeline(
+    content: bytes,
+    manifest_json: str,
+    submitted_at: float | None = None,
+    signer: Signer | None = None,
+    known_signer: bool = False,
+) -> tuple[bytes, dict[str, float]]:
+    """Validate → Strip → Re-sign one upload; runs inside a publish worker.
+
+    The upload is already in memory, so every stage works on streams: the
+    c2pa Reader, Pillow and the Builder's stream-based sign() never touch
+    the filesystem unless KIBALA_PUBLISH_IN_MEMORY=0.
+
+    Returns (re-signed JPEG bytes, seconds per stage) or raises
+    PublishError on rejection.  `submitted_at` is the time.time() at which
+    the job was handed to the pool, to report how long it waited;
+    `signer` is what signer_of() found in the upload, and `known_signer`
+    skips the trust-anchor check for a signer the validation cache already
+    trusts.  Either way the certificate c2pa verified must be that signer's.
+    """
+    timer = StageTimer()
+    if submitted_at is not None:
+        timer.timings["pool_wait"] = max(0.0, time.time() - submitted_at)
+
+    with _scratch_buffer() as clean, _scratch_buffer() as output:
         # ── 2. Validate C2PA manifest against our Root CA ──
+        #
+        # A signer that already passed the trust check skips the
+        # certificate chain validation; everything else is verified.
         try:
-            with open(input_path, "rb") as f:
-                with c2pa.Reader("image/jpeg", f) as reader:
-                    manifest_json_str = reader.json()
-                    manifest_store = json.loads(manifest_json_str)
+            with timer.stage("validate"):
+                with c2pa.Reader(
+                    "image/jpeg", io.BytesIO(content),
+                    context=_known_signer_context() if known_signer else None,
+                ) as reader:
+                    report = reader.json()
         except Exception as e:
-            raise HTTPException(
+            raise PublishError(
                 status_code=400,
                 detail=f"Cannot read C2PA manifest from uploaded image: {e}",
+                reason="unreadable_manifest",
             )
+        summary = _summarize_verified(report, signer)
 
         # 2a. Must contain at least one manifest
-        if "manifests" not in manifest_store or not manifest_store["manifests"]:
-            raise HTTPException(
+        if not summary.has_manifests:
+            raise PublishError(
                 status_code=400,
                 detail="Rejected: no C2PA manifests found in the uploaded image.",
+                reason="no_manifest",
             )
 
         # 2b. Must pass trust-anchor validation (our Root CA).
         #     If the c2pa library finds validation errors, it includes a
         #     "validation_status" array in the JSON. Its absence means valid.
-        if "validation_status" in manifest_store:
-            errors = manifest_store["validation_status"]
-            print(f"❌ Validation failed: {json.dumps(errors, indent=2)}")
-            raise HTTPException(
+        #     Only these top-level fields are decoded (manifest_report.py).
+        if summary.validation_status is not None:
+            errors = summary.validation_status
+            gateway_log.info("upload rejected", reason="validation_failed", validation_status=errors)
+            raise PublishError(
                 status_code=403,
                 detail=f"Rejected: C2PA validation failed — {errors}",
+                reason="validation_failed",
             )
 
-        active_id = manifest_store.get("active_manifest", "unknown")
-        print(f"✅ C2PA manifest validated against Root CA (active: {active_id})")
+        active_id = summary.active_manifest or "unknown"
+        gateway_log.info(
+            "manifest validated", active_manifest=active_id, known_signer=known_signer, sample=True,
+        )
 
         # ── 3. Strip ALL metadata (anonymize) ──
         #
-        # Pillow decodes the pixel data and re-encodes without any metadata:
+        # The JPEG marker stream is rewritten segment by segment, dropping:
         # - EXIF (camera model, serial number, GPS coordinates)
         # - XMP (editing history, author info)
         # - JUMBF/C2PA (the device's manifest & signature)
         # - IPTC (caption, keywords, photographer name)
+        # - comments, vendor APPn segments and data trailing the image
         #
-        # ICC profile is preserved for correct color rendering.
-        img = Image.open(input_path)
-        icc_profile = img.info.get("icc_profile")
+        # ICC profile is preserved for correct color rendering, and the
+        # compressed image data is copied byte-for-byte: no pixel decode,
+        # no re-encode, no generation loss.
+        try:
+            with timer.stage("strip"):
+                stripped, orientation = strip_metadata(content)
+        except JpegError as e:
+            raise PublishError(
+                status_code=400,
+                detail=f"Rejected: malformed JPEG — {e}",
+                reason="malformed_jpeg",
+            )
 
-        # Bake the EXIF Orientation tag into the actual pixel data BEFORE
-        # stripping metadata.  Without this, removing EXIF loses the
-        # orientation hint and the output appears rotated.
-        img = ImageOps.exif_transpose(img)
+        # Bake the EXIF Orientation tag into the image itself, since the
+        # tag is gone after stripping.  Without this the output appears
+        # rotated.  jpegtran rotates/flips the DCT coefficients directly,
+        # which is lossless; Pillow's decode + re-encode is the fallback
+        # when jpegtran is missing or the image has partial MCU edges.
+        # The fallback decodes the stripped image, never the upload, so
+        # nothing Pillow carries over on save (a COM segment, say) can
+        # bring metadata back.
+        if orientation != 1 and JPEGTRAN:
+            try:
+                with timer.stage("orient_lossless"):
+                    oriented = lossless_orient(
+                        stripped, orientation, JPEGTRAN, trim=ORIENT_TRIM_EDGES,
+                    )
+            except JpegError as e:
+                gateway_log.warning("lossless orientation failed, re-encoding", error=str(e))
+                oriented = None
+            if oriented is not None:
+                stripped, orientation = oriented, 1
 
-        clean_path = os.path.join(temp_dir, "clean.jpg")
-        save_kwargs = {"format": "JPEG", "quality": 100}
-        if icc_profile:
-            save_kwargs["icc_profile"] = icc_profile
-        img.save(clean_path, **save_kwargs)
-        img.close()
+        if orientation == 1:
+            source = io.BytesIO(stripped)
+        else:
+            _reencode_upright(stripped, orientation, clean, timer)
+            source = clean
 
-        clean_size = os.path.getsize(clean_path)
-        print(f"🧹 Metadata stripped: {clean_size:,} bytes (clean JPEG)")
+        clean_size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+        gateway_log.info("metadata stripped", bytes=clean_size, sample=True)
 
         # ── 4. Sign clean image with fresh gateway manifest ──
-        timestamp = datetime.datetime.now(datetime.UTC).isoformat() + "Z"
-        gateway_manifest = {
-            "claim_generator": "imanmontajabi.com/1.0",
-            "claim_generator_info": [
-                {"name": "imanmontajabi.com", "version": "1.0"}
-            ],
-            "title": "imanmontajabi.com",
-            "assertions": [
-                {
-                    "label": "c2pa.actions",
-                    "data": {
-                        "actions": [
-                            {
-                                "action": "c2pa.published",
-                                "softwareAgent": "imanmontajabi.com/1.0",
-                                "when": timestamp,
-                            }
-                        ]
-                    },
-                },
-                {
-                    "label": "stds.schema-org.CreativeWork",
-                    "data": {
-                        "@context": "http://schema.org",
-                        "@type": "CreativeWork",
-                        "author": [
-                            {
-                                "@type": "Organization",
-                                "name": "imanmontajabi.com",
-                            }
-                        ],
-                    },
-                },
-            ],
-        }
-
         # No ingredients added — the original device manifest is NOT
         # carried forward.  The output will contain ONLY the gateway's
         # signature, effectively anonymizing the photographer.
-        output_path = os.path.join(temp_dir, "published.jpg")
-
-        with c2pa.Signer.from_callback(
-            callback=gateway_sign_callback,
-            alg=c2pa.C2paSigningAlg.ES256,
-            certs=gateway_chain_pem,
-        ) as signer:
-            with c2pa.Builder(gateway_manifest) as builder:
-                builder.sign_file(
-                    source_path=clean_path,
-                    dest_path=output_path,
-                    signer=signer,
-                )
-
-        # ── 5. Return re-signed image ──
-        with open(output_path, "rb") as f:
-            signed_data = f.read()
-
-        print(f"✅ Gateway published: {len(signed_data):,} bytes (only gateway signature)")
-
-        return Response(
-            content=signed_data,
-            media_type="image/jpeg",
-            headers={
-                "Content-Disposition": 'attachment; filename="kibala_published.jpg"',
-            },
-        )
+        with timer.stage("sign"), c2pa.Builder(manifest_json) as builder:
+            builder.sign(gateway_signer(), "image/jpeg", source, output)
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"❌ Gateway error: {e}")
-        raise HTTPException(status_code=500, detail=str(e)) from e
-    finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        # ── 5. Collect re-signed image ──
+        output.seek(0)
+        signed_data = output.read()
+
+        gateway_log.info("photo published", bytes=len(signed_data), sample=True)
+        return signed_data, timer.timings
+
+
+def _reencode_upright(stripped: bytes, orientation: int, out, timer: StageTimer) -> None:
+    """Write the stripped JPEG to `out` with `orientation` applied, by
+    decode and re-encode.  Only the ICC profile is carried over."""
+    with timer.stage("exif_transpose"):
+        with Image.open(io.BytesIO(stripped)) as decoded:
+            icc_profile = decoded.info.get("icc_profile")
+            img = decoded.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+    save_kwargs = {"format": "JPEG", "quality": 100, "comment": b""}
+    if icc_profile:
+        save_kwargs["icc_profile"] = icc_profile
+    with timer.stage("encode"):
+        img.save(out, **save_kwargs)
+    img.close()
+
+
+def _scratch_buffer():
+    """Stream for an intermediate image: memory, or an unnamed temp file."""
+    if PUBLISH_IN_MEMORY:
+        return io.BytesIO()
+    return tempfile.TemporaryFile(prefix="kibala_gw_")
+
+
+# --- Metrics ---
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint (see metrics.py for what is exported)."""
+    _observe_cache_sizes()
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
+def _observe_cache_sizes() -> None:
+    stats = publish_cache.stats()
+    for tier in ("memory", "disk"):
+        CACHE_ENTRIES.labels("publish", tier).set(stats[f"{tier}_entries"])
+        CACHE_BYTES.labels("publish", tier).set(stats[f"{tier}_bytes"])
+    stats = validation_cache.stats()
+    for kind in ("signatures", "certificates"):
+        CACHE_ENTRIES.labels("validation", kind).set(stats[kind])
 
 
 if __name__ == "__main__":
+    import argparse
+    import sys
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    parser = argparse.ArgumentParser(description="Kibala C2PA CA & Gateway Server")
+    parser.add_argument("--host", default=HOST, help=f"bind address (default {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"port (default {PORT})")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help=f"server processes (default {SERVER_WORKERS})")
+    args = parser.parse_args()
+
+    # Fail here, once, rather than in every worker; this also issues the
+    # gateway pair before the workers start, so they all just load it.
+    try:
+        load_key_material()
+    except RootCANotFound as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.workers > 1:
+        # Workers import the app by name and load the key material from
+        # CERT_DIR themselves; metrics are shared through a directory so
+        # /metrics reports all of them whichever worker is scraped.
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="kibala_metrics_"))
+        # Per-worker shares (the memory budget) are sized from this.
+        os.environ["KIBALA_WORKERS"] = str(args.workers)
+        print(f"🚀 Starting {args.workers} server workers")
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,144 @@
+"""
+Streaming multipart/form-data ingestion for the Kibala privacy gateway.
+=======================================================================
+
+FastAPI's UploadFile only reaches the endpoint after the whole body has
+been received and spooled.  StreamingUpload instead parses the multipart
+body chunk by chunk as it arrives and feeds the photo's bytes straight
+into a JpegHeaderScanner, so the gateway can look at the JPEG header
+segments (and reject the upload) while the rest is still in flight.
+"""
+
+from collections.abc import Collection
+
+from jpeg_markers import JpegHeaderScanner
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+
+class UploadError(Exception):
+    """The request body is not an acceptable upload."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StreamingUpload:
+    """
+    Incremental parser for a multipart body carrying one photo.
+
+    The part named `file_field` is collected into `file_data` and fed to
+    `scanner`; the parts named in `text_fields` are kept as small text
+    fields in `fields`.  Other text parts are skipped; a file sent under
+    any other name is refused with 422.
+    """
+
+    MAX_FIELD_BYTES = 1024
+
+    def __init__(
+        self,
+        content_type: str,
+        file_field: str,
+        max_bytes: int,
+        text_fields: Collection[str] = (),
+    ):
+        media_type, params = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError(415, "Expected a multipart/form-data upload.")
+
+        self.file_field = file_field
+        self.text_fields = frozenset(text_fields)
+        self.max_bytes = max_bytes
+        self.fields: dict[str, str] = {}
+        self.filename: str | None = None
+        self.file_data = bytearray()
+        self.scanner = JpegHeaderScanner()
+        self.received = 0
+
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._part_name: str | None = None
+        self._part_is_file = False
+        self._part_is_text = False
+        self._part_value = bytearray()
+        self._file_seen = False
+        self._parser = multipart.MultipartParser(
+            params[b"boundary"],
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def write(self, chunk: bytes) -> None:
+        """Parse the next piece of the request body."""
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            raise UploadError(413, f"Upload exceeds {self.max_bytes:,} bytes.")
+        self._parser.write(chunk)
+
+    def finish(self) -> bytes:
+        """Complete parsing and return the photo bytes."""
+        self._parser.finalize()
+        if not self._file_seen:
+            raise UploadError(422, f"Missing form field: {self.file_field!r}")
+        return bytes(self.file_data)
+
+    # --- parser callbacks ---
+
+    def _on_part_begin(self) -> None:
+        self._part_name = None
+        self._part_is_file = False
+        self._part_is_text = False
+        self._part_value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if bytes(self._header_field).lower() == b"content-disposition":
+            _, params = parse_options_header(bytes(self._header_value))
+            self._part_name = params.get(b"name", b"").decode("utf-8", "replace")
+            filename = params.get(b"filename")
+            if self._part_name == self.file_field:
+                self._part_is_file = True
+                self._file_seen = True
+                self.filename = filename.decode("utf-8", "replace") if filename else None
+            elif filename is not None:
+                raise UploadError(
+                    422,
+                    f"Unexpected file in form field {self._part_name!r}; "
+                    f"send the photo as {self.file_field!r}.",
+                )
+            else:
+                self._part_is_text = self._part_name in self.text_fields
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._part_is_file:
+            chunk = data[start:end]
+            self.file_data += chunk
+            self.scanner.feed(chunk)
+        elif self._part_is_text:
+            self._part_value += data[start:end]
+            if len(self._part_value) > self.MAX_FIELD_BYTES:
+                raise UploadError(413, f"Form field {self._part_name!r} is too large.")
+
+    def _on_part_end(self) -> None:
+        if self._part_is_text:
+            self.fields[self._part_name] = self._part_value.decode("utf-8", "replace")
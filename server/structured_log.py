@@ -0,0 +1,174 @@
+"""
+Structured, non-blocking logging for the Kibala server.
+=======================================================
+
+Request handlers only put log records on an in-memory queue; a background
+QueueListener thread formats them as one JSON object per line and writes
+them to stdout.  A slow stdout consumer therefore backs up the queue, not
+the event loop.
+
+  log = get_logger("gateway")
+  log.info("photo published", bytes=len(data), sample=True)
+
+Keyword arguments become fields of the JSON record.  sample=True marks a
+high-volume success line: only a KIBALA_LOG_SAMPLE_RATE fraction of those
+is kept.  Warnings and errors are never sampled.
+
+Every record carries the id of the HTTP request it was logged for, taken
+from the client's X-Request-ID header or generated by RequestIdMiddleware
+(and echoed back in the response).
+"""
+
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import uuid
+
+LOGGER_NAME = "kibala"
+REQUEST_ID_HEADER = b"x-request-id"
+
+request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "kibala_request_id", default=None
+)
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class EventLogger(logging.LoggerAdapter):
+    """Logger whose keyword arguments become structured fields."""
+
+    _LOGGING_KWARGS = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in self._LOGGING_KWARGS}
+        sample = fields.pop("sample", False)
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields, "sample": sample}
+        return msg, kwargs
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(logging.getLogger(f"{LOGGER_NAME}.{name}"), {})
+
+
+class _ContextFilter(logging.Filter):
+    """Runs in the calling thread: stamps the request id, drops sampled-out lines."""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (
+            getattr(record, "sample", False)
+            and record.levelno < logging.WARNING
+            and random.random() >= self.sample_rate
+        ):
+            return False
+        record.request_id = request_id.get()
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    The stock prepare() renders the message (and traceback) in the
+    calling thread; records never leave this process, so they can be
+    queued as they are.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.UTC).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            entry["request_id"] = rid
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = "INFO", sample_rate: float = 1.0, stream=None) -> None:
+    """Route the "kibala" loggers through a queue to a JSON stdout writer.
+
+    Safe to call again, e.g. in a forked worker process whose copy of the
+    listener thread did not survive the fork.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(records)
+    handler.addFilter(_ContextFilter(sample_rate))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+
+@atexit.register
+def _flush() -> None:
+    """Drain whatever is still queued when the interpreter exits."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """ASGI middleware: bind a request id for logging and echo it back."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                value = value.decode("latin-1").strip()
+                if value and len(value) <= 128 and value.isprintable():
+                    rid = value
+                break
+        rid = rid or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []), (REQUEST_ID_HEADER, rid.encode("latin-1")),
+                ]
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id.reset(token)
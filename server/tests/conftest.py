@@ -0,0 +1,6 @@
+"""The server modules import each other by bare name, as when server.py runs."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, QueueFull
+
+
+async def _hold(admission: AdmissionController, release: asyncio.Event, patient: bool = False):
+    async with admission.admit(patient=patient):
+        await release.wait()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_patient_waiters_leave_room_for_singles():
+    async def main():
+        admission = AdmissionController(max_in_flight=1, max_queued=4, queue_timeout=None)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_hold(admission, release))]
+        await _settle()
+        # A batch far larger than the queue only takes its share of it.
+        tasks += [asyncio.create_task(_hold(admission, release, patient=True)) for _ in range(10)]
+        await _settle()
+        assert admission.patient_waiting == admission.max_patient_queued == 2
+        assert not admission.queue_full
+
+        tasks += [asyncio.create_task(_hold(admission, release)) for _ in range(2)]
+        await _settle()
+        assert admission.waiting == 4
+        with pytest.raises(QueueFull):
+            async with admission.admit():
+                pass
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_patient_waiter_gets_a_slot_when_released():
+    async def main():
+        admission = AdmissionController(max_in_flight=1, max_queued=2, queue_timeout=None)
+        release = asyncio.Event()
+        first = asyncio.create_task(_hold(admission, release))
+        await _settle()
+        patient = asyncio.create_task(_hold(admission, release, patient=True))
+        await _settle()
+        assert admission.patient_waiting == 1
+        release.set()
+        await asyncio.wait_for(asyncio.gather(first, patient), 1)
+        assert admission.in_flight == 0
+        assert admission.patient_waiting == 0
+
+    asyncio.run(main())
@@ -0,0 +1,304 @@
+import io
+import random
+import shutil
+
+import pytest
+from PIL import Image, ImageOps
+
+from jpeg_markers import (
+    FrameHeader,
+    JpegError,
+    JpegHeaderScanner,
+    is_perfect_transform,
+    lossless_orient,
+    read_frame_header,
+    strip_metadata,
+)
+
+JPEGTRAN = shutil.which("jpegtran")
+ICC_PROFILE = b"\0\0\0\x18fake icc profile payload"
+
+
+# --- builders ---
+
+
+def segment(marker: int, payload: bytes) -> bytes:
+    return bytes((0xFF, marker)) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def exif(orientation: int) -> bytes:
+    tags = Image.Exif()
+    tags[0x0112] = orientation
+    tags[0x013B] = "Alice"  # Artist
+    return segment(0xE1, tags.tobytes())
+
+
+def icc(profile: bytes = ICC_PROFILE) -> bytes:
+    return segment(0xE2, b"ICC_PROFILE\x00\x01\x01" + profile)
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+def superbox(label: str, *children: bytes) -> bytes:
+    description = box(b"jumd", bytes(16) + b"\x03" + label.encode("utf-8") + b"\x00")
+    return box(b"jumb", description + b"".join(children))
+
+
+def app11(box_data: bytes, instance: int = 1, size: int = 40) -> list[bytes]:
+    """APP11 JUMBF segments carrying `box_data`, the box header repeated in
+    every continuation segment, as c2pa writes them."""
+    header, body = box_data[:8], box_data[8:]
+    chunks = [body[i:i + size] for i in range(0, len(body), size)]
+    return [
+        segment(0xEB, b"JP" + instance.to_bytes(2, "big") + z.to_bytes(4, "big") + header + chunk)
+        for z, chunk in enumerate(chunks, start=1)
+    ]
+
+
+MANIFEST_STORE = superbox("c2pa", superbox("urn:c2pa:active", box(b"cbor", bytes(100))))
+
+
+def plain(size=(64, 48), **save) -> bytes:
+    """A metadata-free JPEG (JFIF APP0, tables, one scan) with noisy pixels,
+    so the scan holds stuffed 0xFF00 bytes."""
+    rng = random.Random(0)
+    img = Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90, **save)
+    return out.getvalue()
+
+
+def with_segments(jpeg: bytes, *segments: bytes, trailer: bytes = b"") -> bytes:
+    return jpeg[:2] + b"".join(segments) + jpeg[2:] + trailer
+
+
+# --- strip_metadata ---
+
+
+def test_strip_keeps_image_data_byte_for_byte():
+    clean = plain()
+    assert b"\xff\x00" in clean
+    adobe = segment(0xEE, b"Adobe\x00\x64\x00\x00\x00\x00\x01")
+    dirty = with_segments(
+        clean,
+        exif(6),
+        segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta>GPS 1,2</x:xmpmeta>"),
+        *app11(MANIFEST_STORE),
+        segment(0xED, b"Photoshop 3.0\x008BIM caption"),
+        segment(0xFE, b"owner: Alice GPS 1,2"),
+        segment(0xE5, b"vendor maker notes"),
+        icc(),
+        adobe,
+        trailer=b"MPF secondary image \xff\xd8\xff\xd9",
+    )
+    stripped, orientation = strip_metadata(dirty)
+    assert orientation == 6
+    assert stripped == clean[:2] + icc() + adobe + clean[2:]
+
+
+def test_strip_of_a_clean_jpeg_is_identity():
+    clean = plain()
+    assert strip_metadata(clean) == (clean, 1)
+
+
+@pytest.mark.parametrize("dropped", [
+    exif(1),
+    segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>"),
+    segment(0xFE, b"owner: Alice"),
+    segment(0xE0, b"JFXX\x00thumbnail"),
+    segment(0xE2, b"MPF\x00secondary image index"),
+    *app11(MANIFEST_STORE),
+])
+def test_strip_drops_metadata_segment(dropped):
+    clean = plain()
+    stripped, _ = strip_metadata(with_segments(clean, dropped))
+    assert stripped == clean
+
+
+def test_strip_keeps_restart_markers():
+    clean = plain(restart_marker_blocks=1)
+    assert any(clean[i] == 0xFF and 0xD0 <= clean[i + 1] <= 0xD7 for i in range(len(clean) - 1))
+    stripped, _ = strip_metadata(with_segments(clean, exif(3)))
+    assert stripped == clean
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_strip_reads_orientation(orientation):
+    _, found = strip_metadata(with_segments(plain(), exif(orientation)))
+    assert found == orientation
+
+
+def test_strip_ignores_out_of_range_orientation():
+    _, found = strip_metadata(with_segments(plain(), exif(9)))
+    assert found == 1
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8",                                  # nothing after SOI
+    b"\xff\xd8\x00\x00",                          # not a marker
+    b"\xff\xd8\xff\xe1\x00",                      # truncated length
+    b"\xff\xd8\xff\xe1\x00\x01",                  # length below 2
+    b"\xff\xd8\xff\xe1\x01\x00Exif",              # segment overruns the file
+])
+def test_strip_rejects_malformed_input(data):
+    with pytest.raises(JpegError):
+        strip_metadata(data)
+
+
+def test_strip_rejects_truncated_scan():
+    clean = plain()
+    with pytest.raises(JpegError):
+        strip_metadata(clean[:-2])
+
+
+# --- read_frame_header / is_perfect_transform ---
+
+
+@pytest.mark.parametrize("save, mcu, progressive", [
+    ({"subsampling": 0}, (8, 8), False),
+    ({"subsampling": 1}, (16, 8), False),
+    ({"subsampling": 2}, (16, 16), False),
+    ({"subsampling": 2, "progressive": True}, (16, 16), True),
+])
+def test_read_frame_header(save, mcu, progressive):
+    frame = read_frame_header(with_segments(plain((70, 45), **save), exif(6)))
+    assert frame == FrameHeader(70, 45, 3, mcu[0], mcu[1], progressive)
+
+
+def test_read_frame_header_of_grayscale():
+    out = io.BytesIO()
+    Image.new("L", (33, 17)).save(out, "JPEG")
+    assert read_frame_header(out.getvalue()) == FrameHeader(33, 17, 1, 8, 8, False)
+
+
+@pytest.mark.parametrize("data", [
+    b"not a jpeg",
+    b"\xff\xd8\xff\xda\x00\x02",                  # scan before any SOF
+    b"\xff\xd8\xff\xc0\x00\x05\x08\x00",          # SOF too short
+    b"\xff\xd8\xff\xc0\x00\x08\x08\x00\x10\x00\x10\x03",  # too short for 3 components
+    b"\xff\xd8\xff\xe1\x01\x00Exif",              # segment overruns the file
+])
+def test_read_frame_header_rejects_malformed_input(data):
+    with pytest.raises(JpegError):
+        read_frame_header(data)
+
+
+@pytest.mark.parametrize("width, height, perfect", [
+    (64, 48, {1, 2, 3, 4, 5, 6, 7, 8}),
+    (70, 48, {1, 4, 5, 6}),           # partial right edge
+    (64, 45, {1, 2, 5, 8}),           # partial bottom edge
+    (70, 45, {1, 5}),
+])
+def test_is_perfect_transform(width, height, perfect):
+    frame = FrameHeader(width, height, 3, 16, 16, False)
+    assert {o for o in range(1, 9) if is_perfect_transform(frame, o)} == perfect
+
+
+# --- lossless_orient ---
+
+
+def test_lossless_orient_upright_is_a_no_op():
+    clean = plain()
+    assert lossless_orient(clean, 1, "/nonexistent/jpegtran") is clean
+
+
+def test_lossless_orient_rejects_invalid_orientation():
+    with pytest.raises(JpegError):
+        lossless_orient(plain(), 9, "/nonexistent/jpegtran")
+
+
+def test_lossless_orient_leaves_partial_edges_to_the_caller():
+    assert lossless_orient(plain((70, 45)), 6, "/nonexistent/jpegtran") is None
+
+
+def test_lossless_orient_reports_missing_jpegtran():
+    with pytest.raises(JpegError):
+        lossless_orient(plain((64, 48)), 6, "/nonexistent/jpegtran")
+
+
+@pytest.mark.skipif(JPEGTRAN is None, reason="jpegtran is not installed")
+@pytest.mark.parametrize("orientation", range(2, 9))
+def test_lossless_orient_matches_exif_transpose(orientation):
+    clean = with_segments(plain((64, 48), subsampling=2), icc())
+    upright = lossless_orient(clean, orientation, JPEGTRAN)
+    with Image.open(io.BytesIO(upright)) as img:
+        expected = ImageOps.exif_transpose(
+            Image.open(io.BytesIO(with_segments(clean, exif(orientation))))
+        )
+        assert img.size == expected.size
+        assert img.info["icc_profile"] == ICC_PROFILE
+
+
+@pytest.mark.skipif(JPEGTRAN is None, reason="jpegtran is not installed")
+def test_lossless_orient_trims_partial_edges():
+    upright = lossless_orient(plain((70, 45)), 6, JPEGTRAN, trim=True)
+    assert read_frame_header(upright)[:2] == (32, 70)
+
+
+# --- JpegHeaderScanner ---
+
+
+def scan(data: bytes, chunk: int = 1) -> JpegHeaderScanner:
+    scanner = JpegHeaderScanner()
+    for i in range(0, len(data), chunk):
+        if scanner.feed(data[i:i + chunk]):
+            break
+    return scanner
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 1 << 20])
+def test_scanner_reassembles_manifest_store(chunk):
+    segments = app11(MANIFEST_STORE)
+    assert len(segments) > 2
+    scanner = scan(with_segments(plain(), exif(6), *segments, icc()), chunk)
+    assert scanner.complete
+    assert scanner.has_c2pa
+    assert scanner.manifest_data() == MANIFEST_STORE
+
+
+def test_scanner_orders_segments_by_sequence_number():
+    segments = app11(MANIFEST_STORE)
+    scanner = scan(with_segments(plain(), *reversed(segments)))
+    assert scanner.has_c2pa
+    assert scanner.manifest_data() == MANIFEST_STORE
+
+
+def test_scanner_judges_the_first_sequence_not_the_first_arrival():
+    other = app11(superbox("not-c2pa", box(b"cbor", bytes(100))))
+    # a c2pa store's first segment, numbered 2, arrives before sequence 1
+    # of the same box instance, which is not a manifest store
+    first = app11(MANIFEST_STORE)[0]
+    misnumbered = first[:8] + (2).to_bytes(4, "big") + first[12:]
+    scanner = scan(with_segments(plain(), misnumbered, other[0]))
+    assert not scanner.has_c2pa
+    assert scanner.manifest_data() == b""
+
+
+def test_scanner_without_manifest_store():
+    scanner = scan(with_segments(plain(), *app11(superbox("other", bytes(10)))))
+    assert scanner.complete
+    assert not scanner.has_c2pa
+    assert scanner.manifest_data() == b""
+
+
+def test_scanner_stops_at_the_first_scan():
+    clean = plain()
+    scanner = JpegHeaderScanner()
+    sos = clean.index(b"\xff\xda")
+    assert not scanner.feed(clean[:sos])
+    assert scanner.feed(clean[sos:sos + 2])
+    assert scanner.feed(b"anything after the scan starts")
+
+
+@pytest.mark.parametrize("data", [
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\x00\x00",
+    b"\xff\xd8\xff\xe1\x00\x01",
+])
+def test_scanner_rejects_malformed_input(data):
+    with pytest.raises(JpegError):
+        scan(data)
@@ -0,0 +1,200 @@
+import datetime
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+
+from jumbf import active_signature_box, signer_certificate
+from validation_cache import certificate_fingerprint, signer_of
+
+CERT = b"end-entity certificate DER"
+CA_CERT = b"intermediate certificate DER"
+
+
+# --- JUMBF and CBOR builders ---
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+def superbox(label: str, *children: bytes) -> bytes:
+    description = box(b"jumd", bytes(16) + b"\x03" + label.encode("utf-8") + b"\x00")
+    return box(b"jumb", description + b"".join(children))
+
+
+class Tag:
+    def __init__(self, tag: int, value):
+        self.tag = tag
+        self.value = value
+
+
+class Pairs:
+    """A CBOR map with its keys in this exact order, duplicates allowed."""
+
+    def __init__(self, *pairs):
+        self.pairs = pairs
+
+
+def cbor(item) -> bytes:
+    def head(major: int, arg: int) -> bytes:
+        if arg < 24:
+            return bytes([major << 5 | arg])
+        for info, width in ((24, 1), (25, 2), (26, 4), (27, 8)):
+            if arg < 1 << (8 * width):
+                return bytes([major << 5 | info]) + arg.to_bytes(width, "big")
+        raise ValueError(arg)
+
+    if item is None:
+        return b"\xf6"
+    if isinstance(item, int):
+        return head(0, item) if item >= 0 else head(1, -1 - item)
+    if isinstance(item, bytes):
+        return head(2, len(item)) + item
+    if isinstance(item, str):
+        return head(3, len(item.encode("utf-8"))) + item.encode("utf-8")
+    if isinstance(item, list):
+        return head(4, len(item)) + b"".join(cbor(i) for i in item)
+    if isinstance(item, Tag):
+        return head(6, item.tag) + cbor(item.value)
+    pairs = item.pairs if isinstance(item, Pairs) else tuple(item.items())
+    return head(5, len(pairs)) + b"".join(cbor(k) + cbor(v) for k, v in pairs)
+
+
+def cose_sign1(protected=None, unprotected=None) -> bytes:
+    protected = cbor(protected if protected is not None else {1: -7})
+    return cbor(Tag(18, [protected, unprotected or {}, None, b"signature"]))
+
+
+def signature(*cbor_payloads: bytes) -> bytes:
+    return superbox("c2pa.signature", *(box(b"cbor", p) for p in cbor_payloads))
+
+
+def manifest(label: str, signature_box: bytes) -> bytes:
+    return superbox(label, superbox("c2pa.assertions"), superbox("c2pa.claim.v2"), signature_box)
+
+
+def store(*manifests: bytes) -> bytes:
+    return superbox("c2pa", *manifests)
+
+
+# --- signer_certificate ---
+
+
+@pytest.mark.parametrize(
+    "protected, unprotected",
+    [
+        ({1: -7, 33: [CERT, CA_CERT]}, {}),
+        ({1: -7}, {33: [CERT, CA_CERT]}),
+        ({1: -7}, {"x5chain": CERT}),
+    ],
+)
+def test_signer_certificate_reads_x5chain(protected, unprotected):
+    assert signer_certificate(signature(cose_sign1(protected, unprotected))) == CERT
+
+
+@pytest.mark.parametrize(
+    "protected, unprotected",
+    [
+        ({1: -7, 33: [CERT]}, {33: [CA_CERT]}),       # in both header buckets
+        ({1: -7, 33: [CERT], "x5chain": [CA_CERT]}, {}),  # under both labels
+        (Pairs((1, -7), (33, [CERT]), (33, [CA_CERT])), {}),  # duplicated map key
+        ({1: -7}, Pairs((33, [CERT]), (33, [CA_CERT]))),
+    ],
+)
+def test_signer_certificate_refuses_duplicate_x5chain(protected, unprotected):
+    assert signer_certificate(signature(cose_sign1(protected, unprotected))) is None
+
+
+def test_signer_certificate_refuses_several_cbor_boxes():
+    first = cose_sign1({1: -7, 33: [CERT]})
+    second = cose_sign1({1: -7, 33: [CA_CERT]})
+    assert signer_certificate(signature(first, second)) is None
+    assert signer_certificate(signature()) is None
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"\x9f\x01\xff",  # indefinite-length array
+        cbor(Tag(18, [cbor({1: -7, 33: [CERT]})]))[:-3],  # truncated
+        cbor(Tag(18, [b"\x58\xff", {}, None, b""])),  # protected header runs past its end
+        cbor(Tag(18, "not a COSE structure")),
+        cbor({1: -7}),
+    ],
+)
+def test_signer_certificate_refuses_malformed_cbor(payload):
+    assert signer_certificate(signature(payload)) is None
+
+
+# --- active_signature_box ---
+
+
+def test_active_signature_is_the_last_manifest():
+    older = signature(cose_sign1({1: -7, 33: [CA_CERT]}))
+    active = signature(cose_sign1({1: -7, 33: [CERT]}))
+    data = store(manifest("urn:c2pa:older", older), manifest("urn:c2pa:active", active))
+    assert active_signature_box(data) == active
+    assert signer_certificate(active_signature_box(data)) == CERT
+
+
+def test_signature_of_a_non_active_manifest_is_ignored():
+    older = signature(cose_sign1({1: -7, 33: [CA_CERT]}))
+    unsigned = superbox("urn:c2pa:active", superbox("c2pa.assertions"), superbox("c2pa.claim.v2"))
+    assert active_signature_box(store(manifest("urn:c2pa:older", older), unsigned)) is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        store(),
+        superbox("not-c2pa", manifest("urn:c2pa:a", signature(cose_sign1()))),
+        store(manifest("urn:c2pa:a", signature(cose_sign1())))[:-4],  # truncated
+    ],
+)
+def test_active_signature_box_of_malformed_store(data):
+    assert active_signature_box(data) is None
+
+
+# --- signer_of ---
+
+
+def certificate(serial: int) -> bytes:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Kibala Device")])
+    now = datetime.datetime.now(datetime.UTC)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(serial)
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return cert.public_bytes(Encoding.DER)
+
+
+def test_signer_of_identifies_the_active_certificate():
+    der = certificate(1234567)
+    data = store(manifest("urn:c2pa:active", signature(cose_sign1({1: -7, 33: [der]}))))
+    signer = signer_of(data)
+    assert signer.serial == "1234567"
+    assert signer.fingerprint == certificate_fingerprint(der)
+    assert signer.not_valid_after is not None
+
+
+@pytest.mark.parametrize(
+    "protected",
+    [
+        {1: -7, 33: [b"not a certificate"]},
+        Pairs((1, -7), (33, [b"a"]), (33, [b"b"])),
+    ],
+)
+def test_signer_of_unreadable_certificate_has_no_serial(protected):
+    data = store(manifest("urn:c2pa:active", signature(cose_sign1(protected))))
+    signer = signer_of(data)
+    assert signer is not None
+    assert signer.serial is None and signer.fingerprint is None
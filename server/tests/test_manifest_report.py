@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+import manifest_report
+from manifest_report import ManifestSummary, summarize, summarize_signed
+
+SIGNATURE_INFO = {
+    "alg": "Es256",
+    "common_name": "Kibala Device",
+    "cert_serial_number": "352483554050481285640796071477941066656208052584",
+}
+
+
+def store(validation_status=None, ingredients=0) -> dict:
+    active = {
+        "claim_generator_info": [{"name": "kibala", "version": "1.0"}],
+        "title": "photo.jpg",
+        "assertions": [{"label": "c2pa.actions.v2", "data": {"actions": [{"action": "c2pa.created"}]}}],
+        "signature_info": SIGNATURE_INFO,
+        "label": "urn:c2pa:active",
+    }
+    older = dict(active, label="urn:c2pa:older", signature_info={"cert_serial_number": "1"})
+    older["ingredients"] = [dict(active, title=f"i{i}") for i in range(ingredients)]
+    report = {
+        "active_manifest": "urn:c2pa:active",
+        "manifests": {"urn:c2pa:older": older, "urn:c2pa:active": active},
+    }
+    if validation_status is not None:
+        report["validation_status"] = validation_status
+    return report
+
+
+def pretty(report: dict) -> str:
+    # The layout c2pa-rs (serde_json's pretty printer) produces.
+    return json.dumps(report, indent=2, ensure_ascii=False)
+
+
+@pytest.fixture
+def no_full_parse(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("json.loads() called on the fast path")
+
+    monkeypatch.setattr(manifest_report.json, "loads", fail)
+
+
+def test_fast_path_reads_the_decision_fields(no_full_parse):
+    report = pretty(store())
+    assert summarize(report) == ManifestSummary(True, "urn:c2pa:active", None)
+
+
+def test_fast_path_reads_the_active_signature_info(no_full_parse):
+    summary, signature_info = summarize_signed(pretty(store(ingredients=3)))
+    assert summary == ManifestSummary(True, "urn:c2pa:active", None)
+    assert signature_info == SIGNATURE_INFO
+
+
+def test_fast_path_reports_validation_failures(no_full_parse):
+    status = [{"code": "assertion.dataHash.mismatch", "url": "self#jumbf=x"}]
+    summary, _ = summarize_signed(pretty(store(validation_status=status)))
+    assert summary.validation_status == status
+
+
+def test_fast_path_without_manifests(no_full_parse):
+    assert summarize('{\n  "manifests": {}\n}') == ManifestSummary(False, None, None)
+
+
+def test_missing_signature_info_is_empty(no_full_parse):
+    report = store()
+    del report["manifests"]["urn:c2pa:active"]["signature_info"]
+    assert summarize_signed(pretty(report))[1] == {}
+
+
+@pytest.mark.parametrize(
+    "report",
+    [
+        json.dumps(store()),  # compact
+        json.dumps(store(), indent=4),
+        pretty(store()).replace('"manifests": {', '"manifests":  {', 1),
+        pretty(store()).replace('\n  "manifests"', '\n\t"manifests"', 1),
+        pretty({"active_manifest": "urn:c2pa:active"}),  # no "manifests"
+    ],
+)
+def test_unexpected_layout_falls_back_to_a_full_parse(report, monkeypatch):
+    calls = []
+    loads = json.loads
+    monkeypatch.setattr(manifest_report.json, "loads", lambda s: calls.append(s) or loads(s))
+    expected = loads(report)
+    summary, signature_info = summarize_signed(report)
+    assert calls == [report]
+    assert summary.active_manifest == expected.get("active_manifest")
+    assert summary.has_manifests == bool(expected.get("manifests"))
+    assert signature_info == (SIGNATURE_INFO if expected.get("manifests") else {})
+
+
+def test_ambiguous_active_manifest_falls_back(monkeypatch):
+    # The active manifest's key appears twice: only a full parse decides.
+    report = pretty(store()).replace('"urn:c2pa:older": {', '"urn:c2pa:active": {', 1)
+    calls = []
+    loads = json.loads
+    monkeypatch.setattr(manifest_report.json, "loads", lambda s: calls.append(s) or loads(s))
+    assert summarize_signed(report)[1] == SIGNATURE_INFO  # last key wins, as in json.loads
+    assert calls == [report]
+
+
+@pytest.mark.parametrize(
+    "report",
+    [
+        pretty(store())[:-2],  # truncated
+        pretty(store()).replace('"active_manifest": "urn:c2pa:active",', '"active_manifest": "urn:c2pa:active"', 1),
+        '{\n  "manifests": {\n  "x": }\n}',
+        "",
+    ],
+)
+def test_invalid_json_fails_closed(report):
+    with pytest.raises(ValueError):
+        summarize(report)
+    with pytest.raises(ValueError):
+        summarize_signed(report)
@@ -0,0 +1,60 @@
+import io
+
+import pytest
+from PIL import Image, ImageOps
+
+import server
+from jpeg_markers import strip_metadata
+from metrics import StageTimer
+
+ICC_PROFILE = b"\0\0\0\x18fake icc profile payload"
+COMMENT = b"owner: Alice GPS 1,2"
+
+
+def photo(orientation: int) -> bytes:
+    img = Image.new("RGB", (40, 24), (200, 30, 30))
+    img.paste((30, 30, 200), (0, 0, 8, 8))  # marks the top-left corner
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x013B] = "Alice"  # Artist
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=95, exif=exif, comment=COMMENT, icc_profile=ICC_PROFILE)
+    return out.getvalue()
+
+
+def reencode(content: bytes) -> tuple[bytes, int]:
+    stripped, orientation = strip_metadata(content)
+    out = io.BytesIO()
+    server._reencode_upright(stripped, orientation, out, StageTimer())
+    return out.getvalue(), orientation
+
+
+@pytest.mark.parametrize("orientation", range(2, 9))
+def test_fallback_drops_comment_and_exif(orientation):
+    content = photo(orientation)
+    assert COMMENT in content
+
+    data, found = reencode(content)
+    assert found == orientation
+    assert COMMENT not in data and b"Alice" not in data
+    with Image.open(io.BytesIO(data)) as img:
+        assert "comment" not in img.info
+        assert "exif" not in img.info
+        assert img.info["icc_profile"] == ICC_PROFILE
+
+
+@pytest.mark.parametrize("orientation", range(2, 9))
+def test_fallback_matches_exif_transpose(orientation):
+    content = photo(orientation)
+    data, _ = reencode(content)
+    with Image.open(io.BytesIO(content)) as original, Image.open(io.BytesIO(data)) as upright:
+        expected = ImageOps.exif_transpose(original)
+        assert upright.size == expected.size
+        corner = [
+            (x, y)
+            for x in (0, expected.width - 1)
+            for y in (0, expected.height - 1)
+            if expected.getpixel((x, y))[2] > 150
+        ]
+        assert len(corner) == 1
+        assert upright.getpixel(corner[0])[2] > 150
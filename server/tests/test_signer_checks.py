@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from server import PublishError, _known_signer, _summarize_verified
+from validation_cache import Signer, ValidationCache
+
+SERIAL = "352483554050481285640796071477941066656208052584"
+SIGNER = Signer("signature-key", "fingerprint", SERIAL, None)
+
+
+def report(serial: str | None = SERIAL, manifests: bool = True) -> str:
+    store = {"active_manifest": "urn:c2pa:active", "manifests": {}}
+    if manifests:
+        active = {"label": "urn:c2pa:active", "title": "photo.jpg"}
+        if serial is not None:
+            active["signature_info"] = {"alg": "Es256", "cert_serial_number": serial}
+        store["manifests"]["urn:c2pa:active"] = active
+    return json.dumps(store, indent=2)
+
+
+def test_verified_certificate_matches_signer():
+    summary = _summarize_verified(report(), SIGNER)
+    assert summary.has_manifests and summary.active_manifest == "urn:c2pa:active"
+
+
+@pytest.mark.parametrize(
+    "verified_serial, signer",
+    [
+        ("1", SIGNER),                               # c2pa verified another certificate
+        (None, SIGNER),                              # c2pa names no certificate
+        (SERIAL, Signer("signature-key", None, None, None)),  # ours was unreadable
+        (SERIAL, None),                              # no signature found at all
+    ],
+)
+def test_signer_mismatch_is_rejected(verified_serial, signer):
+    with pytest.raises(PublishError) as e:
+        _summarize_verified(report(verified_serial), signer)
+    assert e.value.status_code == 403
+    assert e.value.reason == "signer_mismatch"
+
+
+def test_report_without_manifests_needs_no_signer():
+    summary = _summarize_verified(report(manifests=False), None)
+    assert not summary.has_manifests
+
+
+def test_unreadable_report_is_rejected():
+    with pytest.raises(PublishError) as e:
+        _summarize_verified("{not json", SIGNER)
+    assert e.value.reason == "unreadable_manifest"
+
+
+def test_signer_without_serial_is_never_known(monkeypatch):
+    signer = Signer("signature-key", None, None, None)
+    cache = ValidationCache(max_entries=16, ttl=60)
+    cache.put(signer, [])
+    assert cache.get(signer) == []
+    monkeypatch.setattr(server, "validation_cache", cache)
+
+    assert asyncio.run(_known_signer(signer)) is False
+    assert asyncio.run(_known_signer(None)) is False
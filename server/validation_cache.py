@@ -0,0 +1,183 @@
+"""
+Trust-validation cache for the Kibala privacy gateway.
+======================================================
+
+Checking a device manifest's signing certificate against the Root CA is
+the same work every time the same signer comes back.  Two kinds of
+outcomes are cached, both in the server process (the publish pipeline
+only gets told whether the signer is already trusted):
+
+  claim signatures     SHA-256 of the active manifest's c2pa.signature
+                       box (see jumbf.py) -> the trust failures the c2pa
+                       library reported, [] for a trusted signer.  Covers
+                       retried uploads and re-embedded manifests, and
+                       turns known-bad signers away without a Reader.
+  device certificates  SHA-256 of the signer's end-entity certificate
+                       DER -> verified, until the certificate's
+                       not_valid_after.  One device posts many photos,
+                       each with its own claim signature but the same
+                       certificate, so this is the common hit.
+
+A trusted signer is validated with a c2pa context that skips the
+trust-anchor check; the claim signature and the content hash bindings
+are still verified against the uploaded bytes, so a tampered image is
+rejected as before, and the certificate c2pa verified the signature with
+must be the one signer_of() found, or the upload is rejected.
+
+Entries are bounded in number, expire (signatures after `ttl` seconds,
+certificates at not_valid_after), are dropped together when their
+certificate is revoked (forget_certificate()), and everything is dropped
+when the trust anchors change.
+
+Counters (hits and misses per kind, evictions) are exported as
+kibala_cache_events_total{cache="validation"}; stats() also reports the
+entries held per kind, which /metrics exports as gauges.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+from typing import NamedTuple
+
+from cryptography import x509
+
+from jumbf import active_signature_box, signer_certificate
+from metrics import CACHE_EVENTS
+
+
+class Signer(NamedTuple):
+    key: str  # claim signature hash
+    fingerprint: str | None  # SHA-256 of the end-entity certificate DER
+    serial: str | None
+    not_valid_after: float | None  # POSIX time
+
+
+def signer_of(manifest_store: bytes) -> Signer | None:
+    """Identify the active manifest's claim signature and signing certificate."""
+    signature = active_signature_box(manifest_store)
+    if signature is None:
+        return None
+    key = hashlib.sha256(signature).hexdigest()
+    der = signer_certificate(signature)
+    if der is None:
+        return Signer(key, None, None, None)
+    try:
+        certificate = x509.load_der_x509_certificate(der)
+    except ValueError:
+        return Signer(key, None, None, None)
+    return Signer(
+        key,
+        certificate_fingerprint(der),
+        str(certificate.serial_number),
+        certificate.not_valid_after_utc.timestamp(),
+    )
+
+
+def certificate_fingerprint(der: bytes) -> str:
+    return hashlib.sha256(der).hexdigest()
+
+
+class ValidationCache:
+    """Bounded LRUs of trust outcomes per claim signature and per device certificate."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # signature key -> (expires_at, trust failures, certificate fingerprint)
+        self._signatures: collections.OrderedDict[str, tuple[float, list, str | None]] = (
+            collections.OrderedDict()
+        )
+        # certificate fingerprint -> expires_at (its not_valid_after)
+        self._certificates: collections.OrderedDict[str, float] = collections.OrderedDict()
+        self._anchors: str | None = None
+        self._counters = collections.Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def set_trust_anchors(self, anchors_pem: str) -> None:
+        """Record the trust anchors in use; a change invalidates every entry."""
+        with self._lock:
+            if anchors_pem != self._anchors:
+                self._signatures.clear()
+                self._certificates.clear()
+                self._anchors = anchors_pem
+
+    # --- claim signatures ---
+
+    def get(self, signer: Signer | None) -> list | None:
+        """The cached trust failures ([] = trusted), or None on a miss."""
+        if signer is None or not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._signatures.get(signer.key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._signatures[signer.key]
+                self._count("signature_misses")
+                return None
+            self._signatures.move_to_end(signer.key)
+            self._count("signature_hits")
+            return entry[1]
+
+    def put(self, signer: Signer | None, failures: list) -> None:
+        """Remember a trust outcome; a trusted signer's certificate is
+        remembered as verified too."""
+        if signer is None or not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        if signer.not_valid_after is not None:
+            expires_at = min(expires_at, signer.not_valid_after)
+        with self._lock:
+            self._store(self._signatures, signer.key, (expires_at, failures, signer.fingerprint))
+            if not failures and signer.fingerprint is not None:
+                self._store(self._certificates, signer.fingerprint, signer.not_valid_after)
+
+    # --- device certificates ---
+
+    def certificate_trusted(self, signer: Signer | None) -> bool:
+        """True when the signer's certificate chain has been verified and
+        the certificate has not expired since."""
+        if signer is None or signer.fingerprint is None or not self.enabled:
+            return False
+        now = time.time()
+        with self._lock:
+            expires_at = self._certificates.get(signer.fingerprint)
+            if expires_at is None or expires_at <= now:
+                if expires_at is not None:
+                    del self._certificates[signer.fingerprint]
+                self._count("certificate_misses")
+                return False
+            self._certificates.move_to_end(signer.fingerprint)
+            self._count("certificate_hits")
+            return True
+
+    def forget_certificate(self, fingerprint: str) -> None:
+        """Drop a (revoked) certificate and every claim signature made with it."""
+        with self._lock:
+            self._certificates.pop(fingerprint, None)
+            for key in [k for k, entry in self._signatures.items() if entry[2] == fingerprint]:
+                del self._signatures[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "signatures": len(self._signatures),
+                "certificates": len(self._certificates),
+                **self._counters,
+            }
+
+    def _count(self, event: str) -> None:
+        self._counters[event] += 1
+        CACHE_EVENTS.labels("validation", event).inc()
+
+    def _store(self, entries: collections.OrderedDict, key: str, value) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self._count("evictions")